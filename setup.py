@@ -35,7 +35,7 @@ setup(
 	author_email    = 'nya@catgirl.link',
 	description     = 'VAX soft-core and SoC',
 	license         = 'BSD-3-Clause',
-	python_requires = '>=3.8,<3.10',
+	python_requires = '>=3.9,<3.10',
 	zip_safe        = False,
 
 	setup_requires  = [
@@ -46,13 +46,18 @@ setup(
 
 	install_requires = [
 		'Jinja2',
+		'numpy',
 
-		'amaranth @ git+https://github.com/amaranth-lang/amaranth.git@master',
-		'amaranth-boards @ git+https://github.com/amaranth-lang/amaranth-soc.git@master',
+		'amaranth>=0.4,<0.5',
+		'amaranth-yosys>=0.38,<0.41',
+		'luna-soc>=0.2.5,<0.3',
 		'amaranth-stdio @ git+https://github.com/amaranth-lang/amaranth-stdio.git@master',
 	],
 
 	packages = find_packages(),
+	package_data = {
+		'vixen': [ 'opcodes.txt' ],
+	},
 
 	entry_points = {
 		'console_scripts': [
@@ -0,0 +1,120 @@
+from amaranth.sim import Settle, Simulator
+
+from vixen.decode import MAX_OPERANDS, VaxDecoder
+from vixen.util import Length
+
+REGISTERS = {2: 0x100, 3: 0x2000, 4: 0x30000, 5: 0x500}
+BUSY      = 1 << 5
+
+# Instructions at increasing addresses from 0, each with the addresses expected per operand:
+# (ea, read length) for an operand read from memory, (ea, None) for one that is only written,
+# and None for one left without an address.
+PROGRAM = [
+    # MOVL B^8(R2), R0
+    ("d0a20850", [(0x108, Length.LONG), None]),
+    # MOVW W^0x1234(R3), R1
+    ("b0c3341251", [(0x3234, Length.WORD), None]),
+    # MOVL L^0x12345678(R4), R0
+    ("d0e47856341250", [(0x12375678, Length.LONG), None]),
+    # MOVL B^5(PC), R0 at 16: the operand ends at 19
+    ("d0af0550", [(19 + 5, Length.LONG), None]),
+    # MOVL @#0x1000, R0
+    ("d09f0010000050", [(0x1000, Length.LONG), None]),
+    # MOVB B^1(R5), R0 with R5 busy
+    ("90a50150", [None, None]),
+    # MOVL (R2)+, B^4(R2): R2 is stale for the second operand, in the same window
+    ("d082a204", [None, None]),
+    # MOVL (R2)+, B^4(R3): but not R3
+    ("d082a304", [None, (0x2004, None)]),
+    # ADDL3 (R2)+, L^0x10(R3), B^4(R2): the third operand is past the decoders, so R2 is stale
+    # through i_modified in the next window
+    ("c182e310000000a204", [None, (0x2010, Length.LONG), None]),
+    # ADDL3 #1, R1, B^4(R2): a new instruction starts over
+    ("c10151a204", [None, None, (0x104, None)]),
+]
+
+
+def expected(program):
+    rows = []
+    addr = 0
+    for text, operands in program:
+        rows.append((addr, [operand and (operand[0], operand[1] is not None, operand[1]) for operand in operands]))
+        addr += len(text) // 2
+    return rows
+
+
+def run(decoder, image, passes=1):
+    # Feeds `image` to `decoder` `passes` times, redirecting back to 0 at its end, with a register
+    # file of REGISTERS and BUSY marked busy. Returns (pc, hit, [(ea, read, read length) or None
+    # per operand]) for each instruction handed out, with hit set when it came from the cache.
+    handed = []
+
+    def process():
+        yield decoder.i_ready.eq(1)
+        yield decoder.i_busy.eq(BUSY)
+        for _ in range(passes):
+            for _ in range(200):
+                addr = yield decoder.o_addr
+                if addr >= len(image):
+                    break
+                yield decoder.i_data.eq(int.from_bytes(image[addr:addr + decoder.width].ljust(decoder.width, b"\0"), "little"))
+                yield decoder.i_valid.eq(1)
+                yield Settle()
+                for n in range(MAX_OPERANDS):
+                    yield decoder.i_reg_data[n].eq(REGISTERS.get((yield decoder.o_reg[n]), 0))
+                yield Settle()
+                hit = yield decoder.o_hit
+                yield
+                yield Settle()
+                if (yield decoder.o_valid):
+                    operands = []
+                    for n in range(MAX_OPERANDS):
+                        if not (yield decoder.o_ea_valid[n]):
+                            operands.append(None)
+                            continue
+                        read = yield decoder.o_read[n]
+                        operands.append((
+                            (yield decoder.o_ea[n]), bool(read),
+                            Length((yield decoder.o_read_length[n])) if read else None,
+                        ))
+                    handed.append(((yield decoder.o_pc), hit, operands))
+            yield decoder.i_valid.eq(0)
+            yield decoder.i_redirect.eq(1)
+            yield decoder.i_target.eq(0)
+            yield
+            yield decoder.i_redirect.eq(0)
+            yield Settle()
+
+    sim = Simulator(decoder)
+    sim.add_clock(1e-6)
+    sim.add_sync_process(process)
+    sim.run()
+
+    return handed
+
+
+def check(results, program):
+    assert len(results) == len(program)
+    for (pc, _, operands), (addr, wanted) in zip(results, expected(program)):
+        assert pc == addr
+        assert operands[:len(wanted)] == wanted, f"instruction at {addr}"
+        assert operands[len(wanted):] == [None] * (MAX_OPERANDS - len(wanted)), f"instruction at {addr}"
+
+
+def test_addresses():
+    image = bytes.fromhex("".join(text for text, _ in PROGRAM))
+    check(run(VaxDecoder(width=12, agen=True), image), PROGRAM)
+
+
+def test_cache_hits():
+    # The second pass comes from the decoded-instruction cache, except for the first ADDL3, which
+    # is split over two windows and so never cached. Its addresses come from the stored specifiers and
+    # operand ends.
+    image   = bytes.fromhex("".join(text for text, _ in PROGRAM))
+    results = run(VaxDecoder(width=12, agen=True, cache_sets=64), image, passes=2)
+
+    first, second = results[:len(PROGRAM)], results[len(PROGRAM):]
+    check(first, PROGRAM)
+    check(second, PROGRAM)
+    assert not any(hit for _, hit, _ in first)
+    assert [hit for _, hit, _ in second] == [text != "c182e310000000a204" for text, _ in PROGRAM]
@@ -0,0 +1,38 @@
+import json
+from argparse import Namespace
+
+from vixen.build import build
+
+
+def run(tmp_path, top, params=(), formats=("rtlil", "verilog")):
+    args = Namespace(top=top, param=list(params), format=list(formats), build_dir=str(tmp_path), jobs=2, force=False)
+    return build(args)
+
+
+def test_default_formats(tmp_path, capsys):
+    # Both formats with the default options, then again from the cache
+    assert run(tmp_path, "OperandDecoder") == 0
+    output = tmp_path / "OperandDecoder"
+    assert (output / "OperandDecoder.il").read_text().startswith("attribute")
+    assert "module OperandDecoder" in (output / "OperandDecoder.v").read_text()
+    assert json.loads((output / "manifest.json").read_text())["formats"] == ["rtlil", "verilog"]
+
+    assert run(tmp_path, "OperandDecoder") == 0
+    assert "0 generated, 0 failed, 1 cached" in capsys.readouterr().err
+
+
+def test_failed_configuration(tmp_path, capsys):
+    # A configuration the top level rejects is reported on a line of its own, without a traceback,
+    # and doesn't stop the others
+    assert run(tmp_path, "VaxDecoderTest", ["width=4,8"], ["rtlil"]) == 1
+    err = capsys.readouterr().err
+    assert "Traceback" not in err
+    assert f"failed     {tmp_path / 'VaxDecoderTest_width_4'}: ValueError: Window width must be at least 8" in err
+    assert "1 generated, 1 failed, 0 cached" in err
+    assert not (tmp_path / "VaxDecoderTest_width_4" / "manifest.json").exists()
+    assert (tmp_path / "VaxDecoderTest_width_8" / "manifest.json").exists()
+
+
+def test_malformed_parameter(tmp_path, capsys):
+    assert run(tmp_path, "OperandDecoder", ["width"]) == 2
+    assert "Malformed parameter 'width'" in capsys.readouterr().err
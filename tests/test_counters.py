@@ -0,0 +1,130 @@
+import pytest
+
+pytest.importorskip("luna_soc")
+
+from amaranth.sim import Settle, Simulator
+
+from vixen.counters import DecodeCounters, read_counters
+
+
+def simulate_readout(counters, events, during_read=()):
+    # Applies `events` ([(input, value)] per cycle) to `counters`, then reads every counter over
+    # the CSR bus in the order read_counters() asks for, one word per cycle with the inputs in
+    # `during_read` applied. Returns read_counters() over the words the bus returned.
+    order = []
+    read_counters(counters, lambda address: order.append(address) or 0)
+
+    bus   = counters.bus
+    words = {}
+
+    def process():
+        for cycle in events:
+            for signal, value in cycle:
+                yield signal.eq(value)
+            yield
+        for signal, _ in events[-1]:
+            yield signal.eq(0)
+        for signal, value in during_read:
+            yield signal.eq(value)
+
+        for address in order:
+            yield bus.addr.eq(address)
+            yield bus.r_stb.eq(1)
+            yield
+            yield bus.r_stb.eq(0)
+            yield Settle()
+            words[address] = yield bus.r_data
+
+    sim = Simulator(counters)
+    sim.add_clock(1e-6)
+    sim.add_sync_process(process)
+    sim.run()
+
+    return read_counters(counters, words.__getitem__), len(order)
+
+
+def test_events():
+    counters = DecodeCounters()
+    events   = [
+        [(counters.i_instructions, 12), (counters.i_split, cycle % 3 == 0), (counters.i_illegal, cycle % 2)]
+        for cycle in range(251)
+    ]
+    values, _ = simulate_readout(counters, events)
+
+    assert values["instructions"] == 12 * 251
+    assert values["split"] == 84
+    assert values["illegal"] == 125
+    assert values["stalled"] == 0
+
+
+def test_lengths():
+    counters = DecodeCounters()
+    events   = [[(count, length) for length, count in enumerate(counters.i_lengths, 1)]] * 300
+    values, _ = simulate_readout(counters, events)
+
+    assert [values[f"length{length}"] for length in range(1, 7)] == [300 * length for length in range(1, 7)]
+
+
+def test_wide_read_is_atomic():
+    # stalled keeps counting while it is read, and its low byte wraps between the reads of its
+    # first and second word. Without the latch on the first word the result would be 256 too high.
+    counters = DecodeCounters()
+    stalled  = 251
+    values, reads = simulate_readout(counters, [[(counters.i_stalled, 1)]] * stalled, [(counters.i_stalled, 1)])
+
+    assert stalled <= values["stalled"] <= stalled + reads
+
+
+def test_decoder_readout():
+    # MOVL R0, R1 and ADDL3 #1, R0, R1 through a small VaxDecoder, then a readout over its bus.
+    # The window has two operand decoders, so each ADDL3 takes two windows.
+    from vixen.decode import VaxDecoder
+
+    decoder = VaxDecoder(width=8, counters=True)
+    image   = bytes.fromhex("d05051" "c1015051") * 8
+    handed  = []
+    words   = {}
+
+    order = []
+    read_counters(decoder.counters, lambda address: order.append(address) or 0)
+
+    def process():
+        yield decoder.i_ready.eq(1)
+        while True:
+            addr = yield decoder.o_addr
+            if addr >= len(image):
+                break
+            yield decoder.i_data.eq(int.from_bytes(image[addr:addr + 8].ljust(8, b"\0"), "little"))
+            yield decoder.i_valid.eq(1)
+            yield
+            yield Settle()
+            if (yield decoder.o_valid):
+                handed.append((yield decoder.o_pc))
+        yield decoder.i_valid.eq(0)
+        for _ in range(4):
+            yield
+            yield Settle()
+            if (yield decoder.o_valid):
+                handed.append((yield decoder.o_pc))
+        yield decoder.i_ready.eq(0)
+
+        for address in order:
+            yield decoder.bus.addr.eq(address)
+            yield decoder.bus.r_stb.eq(1)
+            yield
+            yield decoder.bus.r_stb.eq(0)
+            yield Settle()
+            words[address] = yield decoder.bus.r_data
+
+    sim = Simulator(decoder)
+    sim.add_clock(1e-6)
+    sim.add_sync_process(process)
+    sim.run()
+
+    values = read_counters(decoder.counters, words.__getitem__)
+    assert len(handed) == 16
+    assert values["instructions"] == 16
+    assert values["split"] == 8
+    assert values["illegal"] == 0
+    assert values["length1"] == 8 * 2 + 8 * 3
+    assert values["stalled"] >= 4
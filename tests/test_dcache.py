@@ -0,0 +1,180 @@
+from amaranth.sim import Settle, Simulator
+
+from vixen.dcache import DecodeCache
+from vixen.decode import VaxDecoder
+
+
+def simulate(dut, process):
+    sim = Simulator(dut)
+    sim.add_clock(1e-6)
+    sim.add_sync_process(process)
+    sim.run()
+
+
+def fill(cache, addr, length, target=0):
+    yield cache.i_fill.eq(1)
+    yield cache.i_fill_addr.eq(addr)
+    yield cache.i_fill_entry.opcode.eq(0xd0)
+    yield cache.i_fill_entry.length.eq(length)
+    yield cache.i_fill_entry.target.eq(target)
+    yield
+    yield cache.i_fill.eq(0)
+
+
+def lookup(cache, addr):
+    # (hit, length, target) of the entry for `addr`, a cycle after asking for it
+    yield cache.i_addr.eq(addr)
+    yield
+    yield Settle()
+    if not (yield cache.o_hit):
+        return None
+    return (yield cache.o_entry.length), (yield cache.o_entry.target)
+
+
+def test_fill_then_hit():
+    cache = DecodeCache(sets=16, ways=2, length=8)
+
+    def process():
+        assert (yield from lookup(cache, 0x105)) is None
+        yield from fill(cache, 0x105, 4, 0x1234)
+        assert (yield from lookup(cache, 0x105)) == (4, 0x1234)
+        # The same set under another tag misses, then takes the second way
+        assert (yield from lookup(cache, 0x215)) is None
+        yield from fill(cache, 0x215, 3, 0x5678)
+        assert (yield from lookup(cache, 0x105)) == (4, 0x1234)
+        assert (yield from lookup(cache, 0x215)) == (3, 0x5678)
+        # With both ways in use a third tag replaces the first way
+        yield from fill(cache, 0x325, 2)
+        assert (yield from lookup(cache, 0x105)) is None
+        assert (yield from lookup(cache, 0x215)) == (3, 0x5678)
+        assert (yield from lookup(cache, 0x325)) == (2, 0)
+
+    simulate(cache, process)
+
+
+def invalidated(sets, length, write_bytes, addr):
+    # The sets that still hit after filling one entry per set from 0x200 and a write at `addr`
+    cache = DecodeCache(sets=sets, ways=1, length=length, write_bytes=write_bytes)
+    kept  = []
+
+    def process():
+        for s in range(sets):
+            yield from fill(cache, 0x200 + s, 1)
+        yield cache.i_invalidate.eq(1)
+        yield cache.i_invalidate_addr.eq(addr)
+        yield
+        yield cache.i_invalidate.eq(0)
+        for s in range(sets):
+            if (yield from lookup(cache, 0x200 + s)) is not None:
+                kept.append(s)
+
+    simulate(cache, process)
+    return kept
+
+
+def test_invalidate_span():
+    # An 8 byte instruction can start 7 bytes before a 4 byte write and reach into it, so a write
+    # at 0x208 clears from 0x201 to 0x20b
+    assert invalidated(16, 8, 4, 0x208) == [0, 12, 13, 14, 15]
+    # and one at 0x202 from 0x1fb to 0x205, wrapping round the sets
+    assert invalidated(16, 8, 4, 0x202) == [6, 7, 8, 9, 10]
+    # A span covering every set clears them all
+    assert invalidated(8, 8, 4, 0x208) == []
+
+
+def test_invalidate_wins_over_fill():
+    cache = DecodeCache(sets=16, length=8)
+
+    def process():
+        yield cache.i_invalidate.eq(1)
+        yield cache.i_invalidate_addr.eq(0x105)
+        yield from fill(cache, 0x104, 4)
+        yield cache.i_invalidate.eq(0)
+        assert (yield from lookup(cache, 0x104)) is None
+
+    simulate(cache, process)
+
+
+# Straight line code for VaxDecoder(width=12): a displacement, a split ADDL3 that is never cached,
+# an extended opcode, PC relative, deferred and indexed specifiers, an immediate and two branches
+PROGRAM = [
+    "d0a20850",                          # MOVL B^8(R2), R0
+    "c1e410000000e520000000e630000000",  # ADDL3 L^0x10(R4), L^0x20(R5), L^0x30(R6)
+    "fd7d5051",                          # MOVO R0, R1
+    "d6af04",                            # INCL B^4(PC)
+    "d0b30153",                          # MOVL @B^1(R3), R3
+    "d044a20150",                        # MOVL B^1(R2)[R4], R0
+    "d08f7856341250",                    # MOVL #0x12345678, R0
+    "f551fb",                            # SOBGTR R1, .-2
+    "1210",                              # BNEQ .+0x12
+]
+SPLIT = 1
+
+
+def stream(decoder, image, passes, invalidate=None):
+    # Feeds `image` to `decoder` `passes` times, redirecting back to 0 at its end, with a write at
+    # `invalidate` before the last pass. Returns (hit, fields) for each instruction handed out.
+    handed = []
+
+    def process():
+        yield decoder.i_ready.eq(1)
+        for index in range(passes):
+            for _ in range(200):
+                addr = yield decoder.o_addr
+                if addr >= len(image):
+                    break
+                yield decoder.i_data.eq(int.from_bytes(image[addr:addr + decoder.width].ljust(decoder.width, b"\0"), "little"))
+                yield decoder.i_valid.eq(1)
+                yield Settle()
+                hit = yield decoder.o_hit
+                yield
+                yield Settle()
+                if (yield decoder.o_valid):
+                    fields = []
+                    for signal in (decoder.o_pc, decoder.o_length, decoder.o_opcode, decoder.o_count,
+                                   decoder.o_deferred, decoder.o_immvalid, decoder.o_legalop,
+                                   decoder.o_branch, decoder.o_target, decoder.o_taken,
+                                   *decoder.o_spec, *decoder.o_immed, *decoder.o_end):
+                        fields.append((yield signal))
+                    handed.append((hit, fields))
+            # The write goes with the redirect, which holds the decoder for the cycle
+            yield decoder.i_valid.eq(0)
+            yield decoder.i_redirect.eq(1)
+            yield decoder.i_target.eq(0)
+            yield decoder.i_invalidate.eq(invalidate is not None and index == passes - 2)
+            yield decoder.i_invalidate_addr.eq(invalidate or 0)
+            yield
+            yield decoder.i_redirect.eq(0)
+            yield decoder.i_invalidate.eq(0)
+            yield Settle()
+
+    simulate(decoder, process)
+    return handed
+
+
+def test_cached_stream():
+    # Instructions handed out from the cache match the ones decoded from the bytes field for field
+    image    = bytes.fromhex("".join(PROGRAM))
+    uncached = stream(VaxDecoder(width=12), image, passes=2)
+    cached   = stream(VaxDecoder(width=12, cache_sets=64), image, passes=2)
+
+    assert len(uncached) == 2 * len(PROGRAM)
+    assert [fields for _, fields in cached] == [fields for _, fields in uncached]
+    assert not any(hit for hit, _ in uncached)
+    assert [hit for hit, _ in cached] == [0] * len(PROGRAM) + [index != SPLIT for index in range(len(PROGRAM))]
+
+
+def test_cached_stream_invalidate():
+    # A write at 0x20 drops the instructions that start from 0x20 - 11 to 0x23: MOVO at 0x14 and
+    # MOVL #0x12345678 at 0x24 are out of reach, the three in between are decoded again
+    image  = bytes.fromhex("".join(PROGRAM))
+    starts = [sum(len(text) // 2 for text in PROGRAM[:index]) for index in range(len(PROGRAM))]
+    assert starts[2:7] == [0x14, 0x18, 0x1b, 0x1f, 0x24]
+
+    uncached = stream(VaxDecoder(width=12), image, passes=3)
+    cached   = stream(VaxDecoder(width=12, cache_sets=64), image, passes=3, invalidate=0x20)
+
+    assert [fields for _, fields in cached] == [fields for _, fields in uncached]
+    assert [hit for hit, _ in cached[2 * len(PROGRAM):]] == [
+        index not in (SPLIT, 3, 4, 5) for index in range(len(PROGRAM))
+    ]
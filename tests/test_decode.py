@@ -0,0 +1,79 @@
+import pytest
+from amaranth.sim import Settle, Simulator
+
+from vixen.decode import VaxDecoder
+
+BASE = 0x1000
+
+# Branches decoded by hand, each at BASE: (bytes, length, target, predicted taken). The target is
+# the end of the instruction plus the sign extended displacement.
+BRANCHES = [
+    # BRB .+6: unconditional
+    ("1104", 2, BASE + 2 + 4, True),
+    # SOBGTR R1, .-2: a backward loop branch
+    ("f551fb", 3, BASE + 3 - 5, True),
+    # ACBL S^#5, S^#1, R1, .+0x106: a word displacement after three operands, forward
+    ("f10501510001", 6, BASE + 6 + 0x100, False),
+    # BBS S^#3, R1, .+2: backward by its own length
+    ("e00351fe", 4, BASE + 4 - 2, True),
+    # BSBW .+0x1237: unconditional, word displacement
+    ("303412", 3, BASE + 3 + 0x1234, True),
+    # BNEQ .+0x12: forward conditional
+    ("1210", 2, BASE + 2 + 0x10, False),
+    # BNEQ .-0x7e: backward conditional, the most negative byte displacement
+    ("1280", 2, BASE + 2 - 0x80, True),
+]
+
+
+def decode_one(text, predict):
+    # Redirects a VaxDecoder to BASE, where `text` is, and returns (o_redirect, o_redirect_target)
+    # in the cycle it's decoded and (o_branch, o_target, o_taken, o_length, o_addr) after
+    image   = bytes.fromhex(text)
+    decoder = VaxDecoder(width=12, predict=predict)
+    result  = {}
+
+    def process():
+        yield decoder.i_ready.eq(1)
+        yield decoder.i_redirect.eq(1)
+        yield decoder.i_target.eq(BASE)
+        yield
+        yield decoder.i_redirect.eq(0)
+        yield decoder.i_data.eq(int.from_bytes(image.ljust(decoder.width, b"\0"), "little"))
+        yield decoder.i_valid.eq(1)
+        yield Settle()
+        assert (yield decoder.o_addr) == BASE
+        result["redirect"] = ((yield decoder.o_redirect), (yield decoder.o_redirect_target))
+        yield
+        yield decoder.i_valid.eq(0)
+        yield Settle()
+        assert (yield decoder.o_valid)
+        result["decoded"] = ((yield decoder.o_branch), (yield decoder.o_target), (yield decoder.o_taken),
+                             (yield decoder.o_length), (yield decoder.o_addr))
+
+    sim = Simulator(decoder)
+    sim.add_clock(1e-6)
+    sim.add_sync_process(process)
+    sim.run()
+    return result
+
+
+@pytest.mark.parametrize("predict", [False, True])
+@pytest.mark.parametrize("text, length, target, taken", BRANCHES, ids=[
+    "brb", "sobgtr", "acbl", "bbs", "bsbw", "bneq", "bneq-back",
+])
+def test_branch(text, length, target, taken, predict):
+    result = decode_one(text, predict)
+    follow = predict and taken
+
+    assert result["decoded"] == (1, target, taken, length, target if follow else BASE + length)
+    assert result["redirect"][0] == follow
+    if follow:
+        assert result["redirect"][1] == target
+
+
+def test_not_a_branch():
+    # MOVL B^8(R2), R0 has a byte displacement, but not a branch one
+    result = decode_one("d0a20850", predict=True)
+    assert result["redirect"][0] == 0
+    assert result["decoded"][0] == 0
+    assert result["decoded"][3:] == (4, BASE + 4)
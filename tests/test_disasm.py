@@ -0,0 +1,91 @@
+import json
+from argparse import Namespace
+
+import numpy as np
+import pytest
+
+from vixen import disasm as disasm_module
+from vixen.disasm import FORMATS, RECORD, decode_chunks, disasm
+
+# MOVL B^8(R2), R0; ADDL3 S^#1, R1, R2; MOVO R0, R1; CASEB S^#1, S^#5, S^#0 with its one word
+# table; HALT; and a CASEW cut off in its operands
+TRUNCATED = bytes.fromhex("d0a20850" "c1015152" "fd7d5051" "8f0105000000" "00" "af0304")
+
+
+def run(tmp_path, image, fmt, stats=False, chunk_size=1 << 20):
+    path = tmp_path / "image.bin"
+    path.write_bytes(image)
+    output = tmp_path / f"out.{fmt}"
+    args   = Namespace(image=str(path), format=fmt, output=str(output), base=0, offset=0, length=None,
+                       chunk_size=chunk_size, stats=stats)
+    assert disasm(args) == 0
+    return output.read_bytes()
+
+
+@pytest.mark.parametrize("fmt", FORMATS)
+@pytest.mark.parametrize("stats", [False, True])
+def test_empty(tmp_path, fmt, stats):
+    assert run(tmp_path, b"", fmt, stats) == b""
+
+
+@pytest.mark.parametrize("fmt", FORMATS)
+@pytest.mark.parametrize("stats", [False, True])
+def test_truncated(tmp_path, fmt, stats):
+    output = run(tmp_path, TRUNCATED, fmt, stats)
+    starts = [0, 4, 8, 12, 18, 19]
+
+    if fmt == "binary":
+        records = np.frombuffer(output, dtype=RECORD)
+        assert records["addr"].tolist() == starts
+        assert records["length"].tolist() == [4, 4, 4, 6, 1, 3]
+        assert records["opcode"][-1] == 0xffff
+    elif fmt == "jsonl":
+        lines = [json.loads(line) for line in output.decode().splitlines()]
+        assert [line["addr"] for line in lines] == starts
+        assert lines[-1] == {"addr": 19, "length": 3, "opcode": "(undefined)", "operands": []}
+    else:
+        lines = output.decode().splitlines()
+        assert [int(line.split(":")[0], 16) for line in lines] == starts
+        assert lines[0].split()[-3:] == ["MOVL", "B^8(R2),", "R0"]
+        assert lines[-1] == "00000013:  .byte 0xaf, 0x03, 0x04"
+
+
+def test_truncated_stats(tmp_path, capsys):
+    run(tmp_path, TRUNCATED, "binary", stats=True)
+    stats = json.loads(capsys.readouterr().err)
+    assert stats["instructions"] == 6
+    assert stats["mix"]["(undefined)"] == 1
+
+
+def test_error_is_not_hidden(tmp_path, monkeypatch):
+    # An error part way through must come out as itself, not as a BufferError from closing the
+    # mapping under views of it
+    def fail(batch, index):
+        raise ValueError("formatting failed")
+
+    monkeypatch.setattr(disasm_module, "format_instruction", fail)
+    with pytest.raises(ValueError, match="formatting failed"):
+        run(tmp_path, TRUNCATED * 4, "text")
+
+
+def test_boundaries():
+    # The block walkers against a walk one instruction at a time, over code, random bytes and a
+    # long CASE table, in chunks smaller and larger than a walker's block
+    rng    = np.random.default_rng(1)
+    code   = bytes.fromhex("d05051" "c1015051" "d0e47856341250" "12f0" "fb02ef00000000" "04" "cf50010f")
+    images = [
+        code * 200,
+        rng.integers(0, 256, 20000, dtype=np.uint8).tobytes(),
+        code * 50 + rng.integers(0, 256, 5000, dtype=np.uint8).tobytes() + code * 50,
+    ]
+    for image in images:
+        for chunk_size in (100, 1000, 1 << 20):
+            view     = np.frombuffer(image, dtype=np.uint8)
+            found    = [int(batch.base + start) for batch in decode_chunks(image, 0, chunk_size) for start in batch.start]
+            _, length, _ = disasm_module.speculative_decode(view, len(view))
+            expected = []
+            offset   = 0
+            while offset < len(image):
+                expected.append(offset)
+                offset += int(length[offset])
+            assert found == expected
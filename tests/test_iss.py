@@ -0,0 +1,117 @@
+import pytest
+
+from vixen.iss import AP, FP, PC, SP, Cpu
+
+
+def run(code, regs=(), c=0, steps=None, base=0):
+    # Runs `code` loaded at `base` with the registers in `regs` ({number: value}) and the C flag
+    # `c` set, for `steps` instructions or up to a HALT
+    cpu = Cpu(memory_size=1 << 16)
+    cpu.load_image(bytes.fromhex(code), base)
+    cpu.regs[SP] = 0x8000
+    cpu.regs[PC] = base
+    for reg, value in dict(regs).items():
+        cpu.regs[reg] = value
+    cpu.c = c
+    cpu.run(steps)
+    return cpu
+
+
+def flags(cpu):
+    return cpu.n, cpu.z, cpu.v, cpu.c
+
+
+@pytest.mark.parametrize("code, regs, expected", [
+    # ADDL2 S^#1, R0: signed overflow without a carry
+    ("c00150", {0: 0x7fffffff}, (1, 0, 1, 0)),
+    # ADDL2 S^#1, R0: a carry to zero
+    ("c00150", {0: 0xffffffff}, (0, 1, 0, 1)),
+    # SUBL2 S^#1, R0: a borrow
+    ("c20150", {0: 0}, (1, 0, 0, 1)),
+    # CMPL R0, R1: 1 is greater than -1 signed, but less unsigned
+    ("d15051", {0: 1, 1: 0xffffffff}, (0, 0, 0, 1)),
+    # TSTL R0 clears C
+    ("d550", {0: 0x80000000}, (1, 0, 0, 0)),
+])
+def test_condition_codes(code, regs, expected):
+    assert flags(run(code, regs, c=1, steps=1)) == expected
+
+
+@pytest.mark.parametrize("c", [0, 1])
+@pytest.mark.parametrize("code, regs, expected, target", [
+    # AOBLSS S^#10, R0, .+6: wraps to 0, carrying out, and branches
+    ("f20a5002", {0: 0xffffffff}, (0, 1, 0), 6),
+    # SOBGTR R0, .+5: drops to -1, borrowing, and falls through
+    ("f55002", {0: 0}, (1, 0, 0), 3),
+    # SOBGTR R0, .+5: drops to 1 and branches
+    ("f55002", {0: 2}, (0, 0, 0), 5),
+    # ACBL S^#5, S^#1, R0, .+8: wraps to 0, carrying out, and branches
+    ("f10501500200", {0: 0xffffffff}, (0, 1, 0), 8),
+    # ACBL S^#5, S^#1, R0, .+8: 0x7fffffff + 1 overflows to a negative index, and branches
+    ("f10501500200", {0: 0x7fffffff}, (1, 0, 1), 8),
+])
+def test_loop_keeps_carry(code, regs, expected, target, c):
+    # AOBxxx, SOBxxx and ACBx set N, Z and V, and leave C alone
+    cpu = run(code, regs, c=c, steps=1)
+    assert flags(cpu) == (*expected, c)
+    assert cpu.regs[PC] == target
+
+
+def test_calls_ret():
+    # PUSHL S^#7; CALLS S^#1, @#0x100; HALT, with a procedure at 0x100 saving R2 and R3 that
+    # copies its argument to R0 and AP to R1, clobbers R2 and R3 and returns
+    main = "dd07" "fb019f00010000" "00"
+    proc = "0c00" "d0ac0450" "d05c51" "d00152" "d00253" "04"
+    cpu  = Cpu(memory_size=1 << 16)
+    cpu.load_image(bytes.fromhex(main))
+    cpu.load_image(bytes.fromhex(proc), 0x100)
+    cpu.regs[2:4] = [0x22, 0x33]
+    cpu.regs[FP]  = 0x1234
+    cpu.regs[AP]  = 0x5678
+    cpu.regs[SP]  = 0x8000
+    cpu.c         = 1
+    cpu.run(100)
+
+    assert cpu.halted
+    assert cpu.regs[PC] == len(main) // 2
+    assert cpu.regs[0] == 7
+    assert cpu.regs[1] == 0x8000 - 8             # the argument list: its count, then the argument
+    assert cpu.read(0x8000 - 8, 4) == 1
+    assert cpu.regs[2:4] == [0x22, 0x33]
+    assert (cpu.regs[FP], cpu.regs[AP], cpu.regs[SP]) == (0x1234, 0x5678, 0x8000)
+    # RET restores the condition codes CALLS saved, which the PUSHL set
+    assert flags(cpu) == (0, 0, 0, 1)
+
+
+def test_calls_unaligned_stack():
+    # CALLS aligns the stack and RET undoes it, along with dropping the arguments
+    cpu = Cpu(memory_size=1 << 16)
+    cpu.load_image(bytes.fromhex("fb009f00010000" "00"))
+    cpu.load_image(bytes.fromhex("0000" "04"), 0x100)
+    cpu.regs[SP] = 0x8002
+    cpu.run(100)
+
+    assert cpu.halted
+    assert cpu.regs[SP] == 0x8002
+
+
+def test_self_modifying_code():
+    # MOVL S^#1, R0; MOVB S^#5, @#1 (the literal of the MOVL); SOBGTR R1, back to 0; HALT. The
+    # write drops the cached block, so the second time round the MOVL moves 5.
+    cpu = run("d00150" "90059f01000000" "f551f3" "00", {1: 2})
+
+    assert cpu.halted
+    assert cpu.regs[0] == 5
+    assert cpu.translated >= 3
+
+
+def test_block_cache_hits():
+    # MOVL S^#1, R0; MOVL S^#5, R2; SOBGTR R1, back to the second MOVL; HALT. The first pass
+    # through the loop is the block from 0, the second translates the one from 3, and the other
+    # eight hit it.
+    cpu = run("d00150" "d00552" "f551fa" "00", {1: 10})
+
+    assert cpu.halted
+    assert cpu.retired == 1 + 2 * 10 + 1
+    assert cpu.translated == 3
+    assert cpu.block_hits == 8
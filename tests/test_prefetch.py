@@ -0,0 +1,72 @@
+import pytest
+from amaranth.sim import Settle, Simulator
+
+from vixen.disasm import decode_chunks
+from vixen.prefetch import FrontEnd
+
+# ADDL3 R0, L^0x12345678(R4), R1, which the narrow windows split; HALT; MOVL R0, R1; and
+# ADDL3 L^0(R4), R0, R1. Then a mix of displacements, literals, an immediate and an indexed
+# operand, with instructions ending at every offset of the fetch words.
+IMAGES = [
+    bytes.fromhex("c150e4785634125101" "d05051" "c1e4000000005051") * 4,
+    bytes.fromhex("d0a20850" "c1015152" "b0c3341251" "d5a401" "9a8f0151" "c1e4785634125051" "01") * 3,
+]
+
+
+def boundaries(image, instructions, fetch_width=16, latency=2, **kwargs):
+    # (address, length) of the first `instructions` instructions a FrontEnd decodes from `image`
+    # at address 0, with a memory answering every fetch after `latency` cycles
+    front = FrontEnd(fetch_width=fetch_width, predict=False, **kwargs)
+    prefetch, decoder = front.prefetch, front.decoder
+    word_bytes = fetch_width // 8
+    padded     = bytes(image) + bytes(prefetch.depth + word_bytes)
+    decoded    = []
+
+    def process():
+        yield front.i_redirect.eq(1)
+        yield front.i_target.eq(0)
+        yield
+        yield front.i_redirect.eq(0)
+        yield prefetch.i_fetch_ready.eq(1)
+        yield decoder.i_ready.eq(1)
+
+        in_flight = []
+        for cycle in range(50 * instructions):
+            if len(decoded) >= instructions:
+                break
+            if in_flight and in_flight[0][0] <= cycle:
+                _, addr = in_flight.pop(0)
+                yield prefetch.i_fetch_valid.eq(1)
+                yield prefetch.i_fetch_data.eq(int.from_bytes(padded[addr:addr + word_bytes], "little"))
+            else:
+                yield prefetch.i_fetch_valid.eq(0)
+            yield Settle()
+            if (yield prefetch.o_fetch_valid):
+                in_flight.append((cycle + latency, (yield prefetch.o_fetch_addr)))
+            if (yield decoder.o_valid):
+                decoded.append(((yield decoder.o_pc), (yield decoder.o_length)))
+            yield
+
+    sim = Simulator(front)
+    sim.add_clock(1e-6)
+    sim.add_sync_process(process)
+    sim.run()
+    return decoded
+
+
+def expected(image):
+    return [
+        (int(batch.base + start), int(length))
+        for batch in decode_chunks(image) for start, length in zip(batch.start, batch.length)
+    ]
+
+
+@pytest.mark.parametrize("image", IMAGES, ids=["split", "mixed"])
+@pytest.mark.parametrize("width, fetch_width", [(8, 16), (8, 32), (12, 16)])
+@pytest.mark.parametrize("cache_sets", [0, 16])
+def test_boundaries(image, width, fetch_width, cache_sets):
+    # Runs through the image twice with the cache on, so the second pass can hit
+    wanted = expected(image)
+    found  = boundaries(image + image, 2 * len(wanted), fetch_width, width=width, cache_sets=cache_sets)
+    assert found[:len(wanted)] == wanted
+    assert found[len(wanted):] == [(addr + len(image), length) for addr, length in wanted]
@@ -0,0 +1,64 @@
+import shutil
+
+import numpy as np
+import pytest
+
+from vixen.decode_operand import OperandDecoder
+from vixen.simulate import Simulation
+
+COMPILED = [
+    pytest.param("verilator", marks=pytest.mark.skipif(not shutil.which("verilator"), reason="no Verilator")),
+    pytest.param("cxxrtl", marks=pytest.mark.skipif(not shutil.which("c++"), reason="no C++ compiler")),
+]
+
+def random_inputs(sim, count, seed=0):
+    rng    = np.random.default_rng(seed)
+    inputs = sim.zeros(count)
+    for port in sim.inputs:
+        field = inputs[port.name]
+        field[...] = rng.integers(0, 1 << 32, field.shape, dtype=np.uint64).astype(np.uint32)
+    return inputs
+
+
+def check(design, backend, tmp_path, inputs):
+    compiled  = Simulation(design(), backend, tmp_path)
+    reference = Simulation(design(), "pysim")
+    assert compiled.backend == backend
+
+    actual, stats = compiled.run(inputs(compiled), batch=64)
+    expected, _   = reference.run(inputs(reference))
+    assert stats.vectors == len(actual) == len(expected)
+    assert actual.tobytes() == expected.tobytes()
+
+
+@pytest.mark.parametrize("backend", COMPILED)
+def test_operand_decoder(backend, tmp_path):
+    check(OperandDecoder, backend, tmp_path, lambda sim: random_inputs(sim, 300))
+
+
+@pytest.mark.parametrize("backend", COMPILED)
+def test_pipelined(backend, tmp_path):
+    # A clocked design, with its outputs two cycles behind and reset held for the first few
+    def inputs(sim):
+        inputs = random_inputs(sim, 300, seed=1)
+        inputs["rst"][:] = 0
+        inputs["rst"][:3] = 1
+        return inputs
+
+    check(lambda: OperandDecoder(stages=("classify", "extract")), backend, tmp_path, inputs)
+
+
+def test_auto_falls_back(tmp_path, monkeypatch, capsys):
+    # A compiled backend that fails to build leaves "auto" on the next one, down to pysim
+    def fail(self, build_dir):
+        raise RuntimeError(f"Building the {self.backend} simulation failed:\nno toolchain")
+
+    monkeypatch.setattr(Simulation, "_build", fail)
+    sim = Simulation(OperandDecoder(), "auto", tmp_path)
+    assert sim.backend == "pysim"
+    err = capsys.readouterr().err
+    for backend in Simulation._backends()[:-1]:
+        assert f"{backend} simulation unavailable: Building the {backend} simulation failed" in err
+
+    with pytest.raises(RuntimeError, match="no toolchain"):
+        Simulation(OperandDecoder(), "cxxrtl", tmp_path)
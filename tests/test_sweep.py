@@ -0,0 +1,25 @@
+import numpy as np
+
+from vixen import sweep
+
+
+def test_model_matches_architecture():
+    # The model against the architectural tables over every shard, no simulation needed
+    for first in range(256):
+        vectors  = sweep.shard_vectors(first)
+        expected = sweep._expected(vectors)
+        for name, (values, checked) in sweep.architectural(vectors).items():
+            differs = checked & (expected[name] != values)
+            assert not differs.any(), f"{first:02x} {name}: {np.count_nonzero(differs)} vectors"
+
+
+def test_reduced_sweep(tmp_path):
+    # One shard for each group of modes (literal, register, immediate, absolute, the three
+    # displacements, deferred and PC relative), through the decoder on pysim. The index prefix
+    # shards are left to the full sweep, they are 256 times bigger.
+    firsts  = (0x05, 0x52, 0x8f, 0x9f, 0xa1, 0xdf, 0xe3)
+    summary = sweep.run("pysim", tmp_path, jobs=2, firsts=firsts)
+
+    assert summary["shards"] == len(firsts)
+    assert summary["mismatches"] == dict.fromkeys(summary["mismatches"], 0)
+    assert set(summary["mismatches"]) == {*sweep.OUTPUTS, "o_length/arch", "o_immed/arch"}
@@ -0,0 +1,113 @@
+import pytest
+from amaranth import *
+from amaranth.lib import data
+from amaranth.sim import Settle, Simulator
+
+from vixen.decode import VaxDecoder
+from vixen.uop import REGISTER_ZERO as Z, AgenMode, Cracker, Uop, UopKind, address_temp, value_temp
+from vixen.util import Length
+
+AGEN, LOAD, STORE, ALU = UopKind.AGEN, UopKind.LOAD, UopKind.STORE, UopKind.ALU
+OFFSET, PRE, POST = AgenMode.OFFSET, AgenMode.PRE, AgenMode.POST
+LONG = Length.LONG
+
+
+def crack(image, width=12):
+    # The micro-ops a Cracker fed by a VaxDecoder produces for `image` at address 0, as
+    # (opcode, kind, mode, size, src_a, src_b, src_c, dst_a, dst_b, imm, step, last)
+    decoder = VaxDecoder(width=width)
+    cracker = Cracker()
+    m = Module()
+    m.submodules.decoder = decoder
+    m.submodules.cracker = cracker
+    m.d.comb += cracker.connect(decoder)
+
+    layout = data.Layout.cast(Uop)
+    uops   = []
+
+    def process():
+        yield cracker.i_ready.eq(1)
+        for _ in range(20 * len(image)):
+            addr = yield decoder.o_addr
+            yield decoder.i_data.eq(int.from_bytes(image[addr:addr + width].ljust(width, b"\0"), "little"))
+            yield decoder.i_valid.eq(addr < len(image))
+            yield Settle()
+            if (yield cracker.o_valid):
+                raw   = yield cracker.o_uop.as_value()
+                field = {name: (raw >> f.offset) & ((1 << f.width) - 1) for name, f in layout}
+                uops.append((
+                    field["opcode"], UopKind(field["kind"]), AgenMode(field["mode"]), Length(field["size"]),
+                    field["src_a"], field["src_b"], field["src_c"], field["dst_a"], field["dst_b"],
+                    field["imm"], field["step"], field["last"],
+                ))
+            yield
+            yield Settle()
+
+    sim = Simulator(m)
+    sim.add_clock(1e-6)
+    sim.add_sync_process(process)
+    sim.run()
+    return uops
+
+
+def check(uops, expected):
+    # `expected` leaves out the opcode, step and last, and has None for an imm that isn't used
+    assert len(uops) == len(expected)
+    for index, (uop, wanted) in enumerate(zip(uops, expected)):
+        opcode, *fields, imm, step, last = uop
+        *wanted_fields, wanted_imm = wanted
+        assert fields == wanted_fields, f"micro-op {index}"
+        assert wanted_imm is None or imm == wanted_imm, f"micro-op {index}"
+        assert last == (index == len(expected) - 1), f"micro-op {index}"
+
+
+@pytest.mark.parametrize("text, expected", [
+    # MOVL (R1)+, -(R2): the load after R1 steps on, R2 steps back before the store
+    ("d08172", [
+        (AGEN,  POST,   LONG, 1,               Z,               Z, address_temp(0), 1, 4),
+        (LOAD,  OFFSET, LONG, address_temp(0), Z,               Z, value_temp(0),   Z, None),
+        (AGEN,  PRE,    LONG, 2,               Z,               Z, address_temp(1), 2, 0xfffffffc),
+        (ALU,   OFFSET, LONG, value_temp(0),   Z,               Z, value_temp(1),   Z, 3),
+        (STORE, OFFSET, LONG, address_temp(1), value_temp(1),   Z, Z,               Z, None),
+    ]),
+    # ADDL2 @B^4(R3)[R4], R5: displacement, pointer load, index, value load
+    ("c044b30455", [
+        (AGEN,  OFFSET, LONG, 3,               Z,               Z, address_temp(0), Z, 4),
+        (LOAD,  OFFSET, LONG, address_temp(0), Z,               Z, address_temp(0), Z, None),
+        (AGEN,  OFFSET, LONG, address_temp(0), 4,               Z, address_temp(0), Z, None),
+        (LOAD,  OFFSET, LONG, address_temp(0), Z,               Z, value_temp(0),   Z, None),
+        (ALU,   OFFSET, LONG, value_temp(0),   5,               Z, 5,               Z, 5),
+    ]),
+    # INCL B^4(PC): the address is the end of the specifier plus 4, and the result is stored back
+    ("d6af04", [
+        (AGEN,  OFFSET, LONG, Z,               Z,               Z, address_temp(0), Z, 3 + 4),
+        (LOAD,  OFFSET, LONG, address_temp(0), Z,               Z, value_temp(0),   Z, None),
+        (ALU,   OFFSET, LONG, value_temp(0),   Z,               Z, value_temp(0),   Z, 3),
+        (STORE, OFFSET, LONG, address_temp(0), value_temp(0),   Z, Z,               Z, None),
+    ]),
+    # MOVAL B^8(R2), R3: the address itself is the source, nothing is loaded
+    ("dea20853", [
+        (AGEN,  OFFSET, LONG, 2,               Z,               Z, address_temp(0), Z, 8),
+        (ALU,   OFFSET, LONG, address_temp(0), Z,               Z, 3,               Z, 4),
+    ]),
+    # INDEX R0, R1, R2, R3, R4, R5: five sources spill into a second ALU micro-op
+    ("0a505152535455", [
+        (ALU,   OFFSET, LONG, 0,               1,               2, 5,               Z, 7),
+        (ALU,   OFFSET, LONG, 3,               4,               Z, Z,               Z, 7),
+    ]),
+], ids=["autoinc-autodec", "indexed-deferred", "pc-relative", "address", "spill"])
+def test_crack(text, expected):
+    check(crack(bytes.fromhex(text)), expected)
+
+
+def test_sequence():
+    # The same instructions back to back: the ALU micro-ops carry the address of the next one,
+    # and each instruction ends on its own last micro-op
+    image = bytes.fromhex("d08172" "c044b30455" "d6af04" "dea20853" "0a505152535455")
+    uops  = crack(image)
+
+    alu = [(opcode, imm, step) for opcode, kind, *_, imm, step, last in uops if kind is ALU]
+    assert alu == [(0xd0, 3, 0), (0xc0, 8, 0), (0xd6, 11, 0), (0xde, 15, 0), (0x0a, 22, 0), (0x0a, 22, 1)]
+    assert [last for *_, last in uops].count(1) == 5
+    # INCL B^4(PC) at 8: its operand ends at 11
+    assert [imm for opcode, kind, *_, imm, step, last in uops if opcode == 0xd6 and kind is AGEN] == [11 + 4]
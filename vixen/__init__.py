@@ -17,6 +17,8 @@ def main():
 	from os import path, mkdir
 	from argparse import ArgumentParser, ArgumentDefaultsHelpFormatter
 
+	from .build import TOPS
+
 
 	parser = ArgumentParser(formatter_class = ArgumentDefaultsHelpFormatter, description = 'Vixen')
 
@@ -35,11 +37,198 @@ def main():
 		required = True
 	)
 
+	disasm_parser = action_parser.add_parser(
+		'disasm',
+		formatter_class = ArgumentDefaultsHelpFormatter,
+		help = 'Disassemble a raw VAX binary or object file'
+	)
+
+	disasm_parser.add_argument(
+		'image',
+		type = str,
+		help = 'The file to disassemble'
+	)
+
+	disasm_parser.add_argument(
+		'--format', '-f',
+		type    = str,
+		choices = ('text', 'jsonl', 'binary'),
+		default = 'text',
+		help    = 'The output format'
+	)
+
+	disasm_parser.add_argument(
+		'--output', '-o',
+		type    = str,
+		default = '-',
+		help    = 'The output file, or - for stdout'
+	)
+
+	disasm_parser.add_argument(
+		'--base',
+		type    = lambda value: int(value, 0),
+		default = 0,
+		help    = 'The address the start of the file is loaded at'
+	)
+
+	disasm_parser.add_argument(
+		'--offset',
+		type    = lambda value: int(value, 0),
+		default = 0,
+		help    = 'The file offset to start disassembling at'
+	)
+
+	disasm_parser.add_argument(
+		'--length',
+		type    = lambda value: int(value, 0),
+		default = None,
+		help    = 'The number of bytes to disassemble, defaults to the rest of the file'
+	)
+
+	disasm_parser.add_argument(
+		'--chunk-size',
+		type    = lambda value: int(value, 0),
+		default = 1 << 20,
+		help    = 'The number of bytes decoded per batch'
+	)
+
+	disasm_parser.add_argument(
+		'--stats',
+		action  = 'store_true',
+		default = False,
+		help    = 'Print instruction mix statistics to stderr'
+	)
+
+	iss_parser = action_parser.add_parser(
+		'iss',
+		formatter_class = ArgumentDefaultsHelpFormatter,
+		help = 'Run a raw VAX binary on the instruction set simulator'
+	)
+
+	iss_parser.add_argument(
+		'image',
+		type = str,
+		help = 'The file to run'
+	)
+
+	iss_parser.add_argument(
+		'--base',
+		type    = lambda value: int(value, 0),
+		default = 0x200,
+		help    = 'The address the file is loaded at'
+	)
+
+	iss_parser.add_argument(
+		'--entry',
+		type    = lambda value: int(value, 0),
+		default = None,
+		help    = 'The address to start executing at, defaults to the load address'
+	)
+
+	iss_parser.add_argument(
+		'--memory',
+		type    = lambda value: int(value, 0),
+		default = 16 << 20,
+		help    = 'The size of memory in bytes'
+	)
+
+	iss_parser.add_argument(
+		'--stack',
+		type    = lambda value: int(value, 0),
+		default = None,
+		help    = 'The initial stack pointer, defaults to the top of memory'
+	)
+
+	iss_parser.add_argument(
+		'--max-instructions', '-n',
+		type    = int,
+		default = None,
+		help    = 'Stop after retiring this many instructions'
+	)
+
+	iss_parser.add_argument(
+		'--trace', '-t',
+		type    = str,
+		default = None,
+		help    = 'Write the retired instruction trace to this file'
+	)
+
+	iss_parser.add_argument(
+		'--trace-format',
+		type    = str,
+		choices = ('text', 'binary'),
+		default = 'text',
+		help    = 'The trace format'
+	)
+
+	iss_parser.add_argument(
+		'--dual-issue',
+		type    = int,
+		metavar = 'WIDTH',
+		default = None,
+		help    = 'Report how often a dual issue decoder with a WIDTH byte window fills its second slot'
+	)
+
+	build_parser = action_parser.add_parser(
+		'build',
+		formatter_class = ArgumentDefaultsHelpFormatter,
+		help = 'Generate RTLIL and Verilog for one or more configurations of a top level'
+	)
+
+	build_parser.add_argument(
+		'top',
+		type    = str,
+		choices = TOPS,
+		help    = 'The top level to generate'
+	)
+
+	build_parser.add_argument(
+		'--param', '-p',
+		type    = str,
+		action  = 'append',
+		default = [],
+		metavar = 'NAME=VALUE[,VALUE...]',
+		help    = 'A constructor parameter of the top level; every combination of the values given is generated'
+	)
+
+	build_parser.add_argument(
+		'--format', '-f',
+		type    = str,
+		nargs   = '+',
+		choices = ('rtlil', 'verilog'),
+		default = ['rtlil', 'verilog'],
+		help    = 'The output formats'
+	)
+
+	build_parser.add_argument(
+		'--jobs', '-j',
+		type    = int,
+		default = None,
+		help    = 'The number of configurations to generate at once, defaults to the number of CPUs'
+	)
+
+	build_parser.add_argument(
+		'--force',
+		action  = 'store_true',
+		default = False,
+		help    = 'Regenerate configurations that are up to date'
+	)
+
 
 	args = parser.parse_args()
 
 	if not path.exists(args.build_dir):
 		mkdir(args.build_dir)
 
+	if args.action == 'disasm':
+		from .disasm import disasm
+		return disasm(args)
+	elif args.action == 'iss':
+		from .iss import iss
+		return iss(args)
+	elif args.action == 'build':
+		from .build import build
+		return build(args)
+
 
 	return 0
@@ -0,0 +1,142 @@
+from functools import lru_cache
+
+from amaranth import *
+
+from .decode import MAX_OPERANDS, Opcode, OpcodeAttributes, OpcodeTable
+from .util import Length
+
+# Early effective address generation.
+#
+# AddressGenerator sits next to the operand decoders and works out the effective address of the
+# operands that only need an addition: byte, word and longword displacement (not deferred, not
+# indexed), where it reads the base register or, for PC, takes the address just past the operand,
+# and absolute, which is the address itself. Operands that are read (access r and m) get a memory
+# read request for their size along with the address.
+#
+# An address is only generated when the base register is current: not marked busy by i_busy
+# (writes in flight), and not changed by an autoincrement or autodecrement of an earlier operand
+# of the same instruction, in this window or, through i_modified, in the ones before it.
+# Everything else (deferred, indexed and register modes) is left to the usual address calculation.
+
+
+class OperandReads(Elaboratable):
+    # Which operands of an opcode are specifiers (not branch displacements or inline data), which
+    # of those are read from memory, and their Length, from a ROM addressed like OpcodeAttributes
+    def __init__(self):
+        self.i_opcode    = Signal(16)
+        self.o_specifier = Signal(MAX_OPERANDS)
+        self.o_read      = Signal(MAX_OPERANDS)
+        self.o_length    = [Signal(Length, name=f"o_length{operand + 1}") for operand in range(MAX_OPERANDS)]
+
+    @staticmethod
+    @lru_cache(maxsize=None)
+    def rom_init():
+        table = Opcode.table()
+        len_w = Shape.cast(Length).width
+
+        init = [0] * 1024
+        for row, opcode in enumerate(table.opcodes):
+            word = 0
+            for operand in range(MAX_OPERANDS):
+                kind = table.access[row * MAX_OPERANDS + operand]
+                if kind not in "-bi":
+                    word |= 1 << operand
+                if kind in "rm":
+                    word |= 1 << (MAX_OPERANDS + operand)
+                oplen = table.length[row * MAX_OPERANDS + operand]
+                if oplen != OpcodeTable.NO_LENGTH:
+                    word |= oplen << (2 * MAX_OPERANDS + operand * len_w)
+            init[OpcodeAttributes.address(opcode)] = word
+        return tuple(init)
+
+    def elaborate(self, platform):
+        m = Module()
+
+        len_w     = len(self.o_length[0])
+        length_at = 2 * MAX_OPERANDS
+
+        rom = Memory(width=length_at + MAX_OPERANDS * len_w, depth=1024, init=self.rom_init())
+        m.submodules.rom_rd = rom_rd = rom.read_port(domain="comb")
+
+        is_extended = self.i_opcode[:8].matches(Opcode.EXOPFD, Opcode.EXOPFE, Opcode.EXOPFF)
+
+        m.d.comb += [
+            rom_rd.addr.eq(Mux(is_extended, Cat(self.i_opcode[8:16], self.i_opcode[0:2]), self.i_opcode[0:8])),
+            self.o_specifier.eq(rom_rd.data[:MAX_OPERANDS]),
+            self.o_read.eq(rom_rd.data[MAX_OPERANDS:length_at]),
+        ]
+        m.d.comb += [
+            length.eq(rom_rd.data[length_at + operand * len_w:length_at + (operand + 1) * len_w])
+            for operand, length in enumerate(self.o_length)
+        ]
+
+        return m
+
+
+class AddressGenerator(Elaboratable):
+    # Operand inputs are the fields of a VaxDecoderTest window by operand index, with i_end counted
+    # from i_addr, the address of the window (or instruction) they are relative to.
+    def __init__(self):
+        self.i_addr     = Signal(32)
+        self.i_opcode   = Signal(16)
+        self.i_decoded  = Signal(MAX_OPERANDS)
+        self.i_spec     = [Signal(16, name=f"i_spec{operand + 1}") for operand in range(MAX_OPERANDS)]
+        self.i_immed    = [Signal(32, name=f"i_immed{operand + 1}") for operand in range(MAX_OPERANDS)]
+        self.i_end      = [Signal(8, name=f"i_end{operand + 1}") for operand in range(MAX_OPERANDS)]
+
+        # Registers with writes in flight, and registers changed by operands of the instruction
+        # from earlier windows
+        self.i_busy     = Signal(16)
+        self.i_modified = Signal(16)
+
+        # A register file read port for each operand's base register
+        self.o_reg      = [Signal(4, name=f"o_reg{operand + 1}") for operand in range(MAX_OPERANDS)]
+        self.i_reg_data = [Signal(32, name=f"i_reg_data{operand + 1}") for operand in range(MAX_OPERANDS)]
+
+        # Effective addresses, the operands they were generated for, and which of those to read
+        # from memory and how much
+        self.o_ea          = [Signal(32, name=f"o_ea{operand + 1}") for operand in range(MAX_OPERANDS)]
+        self.o_ea_valid    = Signal(MAX_OPERANDS)
+        self.o_read        = Signal(MAX_OPERANDS)
+        self.o_read_length = [Signal(Length, name=f"o_read_length{operand + 1}") for operand in range(MAX_OPERANDS)]
+
+        # i_modified with the registers the operands of this window change
+        self.o_modified = Signal(16)
+
+    def elaborate(self, platform):
+        m = Module()
+
+        m.submodules.reads = reads = OperandReads()
+        m.d.comb += reads.i_opcode.eq(self.i_opcode)
+
+        modified = self.i_modified
+        for n in range(MAX_OPERANDS):
+            spec  = self.i_spec[n]
+            immed = self.i_immed[n]
+            reg   = spec[0:4]
+            is_pc = reg == 15
+
+            is_disp     = spec[4:8].matches(0xA, 0xC, 0xE)
+            is_absolute = spec[0:8] == 0x9F
+            stale       = ~is_pc & (self.i_busy | modified).bit_select(reg, 1)
+            base        = Mux(is_pc, self.i_addr + self.i_end[n], self.i_reg_data[n])
+            decoded     = self.i_decoded[n] & reads.o_specifier[n]
+            valid       = decoded & (is_absolute | (is_disp & ~stale))
+
+            m.d.comb += [
+                self.o_reg[n].eq(reg),
+                self.o_ea[n].eq(Mux(is_absolute, immed, base + immed)),
+                self.o_ea_valid[n].eq(valid),
+                self.o_read[n].eq(valid & reads.o_read[n]),
+                self.o_read_length[n].eq(reads.o_length[n]),
+            ]
+
+            # Autoincrement (deferred) and autodecrement change their register for the operands
+            # after them, including as the base of an indexed specifier
+            base_spec = Mux(spec[4:8] == 0x4, spec[8:16], spec[0:8])
+            changes   = decoded & base_spec[4:8].matches(0x7, 0x8, 0x9) & (base_spec[0:4] != 15)
+            modified  = modified | Mux(changes, C(1, 16) << base_spec[0:4], 0)
+
+        m.d.comb += self.o_modified.eq(modified)
+
+        return m
@@ -0,0 +1,222 @@
+import json
+import multiprocessing
+import platform
+import resource
+import subprocess
+import sys
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+from amaranth.back import rtlil, verilog
+from amaranth.hdl.ir import Fragment
+
+from .decode import Opcode, OpcodeAttributes, OpcodeOperandCount, OpcodeTable, VaxDecoder, VaxDecoderTest, _OpcodeBase
+from .decode_operand import OperandDecoder
+from .synth import io_ports
+
+# Elaboration and conversion benchmarks for the HDL generators.
+#
+# Every case runs in a fresh process, so the lru_caches start cold and the peak resident set
+# size belongs to that case alone. A case is timed in three stages:
+#
+#   elaborate  Fragment.get() and prepare(), i.e. running every elaborate()
+#   rtlil      converting the prepared fragment to RTLIL
+#   verilog    converting it to Verilog with the builtin Yosys (RTLIL conversion included)
+#
+# along with the peak RSS after each. The opcode table can be cut down to its first `opcodes`
+# entries to see how the opcode dependent logic scales with the size of the ISA. That only
+# changes anything for VaxDecoderTest with lookup="mux", which builds a comparator per opcode;
+# the attribute ROM used everywhere else is 1024 words deep whatever the table holds, so the
+# other cases are run once with the full table.
+#
+# Results are written as JSON; --compare checks them against an earlier run.
+
+
+DESIGNS = ("OperandDecoder", "OpcodeOperandCount", "VaxDecoderTest", "VaxDecoder")
+
+# Designs whose logic depends on the window width
+_WINDOWED = {"VaxDecoderTest", "VaxDecoder"}
+
+
+def _opcode_dependent(design, lookup):
+    # Whether the size of the opcode table changes the logic, see above
+    return design == "VaxDecoderTest" and lookup == "mux"
+
+
+def _make(design, width, lookup):
+    if design == "OperandDecoder":
+        return OperandDecoder()
+    if design == "OpcodeOperandCount":
+        return OpcodeOperandCount()
+    if design == "VaxDecoderTest":
+        return VaxDecoderTest(width=width, lookup=lookup)
+    if design == "VaxDecoder":
+        return VaxDecoder(width=width)
+    raise ValueError(f"Unknown design '{design}', expected one of {', '.join(DESIGNS)}")
+
+
+@contextmanager
+def _opcode_subset(opcodes):
+    # Makes Opcode.table() (and everything built from it) see only the first `opcodes` opcodes
+    if opcodes is None:
+        yield
+        return
+
+    table = _OpcodeBase.table
+    data  = Opcode._data()
+    subset = OpcodeTable({opcode: data[opcode] for opcode in list(data)[:opcodes]})
+    _OpcodeBase.table = staticmethod(lambda: subset)
+    OpcodeAttributes.rom_init.cache_clear()
+    try:
+        yield
+    finally:
+        _OpcodeBase.table = table
+        OpcodeAttributes.rom_init.cache_clear()
+
+
+def _peak_rss():
+    # KiB on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def run_case(case):
+    # Runs one benchmark case, see `cases()`, and returns it with its measurements added
+    result = dict(case)
+    rss    = {"baseline": _peak_rss()}
+
+    with _opcode_subset(case["opcodes"]):
+        design = _make(case["design"], case["width"], case["lookup"])
+
+        start    = time.perf_counter()
+        fragment = Fragment.get(design, platform=None).prepare(ports=io_ports(design))
+        result["elaborate_s"] = time.perf_counter() - start
+        rss["elaborate"] = _peak_rss()
+
+        start = time.perf_counter()
+        rtlil_text, _ = rtlil.convert_fragment(fragment)
+        result["rtlil_s"]     = time.perf_counter() - start
+        result["rtlil_bytes"] = len(rtlil_text)
+        rss["rtlil"] = _peak_rss()
+
+        if case["verilog"]:
+            design   = _make(case["design"], case["width"], case["lookup"])
+            fragment = Fragment.get(design, platform=None).prepare(ports=io_ports(design))
+            start = time.perf_counter()
+            verilog_text, _ = verilog.convert_fragment(fragment)
+            result["verilog_s"]     = time.perf_counter() - start
+            result["verilog_bytes"] = len(verilog_text)
+            rss["verilog"] = _peak_rss()
+
+    result["peak_rss_kib"] = rss
+    return result
+
+
+def cases(designs=DESIGNS, widths=(1 + 6*6,), opcodes=(None,), lookups=("rom",), verilog=True):
+    # Every combination of the parameters a design depends on
+    for design in designs:
+        for width in (widths if design in _WINDOWED else (None,)):
+            for lookup in (lookups if design == "VaxDecoderTest" else ("rom",)):
+                for count in (opcodes if _opcode_dependent(design, lookup) else (None,)):
+                    yield {"design": design, "width": width, "opcodes": count, "lookup": lookup, "verilog": verilog}
+
+
+def _case_key(result):
+    return (result["design"], result["width"], result["opcodes"], result["lookup"])
+
+
+def _git_revision():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"], cwd=Path(__file__).parent, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(case_list, jobs=1, progress=None):
+    # Runs the cases, each in a process of its own, and returns the JSON report
+    import amaranth
+
+    results = []
+    with multiprocessing.get_context("spawn").Pool(jobs, maxtasksperchild=1) as pool:
+        for result in pool.imap(run_case, case_list):
+            results.append(result)
+            if progress is not None:
+                progress(result)
+
+    return {
+        "revision": _git_revision(),
+        "python":   platform.python_version(),
+        "amaranth": amaranth.__version__,
+        "opcodes":  len(Opcode.table().opcodes),
+        "results":  results,
+    }
+
+
+def compare(report, baseline, threshold=1.25):
+    # Cases of `report` whose time in any stage (or peak RSS) grew by more than `threshold` times
+    # over `baseline`, as (key, metric, old, new) tuples
+    old = {_case_key(result): result for result in baseline["results"]}
+    regressions = []
+    for result in report["results"]:
+        before = old.get(_case_key(result))
+        if before is None:
+            continue
+        for metric in ("elaborate_s", "rtlil_s", "verilog_s"):
+            if metric in result and metric in before and result[metric] > before[metric] * threshold:
+                regressions.append((_case_key(result), metric, before[metric], result[metric]))
+        peak, peak_before = max(result["peak_rss_kib"].values()), max(before["peak_rss_kib"].values())
+        if peak > peak_before * threshold:
+            regressions.append((_case_key(result), "peak_rss_kib", peak_before, peak))
+    return regressions
+
+
+def _describe(result):
+    params = [f"{key}={result[key]}" for key in ("width", "opcodes", "lookup") if result[key] not in (None, "rom")]
+    return f"{result['design']}({', '.join(params)})"
+
+
+if __name__ == "__main__":
+    from argparse import ArgumentParser
+
+    parser = ArgumentParser(description="Benchmark elaboration and conversion of the decoder generators")
+    parser.add_argument("--designs", nargs="+", choices=DESIGNS, default=list(DESIGNS))
+    parser.add_argument("--widths", metavar="BYTES", type=int, nargs="+", default=[1 + 6*6], help="window widths to sweep")
+    parser.add_argument("--opcodes", metavar="COUNT", type=int, nargs="+", default=None,
+                        help="opcode table sizes to sweep, taking the first COUNT opcodes (default: all); "
+                             "only VaxDecoderTest with --lookups mux depends on it")
+    parser.add_argument("--lookups", nargs="+", choices=("rom", "mux"), default=["rom"], help="VaxDecoderTest opcode lookups")
+    parser.add_argument("--no-verilog", action="store_true", help="skip Verilog conversion")
+    parser.add_argument("--jobs", "-j", type=int, default=1, help="cases to run at once; timings are noisier above 1")
+    parser.add_argument("--output", "-o", default=None, help="write the JSON report here")
+    parser.add_argument("--compare", metavar="BASELINE", default=None, help="JSON report to check for regressions against")
+    parser.add_argument("--threshold", type=float, default=1.25, help="slowdown ratio counted as a regression")
+    args = parser.parse_args()
+
+    def progress(result):
+        verilog_s = f"{result['verilog_s']:.2f}s" if "verilog_s" in result else "-"
+        print(
+            f"{_describe(result):<44} elaborate {result['elaborate_s']:>7.2f}s  rtlil {result['rtlil_s']:>7.2f}s  "
+            f"verilog {verilog_s:>8}  "
+            f"peak {max(result['peak_rss_kib'].values()) / 1024:>7.1f} MiB",
+            file=sys.stderr, flush=True
+        )
+
+    report = run(
+        list(cases(args.designs, args.widths, args.opcodes or [None], args.lookups, not args.no_verilog)),
+        jobs=args.jobs, progress=progress
+    )
+
+    text = json.dumps(report, indent=2)
+    if args.output is None:
+        print(text)
+    else:
+        Path(args.output).write_text(text)
+
+    if args.compare is not None:
+        regressions = compare(report, json.loads(Path(args.compare).read_text()), args.threshold)
+        for (design, width, opcodes, lookup), metric, before, after in regressions:
+            print(f"regression: {design} width={width} opcodes={opcodes} lookup={lookup} {metric} {before:.2f} -> {after:.2f}",
+                  file=sys.stderr)
+        sys.exit(1 if regressions else 0)
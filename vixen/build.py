@@ -0,0 +1,155 @@
+import ast
+import hashlib
+import itertools
+import json
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+# `vixen build`: generates RTLIL and Verilog for a matrix of configurations of a top level.
+#
+# Every configuration goes into a directory of its own under the build directory, with a
+# manifest.json recording the configuration and a hash of it together with the Vixen sources
+# and the Amaranth version. A configuration whose manifest and outputs are already there with the
+# same hash is skipped; the others are generated in parallel, one per worker process. Netlists
+# are converted with netlist.py, so `-p shared=True` gives one OperandDecoder definition.
+
+FORMATS = {
+    "rtlil":   ".il",
+    "verilog": ".v",
+}
+
+
+def _tops():
+    # Top levels by name, imported when needed as some pull in optional dependencies
+    from .decode import OpcodeOperandCount, VaxDecoder, VaxDecoderTest
+    from .decode_operand import OperandDecoder
+    from .prefetch import FrontEnd, PrefetchQueue
+    from .uop import Cracker
+
+    return {
+        top.__name__: top
+        for top in (OperandDecoder, OpcodeOperandCount, VaxDecoderTest, VaxDecoder, PrefetchQueue, FrontEnd, Cracker)
+    }
+
+
+TOPS = ("OperandDecoder", "OpcodeOperandCount", "VaxDecoderTest", "VaxDecoder", "PrefetchQueue", "FrontEnd", "Cracker")
+
+
+def source_hash():
+    # Hash of every source and data file of the package
+    digest  = hashlib.sha256()
+    package = Path(__file__).parent
+    for path in sorted(package.rglob("*")):
+        if path.is_file() and path.suffix in (".py", ".txt") and "__pycache__" not in path.parts:
+            digest.update(str(path.relative_to(package)).encode())
+            digest.update(path.read_bytes())
+    return digest.hexdigest()
+
+
+def _value(text):
+    # Parameter values are Python literals, or strings when they aren't
+    try:
+        return ast.literal_eval(text)
+    except (ValueError, SyntaxError):
+        return text
+
+
+def configurations(params):
+    # The cartesian product of `params`, a list of "name=value,value,..." strings, as kwargs dicts
+    axes = []
+    for param in params:
+        name, sep, values = param.partition("=")
+        if not sep or not name.isidentifier():
+            raise ValueError(f"Malformed parameter '{param}', expected NAME=VALUE[,VALUE...]")
+        axes.append([(name, _value(value)) for value in values.split(",")])
+    return [dict(combination) for combination in itertools.product(*axes)]
+
+
+def _slug(top, config):
+    return "_".join([top, *(f"{name}_{value}" for name, value in config.items())])
+
+
+def _generate(job):
+    # Worker: elaborates one configuration and writes its outputs and manifest
+    from amaranth.hdl.ir import Fragment
+
+    from .netlist import convert_fragment
+    from .synth import io_ports
+
+    top, config, formats, output, digest = job
+    start    = time.perf_counter()
+    design   = _tops()[top](**config)
+    fragment = Fragment.get(design, platform=None).prepare(ports=io_ports(design))
+    name     = "".join(char if char.isalnum() else "_" for char in _slug(top, config))
+
+    output.mkdir(parents=True, exist_ok=True)
+    for fmt in formats:
+        text, _ = convert_fragment(fragment, name, fmt)
+        (output / f"{top}{FORMATS[fmt]}").write_text(text)
+
+    (output / "manifest.json").write_text(json.dumps({
+        "top":     top,
+        "config":  config,
+        "formats": list(formats),
+        "hash":    digest,
+    }, indent=2) + "\n")
+    return time.perf_counter() - start
+
+
+def plan(top, configs, formats, build_dir, force=False):
+    # (config, output directory, hash, up to date) for each configuration
+    import amaranth
+
+    sources = source_hash()
+    jobs    = []
+    for config in configs:
+        digest = hashlib.sha256(json.dumps(
+            [sources, amaranth.__version__, top, sorted(config.items()), sorted(formats)], default=str
+        ).encode()).hexdigest()
+        output   = Path(build_dir) / _slug(top, config)
+        manifest = output / "manifest.json"
+        current  = (
+            not force and manifest.exists() and json.loads(manifest.read_text()).get("hash") == digest and
+            all((output / f"{top}{FORMATS[fmt]}").exists() for fmt in formats)
+        )
+        jobs.append((config, output, digest, current))
+    return jobs
+
+
+def build(args):
+    try:
+        configs = configurations(args.param)
+    except ValueError as error:
+        print(f"build: {error}", file=sys.stderr)
+        return 2
+    jobs = plan(args.top, configs, args.format, args.build_dir, args.force)
+
+    stale = [job for job in jobs if not job[3]]
+    for _, output, _, current in jobs:
+        if current:
+            print(f"cached     {output}", file=sys.stderr)
+
+    # A configuration that fails (bad parameters, a Yosys error) is reported and the others still
+    # go ahead; its directory is left without a manifest, so it's tried again next time
+    start  = time.perf_counter()
+    failed = 0
+    with ProcessPoolExecutor(max_workers=args.jobs) as pool:
+        futures = [pool.submit(_generate, (args.top, config, args.format, output, digest))
+                   for config, output, digest, _ in stale]
+        for (_, output, _, _), future in zip(stale, futures):
+            try:
+                elapsed = future.result()
+            except Exception as error:
+                failed += 1
+                print(f"failed     {output}: {type(error).__name__}: {str(error).strip()}", file=sys.stderr)
+            else:
+                print(f"generated  {output} in {elapsed:.1f}s", file=sys.stderr)
+
+    print(
+        f"{len(stale) - failed} generated, {failed} failed, {len(jobs) - len(stale)} cached "
+        f"in {time.perf_counter() - start:.1f}s",
+        file=sys.stderr
+    )
+    return 1 if failed else 0
@@ -0,0 +1,213 @@
+import gzip
+from pathlib import Path
+
+import numpy as np
+
+# Bounded waveform capture for long batched simulations.
+#
+# A Capture is fed the input and output records of a Simulation (simulate.py) batch by batch, one
+# record per cycle, and keeps the last `depth` cycles of the selected ports in a ring buffer. When
+# a trigger fires, the buffered cycles, the trigger cycle and the `after` cycles following it are
+# written out as a value change dump, only the values that change, gzip compressed unless asked
+# not to. Only the last `keep` captures are kept on disk, so memory and disk use stay the same
+# however long the run is.
+#
+# Triggers are functions of the input and output records of a batch returning a bool per cycle,
+# see equals(), low() and opcode(); feed() also takes a bool array of its own, for example the
+# vectors that mismatch against a reference model. A trigger during a capture is part of it.
+
+
+def equals(name, value, mask=None):
+    # Fires when port `name` (masked with `mask`) equals `value`
+    def trigger(inputs, outputs):
+        field = _field(inputs, outputs, name)
+        return (field & mask if mask is not None else field) == value
+    return trigger
+
+
+def low(name, enable=None):
+    # Fires when port `name` is zero or, with `enable`, when any of its bits set in port `enable`
+    # is low (for example o_legalop out of o_decoded)
+    def trigger(inputs, outputs):
+        field = _field(inputs, outputs, name)
+        if enable is None:
+            return field == 0
+        return (~field & _field(inputs, outputs, enable)) != 0
+    return trigger
+
+
+def opcode(value):
+    # Fires when the i_data window starts with the opcode `value` (16 bits for extended opcodes)
+    return equals("i_data", value, 0xffff if value > 0xff else 0xff)
+
+
+def any_of(*triggers):
+    def trigger(inputs, outputs):
+        return np.logical_or.reduce([trigger(inputs, outputs) for trigger in triggers])
+    return trigger
+
+
+def _field(inputs, outputs, name):
+    records = inputs if name in inputs.dtype.names else outputs
+    field   = records[name]
+    # Only the low word of a wide port is compared
+    return (field[:, 0] if field.ndim > 1 else field).astype(np.uint64)
+
+
+def _identifier(index):
+    # VCD identifiers from the printable characters
+    text = ""
+    while True:
+        text += chr(33 + index % 94)
+        index //= 94
+        if not index:
+            return text
+
+
+class Capture:
+    # Captures the ports `signals` (default: all) of `sim` around triggers into files named
+    # `path` with the capture number appended
+    def __init__(self, sim, path, signals=None, depth=1024, after=64, trigger=None, keep=16, compress=True):
+        ports = {port.name: port for port in sim.inputs + sim.outputs}
+        names = list(ports) if signals is None else list(signals)
+        for name in names:
+            if name not in ports:
+                raise ValueError(f"Unknown port '{name}', expected one of {', '.join(ports)}")
+
+        self.ports    = [ports[name] for name in names]
+        self.dtype    = np.dtype([(name, sim.input_dtype[name] if name in sim.input_dtype.names else sim.output_dtype[name])
+                                  for name in names])
+        self.path     = Path(path)
+        self.depth    = depth
+        self.after    = after
+        self.trigger  = trigger
+        self.keep     = keep
+        self.compress = compress
+
+        self.cycle    = 0 # cycles fed so far
+        self.triggers = 0 # triggers that started a capture
+        self.files    = []
+
+        self._ring    = np.zeros(depth, dtype=self.dtype)
+        self._filled  = 0
+        self._pending = None # (first cycle, trigger cycle, [record arrays], cycles still to come)
+
+    def _records(self, inputs, outputs):
+        records = np.zeros(len(outputs), dtype=self.dtype)
+        for name in self.dtype.names:
+            records[name] = inputs[name] if name in inputs.dtype.names else outputs[name]
+        return records
+
+    def _push(self, records):
+        # Appends `records` to the ring, keeping the last `depth` of them
+        count   = len(records)
+        records = records[-self.depth:]
+        start   = (self.cycle + count - len(records)) % self.depth
+        first   = min(len(records), self.depth - start)
+        self._ring[start:start + first] = records[:first]
+        self._ring[:len(records) - first] = records[first:]
+        self._filled = min(self.depth, self._filled + count)
+        self.cycle  += count
+
+    def _history(self):
+        # The ring contents, oldest first
+        start = self.cycle % self.depth
+        return np.concatenate((self._ring[start:], self._ring[:start]))[self.depth - self._filled:]
+
+    def feed(self, inputs, outputs, trigger=None):
+        # Adds a batch of cycles, `trigger` being an optional bool array of extra trigger cycles
+        records = self._records(inputs, outputs)
+        fired   = np.zeros(len(records), dtype=bool)
+        if self.trigger is not None:
+            fired |= self.trigger(inputs, outputs)
+        if trigger is not None:
+            fired |= np.asarray(trigger, dtype=bool)
+
+        pos = 0
+        while pos < len(records):
+            if self._pending is not None:
+                first, at, parts, remaining = self._pending
+                chunk = records[pos:pos + remaining]
+                parts.append(chunk)
+                self._push(chunk)
+                pos += len(chunk)
+                self._pending = (first, at, parts, remaining - len(chunk))
+                if remaining == len(chunk):
+                    self._write()
+                continue
+
+            hits = np.flatnonzero(fired[pos:])
+            if not len(hits):
+                self._push(records[pos:])
+                break
+            at = pos + int(hits[0])
+            self._push(records[pos:at])
+            history = self._history()
+            self.triggers += 1
+            self._pending = (self.cycle - len(history), self.cycle, [history, records[at:at + 1]], self.after)
+            self._push(records[at:at + 1])
+            pos = at + 1
+
+    def close(self):
+        # Writes out a capture still waiting for its `after` cycles
+        if self._pending is not None:
+            self._write()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _write(self):
+        first, at, parts, _ = self._pending
+        self._pending = None
+        records = np.concatenate(parts)
+
+        suffix = ".vcd.gz" if self.compress else ".vcd"
+        path   = self.path.with_name(f"{self.path.name}.{self.triggers - 1:06d}{suffix}")
+        opener = gzip.open if self.compress else open
+        with opener(path, "wt") as file:
+            self._dump(file, records, first, at)
+
+        self.files.append(path)
+        while len(self.files) > self.keep:
+            self.files.pop(0).unlink(missing_ok=True)
+
+    def _dump(self, file, records, first, at):
+        ids = {port.name: _identifier(index + 1) for index, port in enumerate(self.ports)}
+        file.write("$timescale 1 us $end\n$scope module top $end\n")
+        file.write(f"$var wire 1 {_identifier(0)} trigger $end\n")
+        for port in self.ports:
+            file.write(f"$var wire {port.width} {ids[port.name]} {port.name} $end\n")
+        file.write("$upscope $end\n$enddefinitions $end\n")
+
+        # Cycles whose value differs from the one before, per port
+        changes = {}
+        for port in self.ports:
+            field = records[port.name]
+            if field.ndim > 1:
+                differs = np.ones(len(field), dtype=bool)
+                differs[1:] = (field[1:] != field[:-1]).any(axis=1)
+            else:
+                differs = np.ones(len(field), dtype=bool)
+                differs[1:] = field[1:] != field[:-1]
+            changes[port.name] = differs
+
+        for n in range(len(records)):
+            cycle = first + n
+            lines = []
+            if n == 0 or cycle in (at, at + 1):
+                lines.append(f"{int(cycle == at)}{_identifier(0)}")
+            for port in self.ports:
+                if not changes[port.name][n]:
+                    continue
+                value = records[port.name][n]
+                value = int.from_bytes(value.tobytes(), "little") if port.words > 1 else int(value)
+                if port.width == 1:
+                    lines.append(f"{value}{ids[port.name]}")
+                else:
+                    lines.append(f"b{value:b} {ids[port.name]}")
+            if lines:
+                file.write(f"#{cycle}\n" + "\n".join(lines) + "\n")
+        file.write(f"#{first + len(records)}\n")
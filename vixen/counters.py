@@ -0,0 +1,85 @@
+from amaranth import *
+from luna_soc.gateware.vendor.amaranth_soc import csr
+
+# Decoder performance counters.
+#
+# DecodeCounters counts the events VaxDecoder(counters=True) reports and exposes each count as a
+# read-only register on an amaranth-soc CSR bus. Counters are free running and wrap around, so
+# readers should take differences between samples. Wider counters take several bus reads, the
+# first of which latches the whole value.
+#
+# The counters are csr.Elements behind a csr.Multiplexer: the Record based CSR API of the
+# amaranth-soc that goes with Amaranth 0.4, which the rest of the tree is written for. amaranth-soc
+# itself has moved on to lib.wiring and never released that API, so it comes from the copy
+# luna-soc 0.2 ships (see requirements.txt).
+#
+#   instructions  instructions handed out
+#   stalled       cycles the decoder could take a window but the bytes weren't there
+#   split         instructions that needed more than one window
+#   illegal       operand specifiers not allowed where they were found (o_legalop low)
+#   length1..6    operand specifiers decoded, by OperandDecoder.o_length: 1 to 6 bytes, with
+#                 quadword and octaword immediates counted as 6
+
+
+class DecodeCounters(Elaboratable):
+    NAMES = ("instructions", "stalled", "split", "illegal", *(f"length{length}" for length in range(1, 7)))
+
+    def __init__(self, width=32, data_width=8, max_events=12):
+        self.width = width
+
+        # Events this cycle, each input being how many to add
+        self.i_instructions = Signal(range(max_events + 1))
+        self.i_stalled      = Signal()
+        self.i_split        = Signal()
+        self.i_illegal      = Signal(range(max_events + 1))
+        self.i_lengths      = [Signal(range(max_events + 1), name=f"i_length{length}") for length in range(1, 7)]
+
+        # Counters take consecutive addresses, in NAMES order
+        words = -(-width // data_width)
+        self._mux      = csr.Multiplexer(addr_width=(len(self.NAMES) * words - 1).bit_length(), data_width=data_width)
+        self._counters = {name: csr.Element(width, "r", name=name) for name in self.NAMES}
+        self.addresses = {name: self._mux.add(element) for name, element in self._counters.items()}
+
+        self.bus = self._mux.bus
+
+    def elaborate(self, platform):
+        m = Module()
+
+        m.submodules.mux = self._mux
+
+        events = dict(zip(self.NAMES, [self.i_instructions, self.i_stalled, self.i_split, self.i_illegal, *self.i_lengths]))
+        for name, element in self._counters.items():
+            count = Signal(self.width, name=f"{name}_count")
+            m.d.sync += count.eq(count + events[name])
+            m.d.comb += element.r_data.eq(count)
+
+        return m
+
+
+def read_counters(counters, read):
+    # Reads every counter of a DecodeCounters through `read(address)`, which returns the CSR bus
+    # data word at `address`. The words of a counter are read from the lowest address up, as the
+    # first read latches the whole value.
+    data_width = len(counters.bus.r_data)
+    values = {}
+    for name, (start, end) in counters.addresses.items():
+        value = 0
+        for offset, address in enumerate(range(start, end)):
+            value |= read(address) << (offset * data_width)
+        values[name] = value
+    return values
+
+
+def format_counters(values, cycles=None):
+    # One line per counter, with the specifier lengths also as a share of all specifiers and the
+    # stalls as a share of `cycles` when given.
+    specifiers = sum(values[f"length{length}"] for length in range(1, 7))
+    lines = []
+    for name in DecodeCounters.NAMES:
+        line = f"{name:<13} {values[name]:>10}"
+        if name.startswith("length") and specifiers:
+            line += f" {values[name] / specifiers:>7.1%}"
+        elif name == "stalled" and cycles:
+            line += f" {values[name] / cycles:>7.1%}"
+        lines.append(line)
+    return "\n".join(lines)
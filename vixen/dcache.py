@@ -0,0 +1,130 @@
+from amaranth import *
+from amaranth.lib import data
+
+from .decode import MAX_OPERANDS, Opcode, _or_tree
+
+# Decoded-instruction cache.
+#
+# DecodeCache holds instructions as VaxDecoder decodes them, tagged with their address, so one
+# that is decoded again (the body of a loop) can be handed out straight from the cache instead
+# of going through the operand decoder chain and without waiting for its bytes to be fetched.
+#
+# Lookups are registered: the entry for i_addr comes out on o_hit/o_entry in the next cycle.
+# VaxDecoder looks up the address it's about to move to, so the lookup overlaps with the cycle
+# o_addr is registered in and adds no latency. A write to instruction memory (i_invalidate)
+# drops every entry that could hold one of the written bytes.
+
+
+class CacheEntry(data.Struct):
+    # The fields of a VaxDecoder instruction, o_end counted from the start of the instruction
+    opcode:   Opcode
+    length:   8
+    count:    range(MAX_OPERANDS + 1)
+    spec:     data.ArrayLayout(16, MAX_OPERANDS)
+    immed:    data.ArrayLayout(32, MAX_OPERANDS)
+    end:      data.ArrayLayout(8, MAX_OPERANDS)
+    deferred: MAX_OPERANDS
+    immvalid: MAX_OPERANDS
+    legalop:  MAX_OPERANDS
+    branch:   1
+    target:   32
+    taken:    1
+
+
+class DecodeCache(Elaboratable):
+    # `sets` sets of `ways` entries, indexed by the low address bits. Instructions are at most
+    # `length` bytes long and instruction memory is written `write_bytes` at a time, which bounds
+    # the sets an invalidation has to clear.
+    def __init__(self, sets=64, ways=1, length=1 + 6*6, write_bytes=4):
+        if sets < 1 or sets & (sets - 1):
+            raise ValueError(f"Set count must be a power of 2, not {sets}")
+        if ways < 1:
+            raise ValueError(f"Way count must be at least 1, not {ways}")
+
+        self.sets        = sets
+        self.ways        = ways
+        self.length      = length
+        self.write_bytes = write_bytes
+
+        # Lookup, answered in the next cycle
+        self.i_addr  = Signal(32)
+        self.o_hit   = Signal()
+        self.o_entry = Signal(CacheEntry)
+
+        # Stores the instruction at i_fill_addr, replacing an invalid entry of its set if there is
+        # one and otherwise the ways in turn
+        self.i_fill       = Signal()
+        self.i_fill_addr  = Signal(32)
+        self.i_fill_entry = Signal(CacheEntry)
+
+        # Instruction memory was written at i_invalidate_addr
+        self.i_invalidate      = Signal()
+        self.i_invalidate_addr = Signal(32)
+
+    def elaborate(self, platform):
+        m = Module()
+
+        index_bits = (self.sets - 1).bit_length()
+        tag_bits   = 32 - index_bits
+
+        def index(addr):
+            return addr[:index_bits] if index_bits else C(0, 1)
+
+        addr = Signal(32)
+        m.d.sync += addr.eq(self.i_addr)
+
+        fill_index = index(self.i_fill_addr)
+        valid      = [Signal(self.sets, name=f"valid{way}") for way in range(self.ways)]
+        victim     = Signal(range(self.ways))
+
+        # Fill the first invalid way, or the next victim when they're all in use
+        in_use   = Cat(valid[way].bit_select(fill_index, 1) for way in range(self.ways))
+        fill_way = Signal(range(self.ways))
+        m.d.comb += fill_way.eq(victim)
+        for way in reversed(range(self.ways)):
+            with m.If(~in_use[way]):
+                m.d.comb += fill_way.eq(way)
+        with m.If(self.i_fill & in_use.all()):
+            m.d.sync += victim.eq(Mux(victim == self.ways - 1, 0, victim + 1))
+
+        # An instruction starting up to length - 1 bytes before the write can include one of the
+        # written bytes, so the sets from there to the end of the write are cleared
+        span  = self.length + self.write_bytes - 1
+        clear = Signal(self.sets)
+        if span >= self.sets:
+            m.d.comb += clear.eq(Mux(self.i_invalidate, (1 << self.sets) - 1, 0))
+        else:
+            first = Signal(index_bits)
+            m.d.comb += first.eq(self.i_invalidate_addr - (self.length - 1))
+            m.d.comb += clear.eq(Cat(
+                self.i_invalidate & ((C(s, index_bits) - first)[:index_bits] < span) for s in range(self.sets)
+            ))
+
+        hits    = []
+        entries = []
+        for way in range(self.ways):
+            memory = Memory(width=tag_bits + len(self.i_fill_entry.as_value()), depth=self.sets, name=f"way{way}")
+            m.submodules[f"read{way}"]  = read  = memory.read_port()
+            m.submodules[f"write{way}"] = write = memory.write_port()
+
+            filled = self.i_fill & (fill_way == way)
+            m.d.comb += [
+                read.addr.eq(index(self.i_addr)),
+                write.addr.eq(fill_index),
+                write.en.eq(filled),
+                write.data.eq(Cat(self.i_fill_addr[index_bits:], self.i_fill_entry)),
+            ]
+            # Invalidation wins over a fill in the same cycle
+            m.d.sync += valid[way].eq((valid[way] | Mux(filled, C(1, self.sets) << fill_index, 0)) & ~clear)
+
+            hit = Signal(name=f"hit{way}")
+            m.d.comb += hit.eq(valid[way].bit_select(index(addr), 1) & (read.data[:tag_bits] == addr[index_bits:]))
+            hits.append(hit)
+            entries.append(Mux(hit, read.data[tag_bits:], 0))
+
+        m.d.comb += [
+            self.o_hit.eq(Cat(hits).any()),
+            self.o_entry.eq(_or_tree(entries)),
+        ]
+
+        return m
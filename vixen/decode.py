@@ -1,93 +1,41 @@
 from enum import Enum
+from functools import lru_cache
+from pathlib import Path
 
 from amaranth import *
 
-from decode_operand import OperandDecoder
-from util import Length
-
-
-class Opcode(Enum):
-    HALT   = 0x00
-    NOP    = 0x01
-    REI    = 0x02
-    BPT    = 0x03
-    RET    = 0x04
-    RSB    = 0x05
-    LDPCTX = 0x06
-    SVPCTX = 0x07
-    CVTPS  = 0x08
-    CVTSP  = 0x09
-    INDEX  = 0x0a
-    CRC    = 0x0b
-    PROBER = 0x0c
-    PROBEW = 0x0d
-    INSQUE = 0x0e
-    REMQUE = 0x0f
-
-    BSBB   = 0x10
-    BRB    = 0x11
-    BNEQ   = 0x12
-    BEQL   = 0x13
-    BGTR   = 0x14
-    BLEQ   = 0x15
-    JSB    = 0x16
-    JMP    = 0x17
-    BGEQ   = 0x18
-    BLSS   = 0x19
-    BGTRU  = 0x1a
-    BLEQU  = 0x1b
-    BVC    = 0x1c
-    BVS    = 0x1d
-    BGEQU  = 0x1e
-    BLSSU  = 0x1f
-
-    ADDP4  = 0x20
-    ADDP6  = 0x21
-    SUBP4  = 0x22
-    SUBP6  = 0x23
-    CVTPT  = 0x24
-    MULP   = 0x25
-    CVTTP  = 0x26
-    DIVP   = 0x27
-    MOVC3  = 0x28
-    CMPC3  = 0x29
-    SCANC  = 0x2a
-    SPANC  = 0x2b
-    MOVC5  = 0x2c
-    CMPC5  = 0x2d
-    MOVTC  = 0x2e
-    MOVTUC = 0x2f
-
-    BSBW   = 0x30
-    BRW    = 0x31
-    CVTWL  = 0x32
-    CVTWB  = 0x33
-    MOVP   = 0x34
-    CMPP3  = 0x35
-    CVTPL  = 0x36
-    CMPP4  = 0x37
-    EDITPC = 0x38
-    MATCHC = 0x39
-    LOCC   = 0x3a
-    SKPC   = 0x3b
-    MOVZWL = 0x3c
-    ACBW   = 0x3d
-    MOVAW  = 0x3e
-    PUSHAW = 0x3f
-
-    ADDB2  = 0x80
-    ADDB3  = 0x81
-
-    ADDW2  = 0xa0
-    ADDW3  = 0xa1
-
-    ADDL2  = 0xc0
-    ADDL3  = 0xc1
-
-    # Extended opcode bytes, for convenience.
-    EXOPFD = 0xfd
-    EXOPFE = 0xfe
-    EXOPFF = 0xff
+from .decode_operand import STAGES, OperandDecoder, SharedOperandDecoder
+from .util import Length
+
+
+def _load_opcodes(path):
+    # Parses opcodes.txt into (mnemonic, aliases, value, kinds, types) rows.
+    #
+    # Extended opcodes are stored little endian, like they appear in the instruction stream,
+    # so FD32 (CVTDH) has the value 0x32fd.
+    rows = []
+    with open(path) as opcodes:
+        for line_num, line in enumerate(opcodes, start=1):
+            fields = line.split("#", 1)[0].split()
+            if not fields:
+                continue
+
+            opcode, names, operands = fields[0], fields[1].split("/"), fields[2:]
+            if len(opcode) not in (2, 4) or any(len(operand) != 2 for operand in operands):
+                raise ValueError(f"{path}:{line_num}: malformed opcode entry '{line.strip()}'")
+
+            value = int.from_bytes(bytes.fromhex(opcode), "little")
+            kinds = "".join(operand[0] for operand in operands)
+            types = "".join(operand[1] for operand in operands)
+            rows.append((names[0], tuple(names[1:]), value, kinds, types))
+    return tuple(rows)
+
+
+_OPCODES = _load_opcodes(Path(__file__).with_name("opcodes.txt"))
+
+
+class _OpcodeBase(Enum):
+    # Members are created from opcodes.txt, see `Opcode` below.
 
     @staticmethod
     def _data() -> dict[Enum, tuple[str, str]]:
@@ -95,126 +43,238 @@ class Opcode(Enum):
         # where operand kinds is a string of:
         # - effective "a"ddress
         # - "b"ranch displacement
+        # - "i"nline data
         # - "m"odified operand
         # - "r"ead operand
-        # - effective address "v" (I don't know the difference between this and a)
+        # - "v"ariable bit field base address
         # - "w"ritten operand
         # data type is a string of:
         # - "b"yte
         # - "w"ord
         # - "l"ongword
         # - "q"uadword
-        return {
-            # 0x00 (misc)
-            Opcode.HALT:   ("", ""),
-            Opcode.NOP:    ("", ""),
-            Opcode.REI:    ("", ""),
-            Opcode.BPT:    ("", ""),
-            Opcode.RET:    ("", ""),
-            Opcode.RSB:    ("", ""),
-            Opcode.LDPCTX: ("", ""),
-            Opcode.SVPCTX: ("", ""),
-            Opcode.CVTPS:  ("rara", "wbwb"),
-            Opcode.CVTSP:  ("rara", "wbwb"),
-            Opcode.INDEX:  ("rrrrrw", "llllll"),
-            Opcode.CRC:    ("arra", "blwb"),
-            Opcode.PROBER: ("rra", "bwb"),
-            Opcode.PROBEW: ("rra", "bwb"),
-            Opcode.INSQUE: ("aa", "bb"),
-            Opcode.REMQUE: ("aw", "bl"),
-            # 0x10 (branches/jumps)
-            Opcode.BSBB:   ("b", "b"),
-            Opcode.BRB:    ("b", "b"),
-            Opcode.BNEQ:   ("b", "b"),
-            Opcode.BEQL:   ("b", "b"),
-            Opcode.BGTR:   ("b", "b"),
-            Opcode.BLEQ:   ("b", "b"),
-            Opcode.JSB:    ("a", "b"),
-            Opcode.JMP:    ("a", "b"),
-            Opcode.BGEQ:   ("b", "b"),
-            Opcode.BLSS:   ("b", "b"),
-            Opcode.BGTRU:  ("b", "b"),
-            Opcode.BLEQU:  ("b", "b"),
-            Opcode.BVC:    ("b", "b"),
-            Opcode.BVS:    ("b", "b"),
-            Opcode.BGEQU:  ("b", "b"),
-            Opcode.BLSSU:  ("b", "b"),
-            # 0x20 (packed decimal)
-            Opcode.ADDP4:  ("rara", "wbwb"),
-            Opcode.ADDP6:  ("rarara", "wbwbwb"),
-            Opcode.SUBP4:  ("rara", "wbwb"),
-            Opcode.SUBP6:  ("rarara", "wbwbwb"),
-            Opcode.CVTPT:  ("raara", "wbbwb"),
-            Opcode.MULP:   ("rarara", "wbwbwb"),
-            Opcode.CVTTP:  ("raara", "wbbwb"),
-            Opcode.DIVP:   ("rarara", "wbwbwb"),
-            Opcode.MOVC3:  ("raa", "wbb"),
-            Opcode.CMPC3:  ("raa", "wbb"),
-            Opcode.SCANC:  ("raar", "wbbb"),
-            Opcode.SPANC:  ("raar", "wbbb"),
-            Opcode.MOVC5:  ("rarra", "wbbwb"),
-            Opcode.CMPC5:  ("rarra", "wbbwb"),
-            Opcode.MOVTC:  ("rarara", "wbbbwb"),
-            Opcode.MOVTUC: ("rarara", "wbbbwb"),
-            # 0x30 (packed decimal and conversions)
-            Opcode.BSBW:   ("b", "w"),
-            Opcode.BRW:    ("b", "w"),
-            Opcode.CVTWL:  ("rw", "wl"),
-            Opcode.CVTWB:  ("rw", "wb"),
-            Opcode.MOVP:   ("raa", "wbb"),
-            Opcode.CMPP3:  ("raa", "wbb"),
-            Opcode.CVTPL:  ("raw", "wbl"),
-            Opcode.CMPP4:  ("rara", "wbwb"),
-            Opcode.EDITPC: ("raaa", "wbbb"),
-            Opcode.MATCHC: ("rara", "wbwb"),
-            Opcode.LOCC:   ("rra", "bwb"),
-            Opcode.SKPC:   ("rra", "bwb"),
-            Opcode.MOVZWL: ("rw", "wl"),
-            Opcode.ACBW:   ("rrmb", "wwww"),
-            Opcode.MOVAW:  ("aw", "wl"),
-            Opcode.PUSHAW: ("a", "w"),
-            # 0x80 (byte math)
-            Opcode.ADDB2:  ("rm", "bb"),
-            Opcode.ADDB3:  ("rrw", "bbb"),
-            # 0xa0 (word math)
-            Opcode.ADDW2:  ("rm", "ww"),
-            Opcode.ADDW3:  ("rrw", "www"),
-            # 0xc0 (longword math)
-            Opcode.ADDL2:  ("rm", "ll"),
-            Opcode.ADDL3:  ("rrw", "lll"),
-        }
+        # - "o"ctaword
+        # - "f", "d", "g", "h" floating
+        return {Opcode[name]: (kinds, types) for name, _, _, kinds, types in _OPCODES}
+
+    @staticmethod
+    @lru_cache(maxsize=None)
+    def table():
+        # Compiled once; every helper and generator below reads from this.
+        return OpcodeTable(Opcode._data())
 
     @staticmethod
     def n_op_insns(operand_count=0):
-        return [opcode for opcode, data in Opcode._data().items() if len(data[0]) == operand_count]
+        return list(Opcode.table().with_count(operand_count))
 
     @staticmethod
     def nth_op_byte_insns(operand=0):
-        return [opcode for opcode, data in Opcode._data().items() if len(data[1]) > operand and data[1][operand] == "b"]
+        return list(Opcode.table().with_length(operand, Length.BYTE))
 
     @staticmethod
     def nth_op_word_insns(operand=0):
-        return [opcode for opcode, data in Opcode._data().items() if len(data[1]) > operand and data[1][operand] == "w"]
+        return list(Opcode.table().with_length(operand, Length.WORD))
 
     @staticmethod
     def nth_op_long_insns(operand=0):
-        return [opcode for opcode, data in Opcode._data().items() if len(data[1]) > operand and data[1][operand] == "l"]
+        return list(Opcode.table().with_length(operand, Length.LONG))
+
+    @staticmethod
+    def nth_op_quad_insns(operand=0):
+        return list(Opcode.table().with_length(operand, Length.QUAD))
+
+    @staticmethod
+    def nth_op_octa_insns(operand=0):
+        return list(Opcode.table().with_length(operand, Length.OCTA))
+
+
+Opcode = _OpcodeBase("Opcode", [
+    (name, value) for mnemonic, aliases, value, _, _ in _OPCODES for name in (mnemonic, *aliases)
+], module=__name__)
+
+
+# Maximum number of operands any instruction has (INDEX, ADDP6, ...)
+MAX_OPERANDS = 6
+
+# Data type letters from Opcode._data() that map onto an operand Length
+DATA_TYPE_LENGTHS = {
+    "b": Length.BYTE,
+    "w": Length.WORD,
+    "l": Length.LONG,
+    "q": Length.QUAD,
+    "o": Length.OCTA,
+    "f": Length.LONG,
+    "d": Length.QUAD,
+    "g": Length.QUAD,
+    "h": Length.OCTA,
+}
+
+
+class OpcodeTable:
+    # Frozen, opcode-indexed form of Opcode._data().
+    #
+    # Every opcode gets a row number (see `index`); per-operand attributes live in flat
+    # arrays of MAX_OPERANDS entries per row, so operand `n` of row `r` is at `r * MAX_OPERANDS + n`.
+    # - count:  number of operands per row
+    # - access: operand kind letter, or "-" for no operand
+    # - length: Length value, or NO_LENGTH for no operand / no matching Length
+    NO_LENGTH = 0xff
+
+    __slots__ = ("opcodes", "index", "count", "access", "length", "_by_count", "_by_length")
+
+    def __init__(self, data):
+        opcodes = tuple(data)
+        count   = bytearray(len(opcodes))
+        access  = bytearray(b"-" * (len(opcodes) * MAX_OPERANDS))
+        length  = bytearray([self.NO_LENGTH] * (len(opcodes) * MAX_OPERANDS))
+
+        by_count  = [[] for _ in range(MAX_OPERANDS + 1)]
+        by_length = [{oplen: [] for oplen in Length} for _ in range(MAX_OPERANDS)]
+
+        for row, opcode in enumerate(opcodes):
+            kinds, types = data[opcode]
+            count[row] = len(kinds)
+            by_count[len(kinds)].append(opcode)
+            for operand, kind in enumerate(kinds):
+                access[row * MAX_OPERANDS + operand] = ord(kind)
+            for operand, data_type in enumerate(types):
+                oplen = DATA_TYPE_LENGTHS.get(data_type)
+                if oplen is not None:
+                    length[row * MAX_OPERANDS + operand] = oplen.value
+                    by_length[operand][oplen].append(opcode)
+
+        self.opcodes = opcodes
+        self.index   = {opcode: row for row, opcode in enumerate(opcodes)}
+        self.count   = bytes(count)
+        self.access  = access.decode("ascii")
+        self.length  = bytes(length)
+
+        self._by_count  = tuple(tuple(matching) for matching in by_count)
+        self._by_length = tuple(
+            {oplen: tuple(matching) for oplen, matching in lengths.items()} for lengths in by_length
+        )
+
+    def operand_count(self, opcode):
+        row = self.index.get(opcode)
+        return 0 if row is None else self.count[row]
+
+    def operand_access(self, opcode, operand):
+        row = self.index.get(opcode)
+        if row is None or not 0 <= operand < MAX_OPERANDS:
+            return None
+        kind = self.access[row * MAX_OPERANDS + operand]
+        return None if kind == "-" else kind
+
+    def operand_length(self, opcode, operand):
+        row = self.index.get(opcode)
+        if row is None or not 0 <= operand < MAX_OPERANDS:
+            return None
+        oplen = self.length[row * MAX_OPERANDS + operand]
+        return None if oplen == self.NO_LENGTH else Length(oplen)
+
+    def with_count(self, operand_count):
+        if not 0 <= operand_count <= MAX_OPERANDS:
+            return ()
+        return self._by_count[operand_count]
+
+    def with_length(self, operand, oplen):
+        if not 0 <= operand < MAX_OPERANDS:
+            return ()
+        return self._by_length[operand][oplen]
+
+
+class OpcodeAttributes(Elaboratable):
+    # Opcode attribute ROM: one lookup produces the operand count, all six operand lengths and
+    # which operands are fixed size (branch displacements and inline data) rather than specifiers.
+    #
+    # The ROM has four 256-entry pages, the first indexed by the opcode byte and the other three
+    # by the second opcode byte of the FD/FE/FF extended opcodes, so it is addressed by
+    # {page, byte} where page is the low two bits of the extension byte (0b01, 0b10, 0b11).
+    def __init__(self):
+        self.i_opcode = Signal(16)
+
+        self.o_count    = Signal(range(MAX_OPERANDS + 1))
+        self.o_operlen1 = Signal(Length)
+        self.o_operlen2 = Signal(Length)
+        self.o_operlen3 = Signal(Length)
+        self.o_operlen4 = Signal(Length)
+        self.o_operlen5 = Signal(Length)
+        self.o_operlen6 = Signal(Length)
+        self.o_fixed    = Signal(MAX_OPERANDS)
+        self.o_branch   = Signal(MAX_OPERANDS)
+
+    @staticmethod
+    def address(opcode):
+        value = opcode.value if isinstance(opcode, Opcode) else opcode
+        if value > 0xff and (value & 0xff) in (Opcode.EXOPFD.value, Opcode.EXOPFE.value, Opcode.EXOPFF.value):
+            return ((value & 0x3) << 8) | (value >> 8)
+        return value & 0xff
+
+    @staticmethod
+    @lru_cache(maxsize=None)
+    def rom_init():
+        table   = Opcode.table()
+        count_w = Shape.cast(range(MAX_OPERANDS + 1)).width
+        len_w   = Shape.cast(Length).width
+
+        masks_at = count_w + MAX_OPERANDS * len_w
+
+        init = [0] * 1024
+        for row, opcode in enumerate(table.opcodes):
+            word = table.count[row]
+            for operand in range(MAX_OPERANDS):
+                oplen = table.length[row * MAX_OPERANDS + operand]
+                if oplen != OpcodeTable.NO_LENGTH:
+                    word |= oplen << (count_w + operand * len_w)
+                kind = table.access[row * MAX_OPERANDS + operand]
+                if kind in "bi":
+                    word |= 1 << (masks_at + operand)
+                if kind == "b":
+                    word |= 1 << (masks_at + MAX_OPERANDS + operand)
+            init[OpcodeAttributes.address(opcode)] = word
+        return tuple(init)
+
+    def elaborate(self, platform):
+        m = Module()
+
+        operlens = [self.o_operlen1, self.o_operlen2, self.o_operlen3, self.o_operlen4, self.o_operlen5, self.o_operlen6]
+        count_w  = len(self.o_count)
+        len_w    = len(self.o_operlen1)
+        masks_at = count_w + MAX_OPERANDS * len_w
+
+        rom = Memory(width=masks_at + 2 * MAX_OPERANDS, depth=1024, init=self.rom_init())
+        m.submodules.rom_rd = rom_rd = rom.read_port(domain="comb")
+
+        is_extended = self.i_opcode[:8].matches(Opcode.EXOPFD, Opcode.EXOPFE, Opcode.EXOPFF)
+
+        m.d.comb += [
+            rom_rd.addr.eq(Mux(is_extended, Cat(self.i_opcode[8:16], self.i_opcode[0:2]), self.i_opcode[0:8])),
+            self.o_count.eq(rom_rd.data[:count_w]),
+            self.o_fixed.eq(rom_rd.data[masks_at:masks_at + MAX_OPERANDS]),
+            self.o_branch.eq(rom_rd.data[masks_at + MAX_OPERANDS:]),
+        ]
+        m.d.comb += [
+            operlen.eq(rom_rd.data[count_w + operand * len_w:count_w + (operand + 1) * len_w])
+            for operand, operlen in enumerate(operlens)
+        ]
+
+        return m
 
 
 class OpcodeOperandCount(Elaboratable):
     def __init__(self):
         self.i_opcode = Signal(16)
-        self.o_count  = Signal(range(6))
+        self.o_count  = Signal(range(MAX_OPERANDS + 1))
 
     def elaborate(self, platform):
         m = Module()
 
-        with m.Switch(self.i_opcode):
-            for operand_count in range(0, 7):
-                with m.Case(Opcode.n_op_insns(operand_count)):
-                    m.d.comb += self.o_count.eq(operand_count)
-            with m.Default():
-                m.d.comb += self.o_count.eq(0)
+        # Shares the attribute ROM with VaxDecoderTest rather than a Switch of its own.
+        m.submodules.attributes = attributes = OpcodeAttributes()
+        m.d.comb += [
+            attributes.i_opcode.eq(self.i_opcode),
+            self.o_count.eq(attributes.o_count),
+        ]
 
         return m
 
@@ -224,49 +284,536 @@ class OpcodeOperandCount(Elaboratable):
 # - outputs to a 3-input, 2-output micro-op
 
 class VaxDecoder(Elaboratable):
-    def __init__(self):
+    # Pipelined instruction decoder, built around the operand decoders of VaxDecoderTest. It takes
+    # a window of instruction bytes starting at o_addr and hands out one decoded instruction per
+    # cycle when it fits in the window; longer ones take a cycle for each window they span.
+    #
+    # With `issue=2` a second VaxDecoderTest starts where the first instruction ends, so two
+    # instructions come out of one window when both fit in it. The second slot (the *2 outputs)
+    # is only ever valid along with the first and is taken with it.
+    #
+    # Branch displacements are sign extended and added to the address of the next instruction as
+    # the instruction is decoded, giving o_target. With `predict` set, unconditional branches and
+    # backward conditional ones (loops) are predicted taken: decoding continues at the target and
+    # o_redirect/o_redirect_target tell the fetch side in the same cycle. It is off by default, so
+    # o_addr only moves on by o_advance unless i_redirect says otherwise; FrontEnd turns it on.
+    #
+    # With `cache_sets` set, instructions decoded from a single window are also kept in a
+    # DecodeCache of that many sets of `cache_ways` entries. When the instruction at o_addr is in
+    # the cache, o_hit is set and it's handed out from there: the window is then consumed when
+    # o_ready is set, whether or not i_valid is, and the producer should skip the o_advance bytes
+    # it covers. i_invalidate drops the entries a write to instruction memory might change.
+    #
+    # With `counters` set, a DecodeCounters (see counters.py, which needs luna-soc) counts
+    # instructions, stalls, split instructions, illegal specifiers and specifier lengths, and
+    # `bus` is its CSR bus.
+    #
+    # With `agen` set, an AddressGenerator (see agen.py) works out the effective addresses of
+    # displacement and absolute specifiers as they are decoded, from a register file read port
+    # per operand (o_reg/i_reg_data), and hands them out with the instruction in o_ea/o_ea_valid,
+    # along with the memory reads they need (o_read/o_read_length). i_busy marks the registers
+    # that the instructions decoded but not yet retired may still write; operands based on them
+    # are left without an address. The second issue slot gets no addresses.
+    #
+    # `shared` is passed on to the VaxDecoderTest windows.
+    #
+    # Both sides use valid/ready handshakes: a window is consumed when i_valid and o_ready are set,
+    # moving o_addr on by o_advance bytes, and instructions are taken when o_valid and i_ready are.
+    def __init__(self, width=1 + 6*6, boundary="ripple", issue=1, predict=False, cache_sets=0, cache_ways=1,
+                 counters=False, shared=False, agen=False):
+        if issue not in (1, 2):
+            raise ValueError(f"Issue width must be 1 or 2, not {issue}")
+
+        self.width      = width
+        self.boundary   = boundary
+        self.shared     = shared
+        self.issue      = issue
+        self.predict    = predict
+        self.cache_sets = cache_sets
+        self.cache_ways = cache_ways
+
+        self.counters = None
+        if counters:
+            from .counters import DecodeCounters
+            self.counters = DecodeCounters(max_events=2 * MAX_OPERANDS)
+            self.bus      = self.counters.bus
+
+        self.agen = None
+        if agen:
+            from .agen import AddressGenerator
+            self.agen       = AddressGenerator()
+            self.o_reg      = self.agen.o_reg
+            self.i_reg_data = self.agen.i_reg_data
+            self.i_busy     = self.agen.i_busy
+
         # Input data for the decoder; little endian.
-        self.i_data = Signal(48)
+        self.i_data  = Signal(width*8)
+        self.i_valid = Signal()
+        self.o_ready = Signal()
+
+        # Current data address. o_more is set when the window only holds the start of an
+        # instruction: its last operand ends on the byte at o_addr + o_advance, where the next
+        # window resumes.
+        self.o_addr    = Signal(32)
+        self.o_advance = Signal(range(width + 17))
+        self.o_more    = Signal()
+
+        # Restarts decoding at i_target, dropping a partly decoded instruction
+        self.i_redirect = Signal()
+        self.i_target   = Signal(32)
+
+        # Decoding continues at o_redirect_target after a branch predicted taken
+        self.o_redirect        = Signal()
+        self.o_redirect_target = Signal(32)
 
-        # Current data address
-        self.o_addr = Signal(32)
+        # Decoded-instruction cache hit for o_addr, and writes to instruction memory
+        self.o_hit             = Signal()
+        self.i_invalidate      = Signal()
+        self.i_invalidate_addr = Signal(32)
+
+        # The decoded instruction, operand fields are as in VaxDecoderTest but with o_end counted
+        # from the start of the instruction
+        self.o_valid    = Signal()
+        self.i_ready    = Signal()
+        self.o_pc       = Signal(32)
+        self.o_opcode   = Signal(Opcode)
+        self.o_length   = Signal(8)
+        self.o_count    = Signal(range(MAX_OPERANDS + 1))
+        self.o_spec     = [Signal(16, name=f"o_spec{operand + 1}") for operand in range(MAX_OPERANDS)]
+        self.o_immed    = [Signal(32, name=f"o_immed{operand + 1}") for operand in range(MAX_OPERANDS)]
+        self.o_end      = [Signal(8, name=f"o_end{operand + 1}") for operand in range(MAX_OPERANDS)]
+        self.o_deferred = Signal(MAX_OPERANDS)
+        self.o_immvalid = Signal(MAX_OPERANDS)
+        self.o_legalop  = Signal(MAX_OPERANDS)
+        self.o_branch   = Signal() # has a branch displacement, and o_target is where it goes
+        self.o_target   = Signal(32)
+        self.o_taken    = Signal() # predicted taken
+
+        # Effective addresses worked out early, when agen is set, and the memory reads to start
+        self.o_ea          = [Signal(32, name=f"o_ea{operand + 1}") for operand in range(MAX_OPERANDS)]
+        self.o_ea_valid    = Signal(MAX_OPERANDS)
+        self.o_read        = Signal(MAX_OPERANDS)
+        self.o_read_length = [Signal(Length, name=f"o_read_length{operand + 1}") for operand in range(MAX_OPERANDS)]
+
+        # The instruction following it, when issue=2
+        self.o_valid2    = Signal()
+        self.o_pc2       = Signal(32)
+        self.o_opcode2   = Signal(Opcode)
+        self.o_length2   = Signal(8)
+        self.o_count2    = Signal(range(MAX_OPERANDS + 1))
+        self.o_spec2     = [Signal(16, name=f"o_spec{operand + 1}_2") for operand in range(MAX_OPERANDS)]
+        self.o_immed2    = [Signal(32, name=f"o_immed{operand + 1}_2") for operand in range(MAX_OPERANDS)]
+        self.o_end2      = [Signal(8, name=f"o_end{operand + 1}_2") for operand in range(MAX_OPERANDS)]
+        self.o_deferred2 = Signal(MAX_OPERANDS)
+        self.o_immvalid2 = Signal(MAX_OPERANDS)
+        self.o_legalop2  = Signal(MAX_OPERANDS)
+        self.o_branch2   = Signal()
+        self.o_target2   = Signal(32)
+        self.o_taken2    = Signal()
 
     def elaborate(self, platform):
         m = Module()
 
-        opcode = Signal(Opcode)
+        m.submodules.window = window = VaxDecoderTest(boundary=self.boundary, width=self.width, shared=self.shared)
+
+        # Instruction being continued from the previous window
+        resume  = Signal()
+        opcode  = Signal(16)
+        operand = Signal(range(MAX_OPERANDS))
+
+        m.d.comb += [
+            window.i_data.eq(self.i_data),
+            window.i_resume.eq(resume),
+            window.i_opcode.eq(opcode),
+            window.i_operand.eq(operand),
+
+            self.o_ready.eq(~self.o_valid | self.i_ready),
+            self.o_advance.eq(window.o_length),
+            self.o_more.eq(window.o_more),
+        ]
 
-        operand = Signal(48) # 48 bits holds longword displacement indexed.
-        operand_valid_bytes = Signal(6)
+        end = self.o_addr + window.o_length
+        branch, target, taken = self._branch(m, window, Mux(resume, opcode, self.i_data[0:16]), end)
 
-        with m.FSM():
-            with m.State("START"):
-                # For now this only looks at the very first operand.
-                # For increased performance one would want to examine as much of the instruction as possible.
+        # Instruction at o_addr found in the decoded-instruction cache, and its prediction
+        hit        = Signal()
+        hit_taken  = Signal()
+        hit_target = Signal(32)
+        if self.cache_sets:
+            from .dcache import DecodeCache
+            m.submodules.cache = cache = DecodeCache(sets=self.cache_sets, ways=self.cache_ways, length=self.width)
+            entry = cache.o_entry
+            m.d.comb += [
+                hit.eq(cache.o_hit & ~resume),
+                hit_taken.eq(entry.taken),
+                hit_target.eq(entry.target),
+                cache.i_invalidate.eq(self.i_invalidate),
+                cache.i_invalidate_addr.eq(self.i_invalidate_addr),
+            ]
+            with m.If(hit):
+                m.d.comb += [
+                    self.o_advance.eq(entry.length),
+                    self.o_more.eq(0),
+                ]
+
+        fire = Signal()
+        m.d.comb += [
+            self.o_hit.eq(hit),
+            fire.eq(~self.i_redirect & self.o_ready & (self.i_valid | hit)),
+        ]
+
+        # The second instruction is decoded from the bytes after the first one, which read as zero
+        # past the end of the window. That is harmless: an instruction using any of them ends past
+        # the window edge, is dropped here and decoded as the first instruction next cycle.
+        paired = Signal()
+        if self.issue == 2:
+            m.submodules.window2 = window2 = VaxDecoderTest(boundary=self.boundary, width=self.width, shared=self.shared)
+            m.d.comb += [
+                window2.i_data.eq(self.i_data >> Cat(C(0, 3), window.o_length)),
+                paired.eq(
+                    ~resume & ~hit & ~window.o_more & ~window2.o_more &
+                    (window.o_length + window2.o_length <= self.width) &
+                    ~(taken & self.predict)
+                ),
+            ]
+            with m.If(paired):
+                m.d.comb += self.o_advance.eq(window.o_length + window2.o_length)
 
-                with m.If(self.i_data[:8].matches(Opcode.EXOPFD, Opcode.EXOPFE, Opcode.EXOPFF)):
-                    m.d.sync += opcode.eq(self.i_data[:16])
+            branch2, target2, taken2 = self._branch(m, window2, window2.i_data[0:16], end + window2.o_length, "2")
+        else:
+            target2, taken2 = C(0, 32), C(0)
+
+        if self.predict:
+            with m.If(fire & Mux(hit, hit_taken, taken | (paired & taken2))):
+                m.d.comb += [
+                    self.o_redirect.eq(1),
+                    self.o_redirect_target.eq(Mux(hit, hit_target, Mux(taken, target, target2))),
+                ]
+
+        with m.If(self.i_ready):
+            m.d.sync += [
+                self.o_valid.eq(0),
+                self.o_valid2.eq(0),
+            ]
+
+        next_addr = Signal(32)
+        m.d.comb += next_addr.eq(Mux(self.o_redirect, self.o_redirect_target, self.o_addr + self.o_advance))
+        if self.cache_sets:
+            m.d.comb += cache.i_addr.eq(Mux(self.i_redirect, self.i_target, Mux(fire, next_addr, self.o_addr)))
+
+        with m.If(self.i_redirect):
+            m.d.sync += [
+                self.o_addr.eq(self.i_target),
+                resume.eq(0),
+            ]
+        if self.cache_sets:
+            with m.Elif(fire & hit):
+                m.d.sync += [
+                    self.o_addr.eq(next_addr),
+                    self.o_valid.eq(1),
+                    self.o_pc.eq(self.o_addr),
+                    self.o_length.eq(entry.length),
+                    self.o_opcode.eq(entry.opcode),
+                    self.o_count.eq(entry.count),
+                    self.o_deferred.eq(entry.deferred),
+                    self.o_immvalid.eq(entry.immvalid),
+                    self.o_legalop.eq(entry.legalop),
+                    self.o_branch.eq(entry.branch),
+                    self.o_target.eq(entry.target),
+                    self.o_taken.eq(entry.taken),
+                ]
+                for n in range(MAX_OPERANDS):
+                    m.d.sync += [
+                        self.o_spec[n].eq(entry.spec[n]),
+                        self.o_immed[n].eq(entry.immed[n]),
+                        self.o_end[n].eq(entry.end[n]),
+                    ]
+        with m.Elif(fire):
+            m.d.sync += [
+                self.o_addr.eq(next_addr),
+                self.o_valid.eq(~window.o_more),
+                self.o_branch.eq(branch),
+                self.o_target.eq(target),
+                self.o_taken.eq(taken),
+                resume.eq(window.o_more),
+                opcode.eq(Mux(resume, opcode, self.i_data[0:16])),
+                operand.eq(window.o_operand),
+            ]
+
+            with m.If(resume):
+                m.d.sync += self.o_length.eq(self.o_length + window.o_length)
+            with m.Else():
+                m.d.sync += [
+                    self.o_pc.eq(self.o_addr),
+                    self.o_length.eq(window.o_length),
+                ]
+            self._capture(m, window, resume, Mux(resume, self.o_length, 0), self.o_opcode, self.o_count,
+                          self.o_spec, self.o_immed, self.o_end, self.o_deferred, self.o_immvalid, self.o_legalop)
+
+            if self.issue == 2:
+                m.d.sync += [
+                    self.o_valid2.eq(paired),
+                    self.o_pc2.eq(end),
+                    self.o_length2.eq(window2.o_length),
+                    self.o_branch2.eq(branch2),
+                    self.o_target2.eq(target2),
+                    self.o_taken2.eq(taken2),
+                ]
+                self._capture(m, window2, C(0), C(0), self.o_opcode2, self.o_count2,
+                              self.o_spec2, self.o_immed2, self.o_end2, self.o_deferred2, self.o_immvalid2, self.o_legalop2)
+
+            # Instructions decoded from a single window go into the cache
+            if self.cache_sets:
+                fill    = cache.i_fill_entry
+                decoded = window.o_decoded
+                data    = self.i_data
+                m.d.comb += [
+                    cache.i_fill.eq(~resume & ~window.o_more),
+                    cache.i_fill_addr.eq(self.o_addr),
+                    fill.opcode.eq(Mux(data[0:8].matches(Opcode.EXOPFD, Opcode.EXOPFE, Opcode.EXOPFF), data[0:16], data[0:8])),
+                    fill.length.eq(window.o_length),
+                    fill.count.eq(window.o_count),
+                    fill.deferred.eq(decoded & window.o_deferred),
+                    fill.immvalid.eq(decoded & window.o_immvalid),
+                    fill.legalop.eq(~decoded | window.o_legalop),
+                    fill.branch.eq(branch),
+                    fill.target.eq(target),
+                    fill.taken.eq(taken),
+                ]
+                for n in range(MAX_OPERANDS):
                     m.d.comb += [
-                        operand.eq(self.i_data),
-                        operand_valid_bytes.eq(0b111100),
+                        fill.spec[n].eq(Mux(decoded[n], window.o_spec[n], 0)),
+                        fill.immed[n].eq(Mux(decoded[n], window.o_immed[n], 0)),
+                        fill.end[n].eq(Mux(decoded[n], window.o_end[n], 0)),
                     ]
-                with m.Else():
-                    m.d.sync += opcode.eq(self.i_data[:8])
+
+        if self.agen is not None:
+            m.submodules.agen = agen = self.agen
+
+            # Registers changed by the operands of an instruction decoded so far
+            modified = Signal(16)
+
+            m.d.comb += [
+                agen.i_addr.eq(self.o_addr),
+                agen.i_opcode.eq(Mux(resume, opcode, self.i_data[0:16])),
+                agen.i_decoded.eq(window.o_decoded),
+                agen.i_modified.eq(Mux(resume, modified, 0)),
+            ]
+            m.d.comb += [
+                field.eq(value)
+                for n in range(MAX_OPERANDS)
+                for field, value in ((agen.i_spec[n], window.o_spec[n]), (agen.i_immed[n], window.o_immed[n]),
+                                     (agen.i_end[n], window.o_end[n]))
+            ]
+            if self.cache_sets:
+                with m.If(hit):
                     m.d.comb += [
-                        operand.eq(self.i_data),
-                        operand_valid_bytes.eq(0b111110),
+                        agen.i_opcode.eq(entry.opcode),
+                        agen.i_decoded.eq((C(1, MAX_OPERANDS + 1) << entry.count) - 1),
                     ]
+                    m.d.comb += [
+                        field.eq(value)
+                        for n in range(MAX_OPERANDS)
+                        for field, value in ((agen.i_spec[n], entry.spec[n]), (agen.i_immed[n], entry.immed[n]),
+                                             (agen.i_end[n], entry.end[n]))
+                    ]
+
+            with m.If(fire):
+                m.d.sync += modified.eq(agen.o_modified)
+                for n in range(MAX_OPERANDS):
+                    # As in _capture, a resumed instruction keeps the addresses of its earlier windows
+                    with m.If(agen.i_decoded[n] | ~resume):
+                        m.d.sync += [
+                            self.o_ea[n].eq(agen.o_ea[n]),
+                            self.o_ea_valid[n].eq(agen.o_ea_valid[n]),
+                            self.o_read[n].eq(agen.o_read[n]),
+                            self.o_read_length[n].eq(agen.o_read_length[n]),
+                        ]
+
+        if self.counters is not None:
+            m.submodules.counters = counters = self.counters
+
+            # Operands sized by the operand decoders, which a cache hit skips
+            windows = [(window, fire & ~hit)]
+            if self.issue == 2:
+                windows.append((window2, fire & paired))
+            handed = self.o_valid & self.i_ready
+            m.d.comb += [
+                counters.i_instructions.eq(handed + (handed & self.o_valid2)),
+                counters.i_stalled.eq(~self.i_redirect & self.o_ready & ~self.i_valid & ~hit),
+                counters.i_split.eq(fire & ~hit & ~resume & window.o_more),
+                counters.i_illegal.eq(sum(handed & ~self.o_legalop[n] for n in range(MAX_OPERANDS)) +
+                                      sum(handed & self.o_valid2 & ~self.o_legalop2[n] for n in range(MAX_OPERANDS))),
+            ]
+            for length, count in enumerate(counters.i_lengths):
+                m.d.comb += count.eq(sum(
+                    used & decoder.o_decoded[n] & decoder.o_speclen[n][length]
+                    for decoder, used in windows for n in range(MAX_OPERANDS)
+                ))
 
         return m
 
+    @staticmethod
+    def _branch(m, window, opcode, end, suffix=""):
+        # The branch displacement of the instruction a window completes, ending at `end`: whether
+        # there is one, its target and whether it's predicted taken
+        found        = window.o_branch & window.o_decoded
+        displacement = _or_tree([Mux(found[n], window.o_immed[n], 0) for n in range(MAX_OPERANDS)])
+
+        branch = Signal(name=f"branch{suffix}")
+        target = Signal(32, name=f"target{suffix}")
+        taken  = Signal(name=f"taken{suffix}")
+        m.d.comb += [
+            branch.eq(found.any() & ~window.o_more),
+            target.eq(end + displacement),
+            taken.eq(branch & (opcode[0:8].matches(Opcode.BRB, Opcode.BRW, Opcode.BSBB, Opcode.BSBW) | displacement[31])),
+        ]
+        return branch, target, taken
+
+    @staticmethod
+    def _capture(m, window, resume, offset, opcode, count, spec, immed, end, deferred, immvalid, legalop):
+        # Loads the opcode and operand fields a window decoded, merging them with those from the
+        # previous windows when `resume` is set. The window starts `offset` bytes into the instruction.
+        with m.If(~resume):
+            data        = window.i_data
+            is_extended = data[0:8].matches(Opcode.EXOPFD, Opcode.EXOPFE, Opcode.EXOPFF)
+            m.d.sync += [
+                opcode.eq(Mux(is_extended, data[0:16], data[0:8])),
+                count.eq(window.o_count),
+            ]
+
+        for n in range(MAX_OPERANDS):
+            # A new instruction starts from clear operands, a resumed one keeps those it has
+            with m.If(window.o_decoded[n] | ~resume):
+                m.d.sync += [
+                    spec[n].eq(Mux(window.o_decoded[n], window.o_spec[n], 0)),
+                    immed[n].eq(Mux(window.o_decoded[n], window.o_immed[n], 0)),
+                    end[n].eq(Mux(window.o_decoded[n], offset + window.o_end[n], 0)),
+                    deferred[n].eq(window.o_decoded[n] & window.o_deferred[n]),
+                    immvalid[n].eq(window.o_decoded[n] & window.o_immvalid[n]),
+                    legalop[n].eq(~window.o_decoded[n] | window.o_legalop[n]),
+                ]
+
+
+class IssueStats:
+    # Counts how often the second slot of VaxDecoder(issue=2) would be filled, given the retired
+    # (or disassembled) instruction stream in order. A pair needs the second instruction to
+    # follow the first in memory (no taken branch in between) and both to fit in the window.
+    def __init__(self, width=1 + 6*6):
+        self.width  = width
+        self.cycles = 0 # cycles starting a new instruction
+        self.paired = 0 # of which also delivered a second one
+        self._first = None
+
+    def add(self, addr, length):
+        first, self._first = self._first, None
+        if first is not None and addr == first[0] and first[1] + length <= self.width:
+            self.paired += 1
+            return
+        self.cycles += 1
+        if length <= self.width:
+            self._first = (addr + length, length)
+
+    @property
+    def rate(self):
+        return self.paired / self.cycles if self.cycles else 0.0
+
+
+def _or_tree(values):
+    # OR of `values` as a balanced tree, rather than the chain a loop would give
+    if len(values) <= 1:
+        return values[0] if values else C(0)
+    return _or_tree(values[:len(values) // 2]) | _or_tree(values[len(values) // 2:])
+
 
 class VaxDecoderTest(Elaboratable):
-    def __init__(self):
-        self.width = 1 + 6*6
+    # `lookup` selects how the operand lengths are derived from the opcode:
+    # - "rom": a single OpcodeAttributes lookup (also provides o_count)
+    # - "mux": the original per-opcode If chains, kept around for comparison
+    #
+    # `boundary` selects how the operand start bytes (and the operand index of each decoder) are found:
+    # - "ripple": each decoder waits on the lengths of the decoders before it, linear depth
+    # - "prefix": pointer jumping over separate length probes, logarithmic depth but more area
+    # Both produce the same o_operands and decoder i_operidx. "ripple" stays the default until
+    # there is Fmax data to go by: synth.py only has gate counts and depth so far, and on the
+    # 37 byte window prefix costs four times the gates (108146 against 26619) for under a third
+    # of the depth (155 against 528 levels).
+    #
+    # With `shared` set the operand decoders are SharedOperandDecoders, which the netlist module
+    # emits as instances of a single module definition instead of one copy per decoder.
+    #
+    # `stages` pipelines the operand decoders, see OperandDecoder. Their outputs then belong to
+    # the window of `latency` cycles before, so the window and the resume inputs are delayed by as
+    # many registers for everything else, boundary chain included, and the outputs follow the
+    # inputs `latency` cycles later. VaxDecoder picks its next window from o_length in the same
+    # cycle, so it keeps combinational ones.
+    def __init__(self, lookup="rom", boundary="ripple", width=1 + 6*6, decoders=None, shared=False, stages=()):
+        if lookup not in ("rom", "mux"):
+            raise ValueError(f"Unknown opcode lookup '{lookup}', expected 'rom' or 'mux'")
+        if boundary not in ("ripple", "prefix"):
+            raise ValueError(f"Unknown boundary network '{boundary}', expected 'ripple' or 'prefix'")
+        for stage in stages:
+            if stage not in STAGES:
+                raise ValueError(f"Unknown OperandDecoder stage '{stage}', expected one of {', '.join(STAGES)}")
+
+        # Only 31 operand decoders are needed to decode 37 bytes of instruction stream.
+        # - the first byte is always an opcode byte.
+        # - a longword displacement indexed operand is 6 bytes.
+        # - an INDEX opcode has 6 operands, so you need 5*6 decoders for 5 operands, and then a 31st for the 6th operand byte.
+        # Smaller windows decode the instructions that don't fit over several cycles (see o_more).
+        # The width sweep in synth.py only has gate counts and depth, no Fmax, so the default
+        # stays at the full 37 bytes until there are timing numbers to trade against.
+        if decoders is None:
+            decoders = width - 6
+        if width < 8:
+            raise ValueError(f"Window width must be at least 8 bytes to fit an extended opcode and an operand, not {width}")
+        if not 2 <= decoders < width:
+            raise ValueError(f"Decoder count must be between 2 and {width - 1} for a {width} byte window, not {decoders}")
+
+        self.width    = width
+        self.decoders = decoders
+        self.lookup   = lookup
+        self.boundary = boundary
+        self.shared   = shared
+        self.stages   = tuple(stage for stage in STAGES if stage in stages)
+        self.latency  = len(self.stages)
 
         self.i_data = Signal(self.width*8)
 
+        # Continues an instruction that didn't fit in the previous window. Byte 0 is then the last
+        # byte of the previous operand, so operand i_operand of i_opcode starts at byte 1.
+        self.i_resume  = Signal()
+        self.i_opcode  = Signal(16)
+        self.i_operand = Signal(range(MAX_OPERANDS))
+
         self.o_operands = Signal(self.width)
+        self.o_count    = Signal(range(MAX_OPERANDS + 1))
+
+        # The operands of the opcode that are branch displacements
+        self.o_branch = Signal(MAX_OPERANDS)
+
+        # o_more is set when the rest of the instruction is past the window or the decoders. Either
+        # way o_length is how far to advance the window: the instruction length when it fits, or up
+        # to the byte before operand o_operand, which the next window should resume at. It can be
+        # past the end of the window when skipping the high bytes of a long immediate.
+        self.o_more    = Signal()
+        self.o_length  = Signal(range(self.width + 17))
+        self.o_operand = Signal(range(MAX_OPERANDS))
+
+        # The operands completed in this window, by operand index, and what their decoders found.
+        # o_spec holds the first two bytes of the specifier, the second being the base of an indexed one,
+        # and o_end the window byte just past the operand.
+        self.o_decoded  = Signal(MAX_OPERANDS)
+        self.o_spec     = [Signal(16, name=f"o_spec{operand + 1}") for operand in range(MAX_OPERANDS)]
+        self.o_immed    = [Signal(32, name=f"o_immed{operand + 1}") for operand in range(MAX_OPERANDS)]
+        self.o_end      = [Signal(range(self.width + 17), name=f"o_end{operand + 1}") for operand in range(MAX_OPERANDS)]
+        self.o_deferred = Signal(MAX_OPERANDS)
+        self.o_immvalid = Signal(MAX_OPERANDS)
+        self.o_legalop  = Signal(MAX_OPERANDS)
+
+        # The o_length of the operand decoder of each operand: bit j for a j+1 byte specifier,
+        # with quadword and octaword immediates as 6 bytes
+        self.o_speclen = [Signal(6, name=f"o_speclen{operand + 1}") for operand in range(MAX_OPERANDS)]
 
     def elaborate(self, platform):
         m = Module()
@@ -277,59 +824,377 @@ class VaxDecoderTest(Elaboratable):
         operlen4 = Signal(Length)
         operlen5 = Signal(Length)
         operlen6 = Signal(Length)
+        operlens = [operlen1, operlen2, operlen3, operlen4, operlen5, operlen6]
+        fixed    = Signal(MAX_OPERANDS)
+        count    = Signal.like(self.o_count)
+        branch   = Signal.like(self.o_branch)
 
-        # Only 31 operand decoders are needed to decode 37 bytes of instruction stream.
-        # - the first byte is always an opcode byte.
-        # - a longword displacement indexed operand is 6 bytes.
-        # - an INDEX opcode has 6 operands, so you need 5*6 decoders for 5 operands, and then a 31st for the 6th operand byte.
-        operands = [None] + [OperandDecoder() for _ in range(5*6 + 1)]
-        for i in range(1, 5*6 + 2):
-            m.submodules[f"decoder_{i}"] = decoder = operands[i]
+        opcode = Signal(16)
+        first  = Signal(range(MAX_OPERANDS))
+        m.d.comb += [
+            opcode.eq(Mux(self.i_resume, self.i_opcode, self.i_data[0:16])),
+            first.eq(Mux(self.i_resume, self.i_operand, 0)),
+        ]
 
-            valid = []
-            for j in range(1, 6):
-                if i > (j + 1):
-                    valid.append((i-j, operands[i-j].o_length[j]))
-            valid_signal = Cat([signal for _, signal in valid])
+        # the "seed"
+        is_extended = ~self.i_resume & self.i_data[0:8].matches(Opcode.EXOPFD, Opcode.EXOPFE, Opcode.EXOPFF)
 
-            for j in range(len(valid_signal)):
-                case = ["-"] * len(valid_signal)
-                case[j] = "1"
-                with m.If(valid_signal.matches(''.join(case))):
-                    m.d.comb += decoder.i_operidx.eq(operands[valid[j][0]].o_nextidx)
+        # Pipelined operand decoders (`stages`) hand out their outputs `latency` cycles after the
+        # window. The opcode lookups below only depend on the window too, so they go in the same
+        # stages, and the boundary network and instruction end get both from the registers.
+        late = self._delayed(m, {
+            "data":        self.i_data,
+            "first":       first,
+            "is_extended": is_extended,
+            "count":       count,
+            "branch":      branch,
+            "fixed":       fixed,
+            **{operlen.name: operlen for operlen in operlens},
+        })
+        data = late["data"]
+        seed = Mux(late["is_extended"], 2, 1)
+        m.d.comb += [
+            self.o_count.eq(late["count"]),
+            self.o_branch.eq(late["branch"]),
+        ]
 
-            m.d.comb += [
-                self.o_operands[i].eq(valid_signal.any()),
+        operands = [None] + [self._operand_decoder() for _ in range(self.decoders)]
+        for i in range(1, self.decoders + 1):
+            m.submodules[f"decoder_{i}"] = decoder = operands[i]
 
+            m.d.comb += [
+                # ahead of `data`, see OperandDecoder.stages
                 decoder.i_data.eq(self.i_data.bit_select(8 * i, 48)),
                 decoder.i_valid.eq(self.o_operands[i]),
-                decoder.i_operlen1.eq(operlen1),
-                decoder.i_operlen2.eq(operlen2),
-                decoder.i_operlen3.eq(operlen3),
-                decoder.i_operlen4.eq(operlen4),
-                decoder.i_operlen5.eq(operlen5),
-                decoder.i_operlen6.eq(operlen6),
+                decoder.i_operlen1.eq(late["operlen1"]),
+                decoder.i_operlen2.eq(late["operlen2"]),
+                decoder.i_operlen3.eq(late["operlen3"]),
+                decoder.i_operlen4.eq(late["operlen4"]),
+                decoder.i_operlen5.eq(late["operlen5"]),
+                decoder.i_operlen6.eq(late["operlen6"]),
+                decoder.i_fixed.eq(late["fixed"]),
             ]
 
-        # the "seed"
-        with m.If(self.i_data[0:8].matches(Opcode.EXOPFD, Opcode.EXOPFE, Opcode.EXOPFF)):
+        late_operlens = [late[operlen.name] for operlen in operlens]
+        if self.boundary == "ripple":
+            self._ripple_boundaries(m, operands, late["is_extended"])
+        else:
+            self._prefix_boundaries(m, data, operands, late_operlens, late["fixed"], late["is_extended"])
+
+        opcode_operlens = [Signal(Length, name=f"opcode_operlen{operand + 1}") for operand in range(MAX_OPERANDS)]
+        opcode_fixed    = Signal(MAX_OPERANDS)
+        if self.lookup == "rom":
+            m.submodules.attributes = attributes = OpcodeAttributes()
+            m.d.comb += [
+                attributes.i_opcode.eq(opcode),
+                count.eq(attributes.o_count),
+                branch.eq(attributes.o_branch),
+                opcode_fixed.eq(attributes.o_fixed),
+                opcode_operlens[0].eq(attributes.o_operlen1),
+                opcode_operlens[1].eq(attributes.o_operlen2),
+                opcode_operlens[2].eq(attributes.o_operlen3),
+                opcode_operlens[3].eq(attributes.o_operlen4),
+                opcode_operlens[4].eq(attributes.o_operlen5),
+                opcode_operlens[5].eq(attributes.o_operlen6),
+            ]
+        else:
+            m.submodules.count = operand_count = OpcodeOperandCount()
+            m.d.comb += [
+                operand_count.i_opcode.eq(opcode),
+                count.eq(operand_count.o_count),
+            ]
+
+            def opcode_is(value):
+                return opcode[0:16 if value.value > 0xff else 8] == value
+
+            for operand in range(MAX_OPERANDS):
+                for value in Opcode.nth_op_byte_insns(operand):
+                    with m.If(opcode_is(value)):
+                        m.d.comb += opcode_operlens[operand].eq(Length.BYTE)
+                for value in Opcode.nth_op_word_insns(operand):
+                    with m.If(opcode_is(value)):
+                        m.d.comb += opcode_operlens[operand].eq(Length.WORD)
+                for value in Opcode.nth_op_long_insns(operand):
+                    with m.If(opcode_is(value)):
+                        m.d.comb += opcode_operlens[operand].eq(Length.LONG)
+                for value in Opcode.nth_op_quad_insns(operand):
+                    with m.If(opcode_is(value)):
+                        m.d.comb += opcode_operlens[operand].eq(Length.QUAD)
+                for value in Opcode.nth_op_octa_insns(operand):
+                    with m.If(opcode_is(value)):
+                        m.d.comb += opcode_operlens[operand].eq(Length.OCTA)
+
+            table = Opcode.table()
+            for value in table.opcodes:
+                for operand in range(table.operand_count(value)):
+                    kind = table.operand_access(value, operand)
+                    if kind in ("b", "i"):
+                        with m.If(opcode_is(value)):
+                            m.d.comb += opcode_fixed[operand].eq(1)
+                    if kind == "b":
+                        with m.If(opcode_is(value)):
+                            m.d.comb += branch[operand].eq(1)
+
+        # The decoders count operands from the start of the window, so a resumed instruction has
+        # its operand lengths rotated to put operand i_operand first.
+        for operand, operlen in enumerate(operlens):
+            with m.Switch(first):
+                for rotation in range(MAX_OPERANDS):
+                    with m.Case(rotation):
+                        m.d.comb += [
+                            operlen.eq(opcode_operlens[(operand + rotation) % MAX_OPERANDS]),
+                            fixed[operand].eq(opcode_fixed[(operand + rotation) % MAX_OPERANDS]),
+                        ]
+
+        self._instruction_end(m, data, operands, late_operlens, seed, late["first"])
+
+        return m
+
+    def _operand_decoder(self):
+        return SharedOperandDecoder(self.stages) if self.shared else OperandDecoder(self.stages)
+
+    def _delayed(self, m, values):
+        # `values` by name, through a register for each of `stages`
+        for stage in self.stages:
+            delayed = {}
+            for name, value in values.items():
+                delayed[name] = Signal.like(value, name=f"{stage}_window_{name}")
+                m.d.sync += delayed[name].eq(value)
+            values = delayed
+        return values
+
+    def _instruction_end(self, m, data, operands, operlens, seed, first):
+        # Finds where each of the first six operands of the window ends and whether it's complete.
+        # Operands past the sixth reuse the operand indices, so the first decoder with an index wins.
+        remaining = Signal(range(MAX_OPERANDS + 1))
+        m.d.comb += remaining.eq(self.o_count - first)
+
+        # OperandDecoder sizes quadword and octaword immediates as 6 bytes, as they don't fit its
+        # o_length. Their real end is computed here, and as the boundaries found after them are
+        # wrong they end what can be decoded from the window. Only their low longword is decoded,
+        # so once that is in the window the rest can be skipped even if it's past the end.
+        is_quad = Cat(operlen == Length.QUAD for operlen in operlens)
+        is_octa = Cat(operlen == Length.OCTA for operlen in operlens)
+
+        ends     = []
+        long_imm = []
+        for p in range(1, self.decoders + 1):
+            decoder = operands[p]
+            length  = decoder.o_length
+            is_long = Signal(name=f"decoder_long_imm{p}")
+            end     = Signal(range(self.width + 17), name=f"decoder_end{p}")
+            m.d.comb += [
+                is_long.eq((data.word_select(p, 8) == 0x8F) & (decoder.i_operidx & (is_quad | is_octa)).any()),
+                end.eq(Mux(is_long,
+                    p + 1 + Mux((decoder.i_operidx & is_octa).any(), 16, 8),
+                    p + Cat(
+                        length[0] | length[2] | length[4],
+                        length[1] | length[2] | length[5],
+                        length[3] | length[4] | length[5],
+                    )
+                )),
+            ]
+            ends.append(end)
+            long_imm.append(is_long)
+
+        operand_ends = []
+        done     = Signal(MAX_OPERANDS)
+        is_long  = Signal(MAX_OPERANDS)
+        fields   = []
+        for n in range(MAX_OPERANDS):
+            # operand n can't start before byte n + 1
+            candidates = range(n + 1, self.decoders + 1)
+            starts = [operands[p].i_valid & operands[p].i_operidx[n] for p in candidates]
+            found  = [start & ~Cat(starts[:index]).any() for index, start in enumerate(starts)]
+
+            def select(field):
+                return _or_tree([Mux(hit, field(p), 0) for hit, p in zip(found, candidates)])
+
+            operand_end = Signal(range(self.width + 17), name=f"operand_end{n}")
+            m.d.comb += [
+                operand_end.eq(select(lambda p: ends[p - 1])),
+                done[n].eq(Cat(hit & Mux(long_imm[p - 1], p + 5 <= self.width, ends[p - 1] <= self.width) for hit, p in zip(found, candidates)).any()),
+                is_long[n].eq(Cat(hit & long_imm[p - 1] for hit, p in zip(found, candidates)).any()),
+            ]
+            operand_ends.append(operand_end)
+            fields.append((
+                select(lambda p: data[8 * p:8 * p + 16]),
+                select(lambda p: operands[p].o_immed),
+                operand_end,
+                select(lambda p: operands[p].o_deferred),
+                select(lambda p: operands[p].o_immvalid),
+                select(lambda p: operands[p].o_legalop),
+                select(lambda p: operands[p].o_length),
+            ))
+
+        # Decoding stops at the first operand that didn't fit or that is a long immediate
+        stop = Signal(range(MAX_OPERANDS + 1))
+        m.d.comb += stop.eq(MAX_OPERANDS)
+        for n in reversed(range(MAX_OPERANDS)):
+            with m.If(~done[n] | is_long[n]):
+                m.d.comb += stop.eq(n)
+
+        # decoded: operands completed in this window, in window order
+        decoded = Signal(range(MAX_OPERANDS + 1))
+        with m.If(stop >= remaining):
+            m.d.comb += [
+                decoded.eq(remaining),
+                self.o_length.eq(Mux(remaining == 0, seed, Array(operand_ends)[remaining - 1])),
+            ]
+        with m.Elif(done.bit_select(stop, 1)):
+            # a long immediate that fits, resume after it
+            m.d.comb += [
+                decoded.eq(stop + 1),
+                self.o_more.eq(stop + 1 < remaining),
+                self.o_length.eq(Array(operand_ends)[stop] - (stop + 1 < remaining)),
+                self.o_operand.eq(first + stop + 1),
+            ]
+        with m.Else():
+            m.d.comb += [
+                decoded.eq(stop),
+                self.o_more.eq(1),
+                self.o_length.eq(Mux(stop == 0, seed, Array(operand_ends)[stop - 1]) - 1),
+                self.o_operand.eq(first + stop),
+            ]
+
+        # Operand fields, by operand index rather than window order
+        with m.Switch(first):
+            for rotation in range(MAX_OPERANDS):
+                with m.Case(rotation):
+                    for n in range(MAX_OPERANDS - rotation):
+                        operand = n + rotation
+                        spec, immed, end, deferred, immvalid, legalop, speclen = fields[n]
+                        m.d.comb += [
+                            self.o_decoded[operand].eq(n < decoded),
+                            self.o_spec[operand].eq(spec),
+                            self.o_immed[operand].eq(immed),
+                            self.o_end[operand].eq(end),
+                            self.o_deferred[operand].eq(deferred),
+                            self.o_immvalid[operand].eq(immvalid),
+                            self.o_legalop[operand].eq(legalop),
+                            self.o_speclen[operand].eq(speclen),
+                        ]
+
+    def _ripple_boundaries(self, m, operands, is_extended):
+        # A decoder starts an operand when one of the six decoders before it is valid and
+        # its operand ends right there; o_length bit j means a j+1 byte operand.
+        for i in range(1, len(operands)):
+            decoder = operands[i]
+
+            valid = []
+            for j in range(1, 7):
+                if i - j >= 1:
+                    valid.append((i-j, operands[i-j].o_length[j-1]))
+            valid_signal = Cat([signal for _, signal in valid])
+
+            # At most one of them can end here, as only the decoders on the chain are valid
+            for previous, ends_here in valid:
+                with m.If(ends_here):
+                    m.d.comb += decoder.i_operidx.eq(operands[previous].o_nextidx)
+
+            m.d.comb += self.o_operands[i].eq(valid_signal.any())
+
+        with m.If(is_extended):
             m.d.comb += self.o_operands[2].eq(1)
         with m.Else():
             m.d.comb += self.o_operands[1].eq(1)
 
-        operlens = [operlen1, operlen2, operlen3, operlen4, operlen5, operlen6]
-        for operand in range(7):
-            for opcode in Opcode.nth_op_byte_insns(operand):
-                with m.If(self.i_data[0:8] == opcode):
-                    m.d.comb += operlens[operand].eq(Length.BYTE)
-            for opcode in Opcode.nth_op_word_insns(operand):
-                with m.If(self.i_data[0:8] == opcode):
-                    m.d.comb += operlens[operand].eq(Length.WORD)
-            for opcode in Opcode.nth_op_long_insns(operand):
-                with m.If(self.i_data[0:8] == opcode):
-                    m.d.comb += operlens[operand].eq(Length.LONG)
+    def _prefix_boundaries(self, m, data, operands, operlens, fixed, is_extended):
+        # The operand boundaries form a list starting at the seed, where the operand at byte p
+        # with operand index k is followed by one at p + length(p, k) with index k + 1. The
+        # length only depends on the operand index for immediates (8F) and fixed size operands,
+        # so it is computed for every byte up front by a probe decoder and patched for those, and the list is
+        # then walked by pointer jumping: after log2(decoders) rounds of doubling, the start
+        # of the n-th operand is found through one table lookup per set bit of n.
+        n_decoders = len(operands) - 1
+        sink       = n_decoders + 1 # past the last decoder, stays there
+        position   = range(sink + 1)
 
-        return m
+        # Immediate specifier sizes for each operand index, as OperandDecoder sizes them
+        imm_lengths = []
+        for index, operlen in enumerate(operlens):
+            imm_length = Signal(range(7), name=f"imm_length{index + 1}")
+            m.d.comb += imm_length.eq(Mux(operlen == Length.BYTE, 2, Mux(operlen == Length.WORD, 3, Mux(operlen == Length.LONG, 5, 6))))
+            imm_lengths.append(imm_length)
+
+        # Fixed size operand lengths, as OperandDecoder sizes them
+        fixed_lengths = []
+        for index, operlen in enumerate(operlens):
+            fixed_length = Signal(range(5), name=f"fixed_length{index + 1}")
+            m.d.comb += fixed_length.eq(Mux(operlen == Length.BYTE, 1, Mux(operlen == Length.WORD, 2, 4)))
+            fixed_lengths.append(fixed_length)
+
+        # jumps[span][p][k]: start of the operand `span` operands after the one at p with index k
+        end = [C(sink, position)] * MAX_OPERANDS
+        jump = [end] + [None] * n_decoders + [end]
+        for p in range(1, n_decoders + 1):
+            m.submodules[f"probe_{p}"] = probe = self._operand_decoder()
+            m.d.comb += [
+                # ahead of `data`, like the decoders
+                probe.i_data.eq(self.i_data.bit_select(8 * p, 48)),
+                probe.i_valid.eq(1),
+                probe.i_operlen1.eq(Length.BYTE),
+            ]
+
+            length = Signal(range(7), name=f"probe_length{p}")
+            m.d.comb += length.eq(Cat(
+                probe.o_length[0] | probe.o_length[2] | probe.o_length[4],
+                probe.o_length[1] | probe.o_length[2] | probe.o_length[5],
+                probe.o_length[3] | probe.o_length[4] | probe.o_length[5],
+            ))
+            is_immediate = data.word_select(p, 8) == 0x8F
+
+            jump[p] = []
+            for k in range(MAX_OPERANDS):
+                target = Signal(position, name=f"jump1_{p}_{k + 1}")
+                next_p = p + Mux(fixed[k], fixed_lengths[k], Mux(is_immediate, imm_lengths[k], length))
+                m.d.comb += target.eq(Mux(next_p > n_decoders, sink, next_p))
+                jump[p].append(target)
+        jumps = {1: jump}
+
+        def lookup(target, index, first, last, table):
+            # target = table[index], where index is known to be in first..last or the sink
+            with m.Switch(index):
+                for q in range(first, min(last, n_decoders) + 1):
+                    with m.Case(q):
+                        m.d.comb += target.eq(table[q])
+                with m.Default():
+                    m.d.comb += target.eq(sink)
+
+        def jumps_for(span):
+            if span not in jumps:
+                half = jumps_for(span // 2)
+                jump = [end] + [None] * n_decoders + [end]
+                for p in range(1, n_decoders + 1):
+                    jump[p] = []
+                    for k in range(MAX_OPERANDS):
+                        target = Signal(position, name=f"jump{span}_{p}_{k + 1}")
+                        following = [half[q][(k + span // 2) % MAX_OPERANDS] for q in position]
+                        lookup(target, half[p][k], p + span // 2, p + 6 * (span // 2), following)
+                        jump[p].append(target)
+                jumps[span] = jump
+            return jumps[span]
+
+        # starts[n]: start of the n-th operand (index n % 6), n = n' + span for the n' found in earlier rounds
+        starts = [Signal(position, name="start0")]
+        m.d.comb += starts[0].eq(Mux(is_extended, 2, 1))
+        span = 1
+        while len(starts) < n_decoders:
+            jump = jumps_for(span)
+            for n in range(min(span, n_decoders - len(starts))):
+                start = Signal(position, name=f"start{n + span}")
+                following = [jump[q][n % MAX_OPERANDS] for q in position]
+                lookup(start, starts[n], 1 + n, 2 + 6 * n, following)
+                starts.append(start)
+            span *= 2
+
+        for i in range(1, n_decoders + 1):
+            hits = [start == i for start in starts]
+            operidx = Cat(Cat(hits[index::MAX_OPERANDS]).any() for index in range(MAX_OPERANDS))
+            m.d.comb += [
+                self.o_operands[i].eq(Cat(hits).any()),
+                operands[i].i_operidx.eq(Mux(self.o_operands[i], operidx, 1)),
+            ]
 
 
 if __name__ == "__main__":
@@ -1,9 +1,30 @@
 from amaranth import *
 
-from util import Length
+from .util import Length
+
+# Points where OperandDecoder can be cut by a register stage, in pipeline order:
+# - "classify": after the addressing mode compares
+# - "extract":  after the halves of the immediate and size muxes that only depend on i_data
+# Both sit in front of the operand index, operand length and validity inputs, which only drive the
+# last few mux levels; see OperandDecoder.
+STAGES = ("classify", "extract")
+
 
 class OperandDecoder(Elaboratable):
-    def __init__(self):
+    # `stages` is a collection of STAGES to put registers at, in the sync domain. The cuts only
+    # split the logic that depends on i_data alone: i_data is then taken `latency` cycles ahead of
+    # the other inputs, which the outputs still follow combinationally. That keeps a chain of
+    # decoders, where each one's o_length and o_nextidx feed the i_valid and i_operidx of the next,
+    # working in a single cycle with the window going in `latency` cycles early (see
+    # VaxDecoderTest). With no stages the decoder is purely combinational.
+    def __init__(self, stages=()):
+        for stage in stages:
+            if stage not in STAGES:
+                raise ValueError(f"Unknown OperandDecoder stage '{stage}', expected one of {', '.join(STAGES)}")
+
+        self.stages  = tuple(stage for stage in STAGES if stage in stages)
+        self.latency = len(self.stages)
+
         self.i_data     = Signal(6*8)
         self.i_valid    = Signal()
         self.i_operidx  = Signal(6, reset=1)
@@ -14,6 +35,10 @@ class OperandDecoder(Elaboratable):
         self.i_operlen5 = Signal(Length)
         self.i_operlen6 = Signal(Length)
 
+        # Operand indices that are fixed size branch displacements or inline data rather than
+        # specifiers. Those are sign extended from their Length (byte, word or longword).
+        self.i_fixed    = Signal(6)
+
         self.o_deferred = Signal()
         self.o_legalop  = Signal()
         self.o_immed    = Signal(32)
@@ -21,112 +46,246 @@ class OperandDecoder(Elaboratable):
         self.o_length   = Signal(6)
         self.o_nextidx  = Signal(6)
 
+    def ports(self):
+        return [
+            self.i_data, self.i_valid, self.i_operidx, self.i_operlen1, self.i_operlen2, self.i_operlen3, self.i_operlen4,
+            self.i_operlen5, self.i_operlen6, self.i_fixed,
+            self.o_deferred, self.o_legalop, self.o_immed, self.o_immvalid, self.o_length, self.o_nextidx,
+        ]
+
+    def _cut(self, m, stage, values):
+        # `values` by name, through a register each when `stage` is one of the cut points
+        if stage not in self.stages:
+            return values
+        registered = {}
+        for name, value in values.items():
+            registered[name] = Signal(Value.cast(value).shape(), name=f"{stage}_{name}")
+            m.d.sync += registered[name].eq(value)
+        return registered
+
     def elaborate(self, platform):
         m = Module()
 
-        is_indexed  = self.i_data[4:8] == 0x4
+        data = self.i_data
+
+        is_indexed  = data[4:8] == 0x4
 
         op_offset   = Mux(is_indexed, 8, 0)
-        imm_offset  = Mux(is_indexed, 16, 8)
 
-        opcode_nibble = self.i_data.bit_select(op_offset+4, 4)
-        opcode_byte   = self.i_data.bit_select(op_offset, 8)
-
-        is_literal           = self.i_data[6:8]   == 0b00
-        is_literal_indexed   = self.i_data[14:16] == 0b00
-        is_index_indexed     = self.i_data[12:16] == 0x4
-        is_register          = self.i_data[4:8]   == 0x5
-        is_register_indexed  = self.i_data[12:16] == 0x5
-        is_register_deferred = opcode_nibble      == 0x6
-        is_autodec           = opcode_nibble      == 0x7
-        is_autoinc           = opcode_nibble      == 0x8
-        is_immediate         = self.i_data[0:8]   == 0x8F
-        is_immediate_indexed = self.i_data[8:16]  == 0x8F
-        is_autoinc_deferred  = opcode_nibble      == 0x9
-        is_absolute          = opcode_byte        == 0x9F
-        is_bytedisp          = opcode_nibble      == 0xA
-        is_worddisp          = opcode_nibble      == 0xB
-        is_longdisp          = opcode_nibble      == 0xC
-        is_bytedisp_deferred = opcode_nibble      == 0xD
-        is_worddisp_deferred = opcode_nibble      == 0xE
-        is_longdisp_deferred = opcode_nibble      == 0xF
+        opcode_nibble = data.bit_select(op_offset+4, 4)
+        opcode_byte   = data.bit_select(op_offset, 8)
 
-        oplength = Signal(Length)
-        operlens = [self.i_operlen1, self.i_operlen2, self.i_operlen3, self.i_operlen4, self.i_operlen5, self.i_operlen6]
-        for i, operlen in enumerate(operlens):
-            with m.If(self.i_operidx[i]):
-                m.d.comb += oplength.eq(operlen)
+        # Mode classification
+        mode = self._cut(m, "classify", {
+            "data":                 data,
+            "is_indexed":           is_indexed,
+            "is_literal":           data[6:8]     == 0b00,
+            "is_literal_indexed":   data[14:16]   == 0b00,
+            "is_index_indexed":     data[12:16]   == 0x4,
+            "is_register":          data[4:8]     == 0x5,
+            "is_register_indexed":  data[12:16]   == 0x5,
+            "is_register_deferred": opcode_nibble == 0x6,
+            "is_autodec":           opcode_nibble == 0x7,
+            "is_autoinc":           opcode_nibble == 0x8,
+            "is_immediate":         data[0:8]     == 0x8F,
+            "is_immediate_indexed": data[8:16]    == 0x8F,
+            "is_autoinc_deferred":  opcode_nibble == 0x9,
+            "is_absolute":          opcode_byte   == 0x9F,
+            "is_bytedisp":          opcode_nibble == 0xA,
+            "is_worddisp":          opcode_nibble == 0xC,
+            "is_longdisp":          opcode_nibble == 0xE,
+            "is_bytedisp_deferred": opcode_nibble == 0xB,
+            "is_worddisp_deferred": opcode_nibble == 0xD,
+            "is_longdisp_deferred": opcode_nibble == 0xF,
+        })
 
-        literal_imm   = self.i_data[0:6] # indexed literal is illegal, so no shift needed
-        autoinc_imm   = Mux(oplength == Length.BYTE, 1, Mux(oplength == Length.WORD, 2, Mux(oplength == Length.LONG, 4, 8)))
-        autodec_imm   = -autoinc_imm
-        immediate_imm = Mux(oplength == Length.BYTE, self.i_data[8:16], Mux(oplength == Length.WORD, self.i_data[8:24], self.i_data[8:40]))
-        absolute_imm  = self.i_data.bit_select(imm_offset, 32)
-        bytedisp_imm  = Cat(self.i_data.bit_select(imm_offset, 8), Repl(self.i_data.bit_select(imm_offset + 7, 1), 24))
-        worddisp_imm  = Cat(self.i_data.bit_select(imm_offset, 16), Repl(self.i_data.bit_select(imm_offset + 15, 1), 16))
+        data                 = mode["data"]
+        is_indexed           = mode["is_indexed"]
+        is_literal           = mode["is_literal"]
+        is_literal_indexed   = mode["is_literal_indexed"]
+        is_index_indexed     = mode["is_index_indexed"]
+        is_register          = mode["is_register"]
+        is_register_indexed  = mode["is_register_indexed"]
+        is_register_deferred = mode["is_register_deferred"]
+        is_autodec           = mode["is_autodec"]
+        is_autoinc           = mode["is_autoinc"]
+        is_immediate         = mode["is_immediate"]
+        is_immediate_indexed = mode["is_immediate_indexed"]
+        is_autoinc_deferred  = mode["is_autoinc_deferred"]
+        is_absolute          = mode["is_absolute"]
+        is_bytedisp          = mode["is_bytedisp"]
+        is_worddisp          = mode["is_worddisp"]
+        is_longdisp          = mode["is_longdisp"]
+        is_bytedisp_deferred = mode["is_bytedisp_deferred"]
+        is_worddisp_deferred = mode["is_worddisp_deferred"]
+        is_longdisp_deferred = mode["is_longdisp_deferred"]
+
+        imm_offset  = Mux(is_indexed, 16, 8)
+
+        literal_imm   = data[0:6] # indexed literal is illegal, so no shift needed
+        absolute_imm  = data.bit_select(imm_offset, 32)
+        bytedisp_imm  = Cat(data.bit_select(imm_offset, 8), data.bit_select(imm_offset + 7, 1).replicate(24))
+        worddisp_imm  = Cat(data.bit_select(imm_offset, 16), data.bit_select(imm_offset + 15, 1).replicate(16))
         longdisp_imm  = absolute_imm
 
-        is_one_byte           = (~is_indexed) & (is_literal | is_register | is_register_deferred | is_autodec | is_autoinc | is_autoinc_deferred)
-        is_one_byte_indexed   = is_indexed & (is_literal | is_register | is_register_deferred | is_autodec | is_autoinc | is_autoinc_deferred)
-        is_two_byte           = is_one_byte_indexed | ((oplength == Length.BYTE) & is_immediate) | ((~is_indexed) & (is_bytedisp | is_bytedisp_deferred))
+        # Immediate (8F) and absolute (9F) share their mode nibble with autoincrement and
+        # autoincrement deferred, so those have to be excluded from the one byte modes.
+        is_short_autoinc      = is_autoinc & ~is_immediate
+        is_short_autoinc_def  = is_autoinc_deferred & ~is_absolute
+        is_one_byte           = (~is_indexed) & (is_literal | is_register | is_register_deferred | is_autodec | is_short_autoinc | is_short_autoinc_def)
+        is_one_byte_indexed   = is_indexed & (is_literal | is_register | is_register_deferred | is_autodec | is_short_autoinc | is_short_autoinc_def)
+        is_two_byte           = is_one_byte_indexed | ((~is_indexed) & (is_bytedisp | is_bytedisp_deferred))
         is_two_byte_indexed   = is_indexed & (is_bytedisp | is_bytedisp_deferred)
-        is_three_byte         = is_two_byte_indexed | ((oplength == Length.WORD) & is_immediate) | ((~is_indexed) & (is_worddisp | is_worddisp_deferred))
+        is_three_byte         = is_two_byte_indexed | ((~is_indexed) & (is_worddisp | is_worddisp_deferred))
         is_three_byte_indexed = is_indexed & (is_worddisp | is_worddisp_deferred)
         is_four_byte          = is_three_byte_indexed
-        is_five_byte          = (~is_indexed) & (((oplength == Length.LONG) & is_immediate) | is_absolute | is_longdisp | is_longdisp_deferred)
+        is_five_byte          = (~is_indexed) & (is_absolute | is_longdisp | is_longdisp_deferred)
         is_five_byte_indexed  = is_indexed & (is_absolute | is_longdisp | is_longdisp_deferred)
         is_six_byte           = is_five_byte_indexed
 
-        m.d.comb += [
-            self.o_deferred.eq(is_register_deferred | is_autoinc_deferred | is_bytedisp_deferred | is_worddisp_deferred | is_longdisp_deferred),
-            self.o_legalop.eq((~is_indexed) | (~(is_literal_indexed | is_index_indexed | is_register_indexed | is_immediate_indexed))),
-            self.o_immvalid.eq(~(is_register | is_register_deferred))
-        ]
+        # The immediate and size routing is split in two. Here are the parts that follow from
+        # i_data: the immediates carried in the specifier, and the sizes of everything but
+        # immediates (8F), which take theirs from the operand Length like the autoincrement and
+        # autodecrement steps. Those, and fixed size operands, are picked after the cuts.
+        spec_immed  = Signal(32)
+        spec_length = Signal(6)
 
         # Immediate routing
         with m.If(is_literal):
-            m.d.comb += self.o_immed.eq(literal_imm)
-        with m.Elif(is_autodec):
-            m.d.comb += self.o_immed.eq(autodec_imm)
-        with m.Elif(is_immediate):
-            m.d.comb += self.o_immed.eq(immediate_imm)
+            m.d.comb += spec_immed.eq(literal_imm)
+        with m.Elif(is_autodec | is_immediate):
+            pass
         with m.Elif(is_absolute):
-            m.d.comb += self.o_immed.eq(absolute_imm)
+            m.d.comb += spec_immed.eq(absolute_imm)
         with m.Elif(is_autoinc | is_autoinc_deferred):
-            m.d.comb += self.o_immed.eq(autoinc_imm)
+            pass
         with m.Elif(is_bytedisp | is_bytedisp_deferred):
-            m.d.comb += self.o_immed.eq(bytedisp_imm)
+            m.d.comb += spec_immed.eq(bytedisp_imm)
         with m.Elif(is_worddisp | is_worddisp_deferred):
-            m.d.comb += self.o_immed.eq(worddisp_imm)
+            m.d.comb += spec_immed.eq(worddisp_imm)
         with m.Elif(is_longdisp | is_longdisp_deferred):
-            m.d.comb += self.o_immed.eq(longdisp_imm)
+            m.d.comb += spec_immed.eq(longdisp_imm)
 
         # Size routing
+        with m.If(is_one_byte):
+            m.d.comb += spec_length.eq(1 << 0)
+        with m.Elif(is_two_byte):
+            m.d.comb += spec_length.eq(1 << 1)
+        with m.Elif(is_three_byte):
+            m.d.comb += spec_length.eq(1 << 2)
+        with m.Elif(is_four_byte):
+            m.d.comb += spec_length.eq(1 << 3)
+        with m.Elif(is_five_byte):
+            m.d.comb += spec_length.eq(1 << 4)
+        with m.Else(): # equivalent to m.Elif(is_six_byte)
+            m.d.comb += spec_length.eq(1 << 5)
+
+        # Immediate extraction
+        spec = self._cut(m, "extract", {
+            "data":         data[0:40],
+            "immed":        spec_immed,
+            "length":       spec_length,
+            "is_autodec":   ~is_literal & is_autodec,
+            "is_immediate": ~is_literal & ~is_autodec & is_immediate,
+            "is_autoinc":   ~is_literal & ~is_autodec & ~is_immediate & ~is_absolute & (is_autoinc | is_autoinc_deferred),
+            "deferred":     is_register_deferred | is_autoinc_deferred | is_bytedisp_deferred | is_worddisp_deferred | is_longdisp_deferred,
+            "legalop":      (~is_indexed) | (~(is_literal_indexed | is_index_indexed | is_register_indexed | is_immediate_indexed)),
+            "immvalid":     ~(is_register | is_register_deferred),
+        })
+
+        data = spec["data"]
+
+        oplength = Signal(Length)
+        operlens = [self.i_operlen1, self.i_operlen2, self.i_operlen3, self.i_operlen4, self.i_operlen5, self.i_operlen6]
+        for i, operlen in enumerate(operlens):
+            with m.If(self.i_operidx[i]):
+                m.d.comb += oplength.eq(operlen)
+
+        is_fixed = (self.i_operidx & self.i_fixed).any()
+
+        fixed_imm     = Mux(oplength == Length.BYTE, data[0:8].as_signed(), Mux(oplength == Length.WORD, data[0:16].as_signed(), data[0:32]))
+        autoinc_imm   = Mux(oplength == Length.BYTE, 1, Mux(oplength == Length.WORD, 2, Mux(oplength == Length.LONG, 4, Mux(oplength == Length.QUAD, 8, 16))))
+        autodec_imm   = -autoinc_imm
+        immediate_imm = Mux(oplength == Length.BYTE, data[8:16], Mux(oplength == Length.WORD, data[8:24], data[8:40]))
+
+        # Immediate routing, the operand Length dependent part
+        with m.If(is_fixed):
+            m.d.comb += self.o_immed.eq(fixed_imm)
+        with m.Elif(spec["is_autodec"]):
+            m.d.comb += self.o_immed.eq(autodec_imm)
+        with m.Elif(spec["is_immediate"]):
+            m.d.comb += self.o_immed.eq(immediate_imm)
+        with m.Elif(spec["is_autoinc"]):
+            m.d.comb += self.o_immed.eq(autoinc_imm)
+        with m.Else():
+            m.d.comb += self.o_immed.eq(spec["immed"])
+
+        # Size routing, the operand Length dependent part. Fixed size operands and immediates are
+        # sized for every operand index from i_operlen* alone, so that i_operidx (one-hot) and
+        # i_valid, which a chain of decoders feeds from the one before, only pick from them.
+        fixed_lengths = [Signal(6, name=f"fixed_length{i + 1}") for i in range(len(operlens))]
+        imm_lengths   = [Signal(6, name=f"imm_length{i + 1}") for i in range(len(operlens))]
+        for operlen, fixed_length, imm_length in zip(operlens, fixed_lengths, imm_lengths):
+            m.d.comb += [
+                fixed_length.eq(Mux(operlen == Length.BYTE, 1 << 0, Mux(operlen == Length.WORD, 1 << 1, 1 << 3))),
+                imm_length.eq(Mux(operlen == Length.BYTE, 1 << 1, Mux(operlen == Length.WORD, 1 << 2, Mux(operlen == Length.LONG, 1 << 4, 1 << 5)))),
+            ]
+
+        def by_index(lengths):
+            return Cat((self.i_operidx & Cat(length[bit] for length in lengths)).any() for bit in range(len(self.o_length)))
+
         with m.If(self.i_valid):
-            with m.If(is_one_byte):
-                m.d.comb += self.o_length.eq(1 << 0)
-            with m.Elif(is_two_byte):
-                m.d.comb += self.o_length.eq(1 << 1)
-            with m.Elif(is_three_byte):
-                m.d.comb += self.o_length.eq(1 << 2)
-            with m.Elif(is_four_byte):
-                m.d.comb += self.o_length.eq(1 << 3)
-            with m.Elif(is_five_byte):
-                m.d.comb += self.o_length.eq(1 << 4)
-            with m.Else(): # equivalent to m.Elif(is_six_byte)
-                m.d.comb += self.o_length.eq(1 << 5)
-
-        # Operand index routing
-        m.d.comb += self.o_nextidx.eq(self.i_operidx.rotate_left(1))
+            with m.If(is_fixed):
+                m.d.comb += self.o_length.eq(by_index(fixed_lengths))
+            with m.Elif(spec["is_immediate"]):
+                m.d.comb += self.o_length.eq(by_index(imm_lengths))
+            with m.Else():
+                m.d.comb += self.o_length.eq(spec["length"])
+
+        m.d.comb += [
+            self.o_deferred.eq(~is_fixed & spec["deferred"]),
+            self.o_legalop.eq(is_fixed | spec["legalop"]),
+            self.o_immvalid.eq(is_fixed | spec["immvalid"]),
+            # Operand index routing
+            self.o_nextidx.eq(self.i_operidx.rotate_left(1)),
+        ]
 
         return m
 
+
+class SharedOperandDecoder(OperandDecoder):
+    # An OperandDecoder that elaborates to an instance of a module shared by every decoder with the
+    # same stages, rather than to a copy of its logic, so a netlist with many of them has a single
+    # definition of each, from definition(). Pipelined ones get the sync clock and reset.
+    # Instances can't be simulated with pysim, so this is for generating netlists only.
+    MODULE = "vixen_operand_decoder"
+
+    @classmethod
+    def module(cls, stages=()):
+        # The name of the module shared by the decoders with `stages`
+        return "_".join((cls.MODULE, *stages))
+
+    def elaborate(self, platform):
+        clocks = {"i_clk": ClockSignal(), "i_rst": ResetSignal()} if self.stages else {}
+        return Instance(self.module(self.stages), **clocks, **{
+            f"{port.name[0]}_{port.name}": port for port in self.ports()
+        })
+
+    @classmethod
+    def definition(cls, stages=()):
+        # The RTLIL module the instances with `stages` refer to
+        from amaranth.back import rtlil
+
+        decoder = OperandDecoder(stages)
+        return rtlil.convert(decoder, name=cls.module(decoder.stages), ports=decoder.ports())
+
+
 if __name__ == "__main__":
     from amaranth.back import verilog
 
     opdec = OperandDecoder()
     ports = [
-        opdec.i_data, opdec.i_valid, opdec.i_operlen1, opdec.i_operlen2, opdec.i_operlen3, opdec.i_operlen4, opdec.i_operlen5, opdec.i_operlen6,
+        opdec.i_data, opdec.i_valid, opdec.i_fixed, opdec.i_operlen1, opdec.i_operlen2, opdec.i_operlen3, opdec.i_operlen4, opdec.i_operlen5, opdec.i_operlen6,
         opdec.o_deferred, opdec.o_legalop, opdec.o_immed, opdec.o_immvalid, opdec.o_length
     ]
 
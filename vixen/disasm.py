@@ -0,0 +1,437 @@
+import json
+import mmap
+import os
+import sys
+from collections import Counter
+from contextlib import closing, nullcontext
+
+import numpy as np
+
+from .decode import MAX_OPERANDS, IssueStats, Opcode
+from .operand_model import decode_operands, windows
+from .util import Length
+
+# Streaming VAX disassembler.
+#
+# The image is memory mapped and walked in chunks. For each chunk every byte offset is
+# speculatively decoded as the start of an instruction in a handful of vectorized passes,
+# using the opcode table for operand counts and types and the OperandDecoder rules (via
+# operand_model) for specifier lengths. The real instruction boundaries are then followed through
+# the resulting length array by walkers that each take a block of it, see follow_boundaries().
+#
+# Specifier lengths follow OperandDecoder except for quadword and octaword immediates, which
+# OperandDecoder can't size; those are given their architectural 9 and 17 byte lengths here.
+#
+# Throughput to binary records is about 6 MB/s on typical code, not the tens of MB/s a full-speed
+# scan would need; that is out of scope for this module. The boundary walk is down to about a
+# sixth of the time. Most of the rest is the speculative decode at every byte offset, which takes
+# four times the work of decoding the real instructions and would have to go, along with the
+# per-instruction Python formatting of the text and JSON formats, to close the gap.
+
+DATA_TYPE_BYTES = {
+    "b": 1, "w": 2, "l": 4, "q": 8, "o": 16,
+    "f": 4, "d": 8, "g": 8, "h": 16,
+}
+
+# Longest instruction without a CASE table: an extended opcode and six indexed immediates.
+LOOKAHEAD = 2 + MAX_OPERANDS * 18
+
+# Bytes per walker in follow_boundaries()
+BOUNDARY_BLOCK = 256
+
+REGISTER_NAMES = tuple(f"R{n}" for n in range(12)) + ("AP", "FP", "SP", "PC")
+
+CASE_OPCODES = (Opcode.CASEB, Opcode.CASEW, Opcode.CASEL)
+
+# Compact binary output, one record per instruction
+RECORD = np.dtype([
+    ("addr",     "<u8"),
+    ("opcode",   "<u2"),
+    ("length",   "<u4"),
+    ("count",    "u1"),
+    ("operands", "u1", (MAX_OPERANDS,)), # offset of each operand from the instruction start
+])
+
+FORMATS = ("text", "jsonl", "binary")
+
+
+class _OpcodeArrays:
+    # The opcode table as NumPy arrays, indexed by 16-bit opcode value (unknown opcodes are row 0)
+    __slots__ = ("row", "opcodes", "value", "operands", "count", "is_spec", "size", "oplen", "is_case", "op_len", "op_class")
+
+    def __init__(self):
+        table = Opcode.table()
+        data  = Opcode._data()
+        rows  = len(table.opcodes) + 1
+
+        self.row      = np.zeros(1 << 16, dtype=np.int16)
+        self.opcodes  = (None,) + table.opcodes
+        self.value    = np.array([0xffff] + [opcode.value for opcode in table.opcodes], dtype=np.uint16)
+        self.operands = [()] # (kind, data type) pairs per row
+        self.count    = np.zeros(rows, dtype=np.uint8)
+        self.is_spec  = np.zeros((MAX_OPERANDS, rows), dtype=bool)
+        self.size     = np.zeros((MAX_OPERANDS, rows), dtype=np.uint8)
+        self.oplen    = np.zeros((MAX_OPERANDS, rows), dtype=np.uint8)
+        self.is_case  = np.zeros(rows, dtype=bool)
+
+        for index, opcode in enumerate(table.opcodes):
+            row = index + 1
+            if opcode.value > 0xff:
+                self.row[opcode.value] = row
+            else:
+                # Single byte opcodes match whatever byte follows them
+                self.row[opcode.value::0x100] = row
+            kinds, types = data[opcode]
+            self.operands.append(tuple(zip(kinds, types)))
+            self.count[row]   = len(kinds)
+            self.is_case[row] = opcode in CASE_OPCODES
+            for operand, (kind, data_type) in enumerate(zip(kinds, types)):
+                self.is_spec[operand, row] = kind not in "bi"
+                self.size[operand, row]    = DATA_TYPE_BYTES[data_type]
+                oplen = table.operand_length(opcode, operand)
+                self.oplen[operand, row]   = 0 if oplen is None else oplen.value
+
+        # Escape bytes with an unknown second byte are undefined, not the EXOPFx placeholders
+        for escape in (Opcode.EXOPFD, Opcode.EXOPFE, Opcode.EXOPFF):
+            for second in range(0x100):
+                value = escape.value | (second << 8)
+                if self.opcodes[self.row[value]] is escape:
+                    self.row[value] = 0
+
+        # Operand length in bytes for every pair of bytes at the start of the operand, per operand
+        # class: specifiers of each Length (OperandDecoder only looks at the second byte for
+        # indexed specifiers), followed by fixed size branch displacements and inline data,
+        # followed by an all zero class for missing operands.
+        pairs = np.arange(1 << 16, dtype=np.uint64)
+        spec_classes = int(self.oplen.max()) + 1
+        sizes = sorted(set(DATA_TYPE_BYTES.values()))
+
+        self.op_len = np.zeros((spec_classes + len(sizes) + 1, 1 << 16), dtype=np.uint8)
+        for oplen in range(spec_classes):
+            onehot = decode_operands(pairs, oplen).length
+            self.op_len[oplen] = np.log2(onehot).astype(np.uint8) + 1
+        for oplen, size in ((Length.QUAD.value, 8), (Length.OCTA.value, 16)):
+            if oplen < spec_classes:
+                self.op_len[oplen, 0x8f::0x100] = 1 + size
+        for index, size in enumerate(sizes):
+            self.op_len[spec_classes + index] = size
+        self.op_len = self.op_len.ravel()
+
+        self.op_class = np.full((MAX_OPERANDS, rows), spec_classes + len(sizes), dtype=np.int32)
+        for row, operands in enumerate(self.operands):
+            for operand, (kind, data_type) in enumerate(operands):
+                if kind in "bi":
+                    self.op_class[operand, row] = spec_classes + sizes.index(DATA_TYPE_BYTES[data_type])
+                else:
+                    self.op_class[operand, row] = self.oplen[operand, row]
+        self.op_class <<= 16
+
+
+_arrays = None
+
+
+def opcode_arrays():
+    global _arrays
+    if _arrays is None:
+        _arrays = _OpcodeArrays()
+    return _arrays
+
+
+class DecodedBatch:
+    # Instructions decoded from one chunk, as parallel arrays
+    __slots__ = ("buf", "base", "start", "row", "length", "operands")
+
+    def __init__(self, buf, base, start, row, length, operands):
+        self.buf      = buf      # chunk bytes (with lookahead)
+        self.base     = base     # address of buf[0]
+        self.start    = start    # instruction offsets into buf
+        self.row      = row      # _OpcodeArrays row, 0 for undefined opcodes
+        self.length   = length   # instruction lengths
+        self.operands = operands # (MAX_OPERANDS, n) operand offsets from the instruction start
+
+    def __len__(self):
+        return len(self.start)
+
+    def records(self):
+        arrays = opcode_arrays()
+        records = np.zeros(len(self), dtype=RECORD)
+        records["addr"]     = self.base + self.start
+        records["opcode"]   = arrays.value[self.row]
+        records["length"]   = self.length
+        records["count"]    = arrays.count[self.row]
+        records["operands"] = np.where(np.arange(MAX_OPERANDS)[:, None] < records["count"], self.operands, 0).T
+        return records
+
+
+def speculative_decode(buf, size):
+    # Decodes an instruction at each of the first `size` offsets of `buf`, which should extend
+    # LOOKAHEAD bytes past them unless it's the end of the image.
+    # Returns (row, length, operand offsets) arrays.
+    arrays = opcode_arrays()
+    padded = np.concatenate((buf, np.zeros(LOOKAHEAD + 1, dtype=np.uint8)))
+    # Every byte pair, so a 16-bit opcode or specifier can be looked up with a single gather
+    pairs  = padded[:-1].astype(np.intp) | (padded[1:].astype(np.intp) << 8)
+    last   = len(pairs) - 1
+
+    offsets  = np.arange(size, dtype=np.intp)
+    row      = arrays.row[pairs[:size]].astype(np.intp)
+    extended = (padded[:size] >= 0xfd) & (row != 0)
+
+    # The operand pairs are at most LOOKAHEAD - 18 bytes on, so they're inside `pairs`
+    pos      = offsets + 1 + extended
+    operands = np.empty((MAX_OPERANDS, size), dtype=np.uint8)
+    for operand in range(MAX_OPERANDS):
+        operands[operand] = pos - offsets
+        pos += arrays.op_len[arrays.op_class[operand][row] | pairs[pos]]
+
+    length = (pos - offsets).astype(np.int64)
+
+    # CASEx is followed by a table of (limit + 1) word displacements, sized statically when
+    # the limit is a short literal or an immediate.
+    is_case = arrays.is_case[row]
+    if is_case.any():
+        case       = np.flatnonzero(is_case)
+        limit_pos  = np.minimum(case + operands[2, case], last)
+        spec       = padded[limit_pos].astype(np.int64)
+        immed      = windows(padded, limit_pos + 1).astype(np.int64) & 0xffffffff
+        limit_mask = (np.int64(1) << (8 * arrays.size[2, row[case]].astype(np.int64))) - 1
+        limit      = np.where(spec < 0x40, spec & 0x3f, np.where(spec == 0x8f, immed & limit_mask, -1))
+        length[case] += np.where(limit >= 0, 2 * (limit + 1), 0)
+
+    return row, length, operands
+
+
+def follow_boundaries(length, limit):
+    # Offsets of the instructions from offset 0 up to `limit`, given the instruction `length` at
+    # every offset, and the offset the last one ends at.
+    #
+    # A walker starts at the beginning of every BOUNDARY_BLOCK bytes, and they all step through
+    # their blocks together. Instruction streams resynchronise within a few instructions, so the
+    # real boundaries entering a block soon land on one its walker visited, and from there on
+    # they're the walker's. Only the steps before that are taken one at a time.
+    following = np.arange(len(length), dtype=np.int64) + length
+    blocks    = -(-limit // BOUNDARY_BLOCK)
+    ends      = np.minimum(np.arange(1, blocks + 1, dtype=np.int64) * BOUNDARY_BLOCK, limit)
+    exits     = np.empty(blocks, dtype=np.int64)
+
+    offset = np.arange(blocks, dtype=np.int64) * BOUNDARY_BLOCK
+    walker = np.arange(blocks)
+    visits = []
+    while len(offset):
+        visits.append(offset)
+        offset = following[offset]
+        inside = offset < ends[walker]
+        exits[walker[~inside]] = offset[~inside]
+        offset, walker = offset[inside], walker[inside]
+    visits  = np.concatenate(visits)
+    visited = np.zeros(limit, dtype=bool)
+    visited[visits] = True
+
+    # The first real boundary each walker shares, or the end of its block if there is none
+    shared = ends.copy()
+    missed = []
+    offset = 0
+    for block, end in enumerate(ends.tolist()):
+        while offset < end and not visited[offset]:
+            missed.append(offset)
+            offset = int(following[offset])
+        if offset < end:
+            shared[block] = offset
+            offset = int(exits[block])
+
+    starts = np.zeros(limit, dtype=bool)
+    starts[visits[visits >= shared[visits // BOUNDARY_BLOCK]]] = True
+    starts[missed] = True
+    return np.flatnonzero(starts), offset
+
+
+def decode_chunks(data, base=0, chunk_size=1 << 20):
+    # Yields a DecodedBatch for each chunk of `data` (any buffer, e.g. an mmap). The chunks are
+    # copied, so no batch holds on to `data`. An instruction cut off by the end of `data` is
+    # handed out as an undefined one covering the bytes that are there.
+    view = np.frombuffer(data, dtype=np.uint8)
+    pos  = 0
+    while pos < len(view):
+        end = min(pos + chunk_size, len(view))
+        buf = view[pos:min(end + LOOKAHEAD, len(view))].copy()
+        row, length, operands = speculative_decode(buf, end - pos)
+
+        starts, offset = follow_boundaries(length, end - pos)
+        row, length    = row[starts], length[starts]
+        if pos + offset > len(view):
+            row[-1]     = 0
+            length[-1] -= pos + offset - len(view)
+            offset      = len(view) - pos
+
+        yield DecodedBatch(buf, base + pos, starts, row, length, operands[:, starts])
+        pos += offset
+
+
+def format_specifier(buf, pos, addr, data_type):
+    # Formats the operand specifier at buf[pos] (at address `addr`) in VAX MACRO syntax.
+    # Returns (text, length)
+    spec = int(buf[pos])
+    mode, reg = spec >> 4, spec & 0xf
+
+    if mode == 0x4:
+        base, length = format_specifier(buf, pos + 1, addr + 1, data_type)
+        return f"{base}[{REGISTER_NAMES[reg]}]", length + 1
+
+    def read(offset, size, signed=False):
+        return int.from_bytes(bytes(buf[pos + offset:pos + offset + size]), "little", signed=signed)
+
+    if mode <= 0x3:
+        return f"S^#{spec & 0x3f}", 1
+    if mode == 0x5:
+        return REGISTER_NAMES[reg], 1
+    if mode == 0x6:
+        return f"({REGISTER_NAMES[reg]})", 1
+    if mode == 0x7:
+        return f"-({REGISTER_NAMES[reg]})", 1
+    if mode == 0x8:
+        if reg == 0xf:
+            size = DATA_TYPE_BYTES[data_type]
+            return f"I^#0x{read(1, size):x}", 1 + size
+        return f"({REGISTER_NAMES[reg]})+", 1
+    if mode == 0x9:
+        if reg == 0xf:
+            return f"@#0x{read(1, 4):08x}", 5
+        return f"@({REGISTER_NAMES[reg]})+", 1
+
+    deferred = "@" if mode & 1 else ""
+    size     = (1, 2, 4)[(mode - 0xa) >> 1]
+    prefix   = "BWL"[(mode - 0xa) >> 1]
+    disp     = read(1, size, signed=True)
+    if reg == 0xf:
+        return f"{deferred}{prefix}^0x{(addr + 1 + size + disp) & 0xffffffff:08x}", 1 + size
+    return f"{deferred}{prefix}^{disp}({REGISTER_NAMES[reg]})", 1 + size
+
+
+def format_instruction(batch, index):
+    arrays = opcode_arrays()
+    start  = int(batch.start[index])
+    addr   = batch.base + start
+    row    = int(batch.row[index])
+    length = int(batch.length[index])
+    if row == 0:
+        return f"{addr:08x}:  .byte {', '.join(f'0x{byte:02x}' for byte in bytes(batch.buf[start:start + length]))}"
+
+    opcode   = arrays.opcodes[row]
+    operands = []
+    for operand, (kind, data_type) in enumerate(arrays.operands[row]):
+        offset = start + int(batch.operands[operand, index])
+        if kind in "bi":
+            size  = DATA_TYPE_BYTES[data_type]
+            value = int.from_bytes(bytes(batch.buf[offset:offset + size]), "little", signed=True)
+            if kind == "b":
+                operands.append(f"0x{(batch.base + offset + size + value) & 0xffffffff:08x}")
+            else:
+                operands.append(f"0x{value & ((1 << (8 * size)) - 1):x}")
+        else:
+            operands.append(format_specifier(batch.buf, offset, batch.base + offset, data_type)[0])
+
+    shown = bytes(batch.buf[start:start + min(length, 12)]).hex()
+    return f"{addr:08x}:  {shown:<24} {opcode.name:<7} {', '.join(operands)}".rstrip()
+
+
+class Statistics:
+    # Instruction mix, instruction length and specifier mode histograms, and how often a dual
+    # issue VaxDecoder would fill its second slot decoding straight through the image
+    def __init__(self):
+        self.instructions = 0
+        self.mix          = Counter()
+        self.lengths      = Counter()
+        self.modes        = Counter()
+        self.issue        = IssueStats()
+
+    def add(self, batch):
+        arrays = opcode_arrays()
+        self.instructions += len(batch)
+        for row, hits in zip(*np.unique(batch.row, return_counts=True)):
+            self.mix["(undefined)" if row == 0 else arrays.opcodes[row].name] += int(hits)
+        for length, hits in zip(*np.unique(batch.length, return_counts=True)):
+            self.lengths[int(length)] += int(hits)
+        for addr, length in zip((batch.base + batch.start).tolist(), batch.length.tolist()):
+            self.issue.add(addr, length)
+        for operand in range(MAX_OPERANDS):
+            has_spec = arrays.is_spec[operand, batch.row] & (operand < arrays.count[batch.row])
+            modes = batch.buf[(batch.start + batch.operands[operand])[has_spec]] >> 4
+            for mode, hits in zip(*np.unique(modes, return_counts=True)):
+                self.modes[f"{int(mode):x}"] += int(hits)
+
+    def as_dict(self):
+        return {
+            "instructions": self.instructions,
+            "mix":          dict(self.mix.most_common()),
+            "lengths":      {str(length): hits for length, hits in sorted(self.lengths.items())},
+            "modes":        dict(sorted(self.modes.items())),
+            "dual_issue":   {
+                "width":  self.issue.width,
+                "cycles": self.issue.cycles,
+                "paired": self.issue.paired,
+                "rate":   round(self.issue.rate, 4),
+            },
+        }
+
+
+def disassemble(data, output, fmt="text", base=0, chunk_size=1 << 20, stats=None):
+    # Writes the disassembly of `data` to `output`, a binary file for the "binary" format
+    # and a text file otherwise.
+    arrays = opcode_arrays()
+    with closing(decode_chunks(data, base, chunk_size)) as batches:
+        for batch in batches:
+            if stats is not None:
+                stats.add(batch)
+
+            if fmt == "binary":
+                output.write(batch.records().tobytes())
+            elif fmt == "jsonl":
+                addrs = (batch.base + batch.start).tolist()
+                lines = []
+                for index, row in enumerate(batch.row.tolist()):
+                    lines.append(json.dumps({
+                        "addr":     addrs[index],
+                        "length":   int(batch.length[index]),
+                        "opcode":   "(undefined)" if row == 0 else arrays.opcodes[row].name,
+                        "operands": batch.operands[:arrays.count[row], index].tolist(),
+                    }))
+                output.write("\n".join(lines) + "\n")
+            else:
+                output.write("\n".join(format_instruction(batch, index) for index in range(len(batch))) + "\n")
+
+
+def disasm(args):
+    if args.format not in FORMATS:
+        raise ValueError(f"Unknown output format '{args.format}', expected one of {', '.join(FORMATS)}")
+
+    binary = args.format == "binary"
+    stats  = Statistics() if args.stats else None
+
+    with open(args.image, "rb") as image:
+        # An empty file can't be memory mapped, and has nothing to disassemble
+        if os.fstat(image.fileno()).st_size:
+            mapping = mmap.mmap(image.fileno(), 0, access=mmap.ACCESS_READ)
+        else:
+            mapping = nullcontext(b"")
+
+        with mapping as data:
+            view = memoryview(data)[args.offset:]
+            if args.length is not None:
+                view = view[:args.length]
+
+            if args.output == "-":
+                output = sys.stdout.buffer if binary else sys.stdout
+            else:
+                output = open(args.output, "wb" if binary else "w")
+
+            try:
+                disassemble(view, output, args.format, args.base + args.offset, args.chunk_size, stats)
+            finally:
+                view.release()
+                if args.output != "-":
+                    output.close()
+
+    if stats is not None:
+        print(json.dumps(stats.as_dict(), indent=2), file=sys.stderr)
+
+    return 0
@@ -0,0 +1,515 @@
+import json
+import multiprocessing
+import os
+import random
+import sys
+import time
+from collections import deque
+from itertools import accumulate
+from pathlib import Path
+
+import numpy as np
+
+from .decode import MAX_OPERANDS
+from .disasm import DATA_TYPE_BYTES, LOOKAHEAD, opcode_arrays
+from .operand_model import decode_operands
+from .sweep import PAYLOADS
+from .util import Length
+
+# Coverage-guided random instruction stream fuzzer for VaxDecoderTest.
+#
+# Windows are generated from the opcode table: an instruction with a specifier of some addressing
+# mode for every operand, followed by another instruction or random bytes and cut to the window.
+# A quarter of those with two or more operands are resumed at a later operand instead, like the
+# windows VaxDecoder feeds it when an instruction doesn't fit. Some windows get an undefined opcode
+# or are random bytes altogether.
+#
+# Every window is checked against reference(), which works out what VaxDecoderTest should
+# produce from the opcode table and the OperandDecoder model, and the decoded operands are counted
+# into coverage bins: addressing mode (and whether it is indexed) by operand slot and by the
+# decoder position the operand starts at, and opcodes. Addressing modes and opcodes are picked
+# with weights favouring the bins that have been hit the least so far.
+#
+# Batches of windows are generated and simulated by a pool of processes, each with a Simulation
+# of its own (see simulate.py), against the coverage as it was when the batch was handed out.
+# Mismatching windows are minimized there to the shortest prefix that still mismatches with the
+# rest of the window zero, with as many of its bytes zero as possible.
+
+MODES = (
+    "literal", "index", "register", "register_deferred", "autodec", "autoinc", "immediate",
+    "autoinc_deferred", "absolute", "byte_disp", "byte_disp_deferred", "word_disp",
+    "word_disp_deferred", "long_disp", "long_disp_deferred", "fixed",
+)
+
+FIXED = MODES.index("fixed")
+
+# Mode nibble, payload bytes
+_MODE_FORMS = {
+    "index":              (0x4, 0),
+    "register":           (0x5, 0),
+    "register_deferred":  (0x6, 0),
+    "autodec":            (0x7, 0),
+    "autoinc":            (0x8, 0),
+    "autoinc_deferred":   (0x9, 0),
+    "byte_disp":          (0xa, 1),
+    "byte_disp_deferred": (0xb, 1),
+    "word_disp":          (0xc, 2),
+    "word_disp_deferred": (0xd, 2),
+    "long_disp":          (0xe, 4),
+    "long_disp_deferred": (0xf, 4),
+}
+
+# Addressing mode of every specifier byte (the base byte for an indexed one)
+MODE_OF_BYTE = np.zeros(256, dtype=np.uint8)
+MODE_OF_BYTE[0x00:0x40] = MODES.index("literal")
+for _mode, (_nibble, _) in _MODE_FORMS.items():
+    MODE_OF_BYTE[_nibble << 4:(_nibble + 1) << 4] = MODES.index(_mode)
+MODE_OF_BYTE[0x8f] = MODES.index("immediate")
+MODE_OF_BYTE[0x9f] = MODES.index("absolute")
+
+# (mode, indexed) bins that can occur: there's no unindexed index mode or indexed fixed operand
+REACHABLE = np.ones((len(MODES), 2), dtype=bool)
+REACHABLE[MODES.index("index"), 0] = False
+REACHABLE[FIXED, 1] = False
+
+# What a specifier can be generated as
+_CHOICES = [(mode, indexed) for mode in range(len(MODES)) for indexed in (0, 1) if REACHABLE[mode, indexed] and mode != FIXED]
+
+# Share of windows that are random bytes, and that start with an undefined opcode
+_RANDOM  = 0.05
+_ILLEGAL = 0.05
+_RESUME  = 0.25
+
+
+class Coverage:
+    # Hit counts of the coverage bins
+    def __init__(self, decoders, opcodes):
+        self.slot     = np.zeros((MAX_OPERANDS, len(MODES), 2), dtype=np.int64)
+        self.position = np.zeros((decoders + 1, len(MODES), 2), dtype=np.int64)
+        self.opcode   = np.zeros(opcodes, dtype=np.int64)
+
+    def merge(self, other):
+        self.slot     += other.slot
+        self.position += other.position
+        self.opcode   += other.opcode
+
+    def summary(self):
+        # (bins hit, bins) for each kind of bin
+        position = np.broadcast_to(REACHABLE, self.position.shape).copy()
+        position[0] = False
+        return {
+            "slot":     (int((self.slot[:, REACHABLE] > 0).sum()), int(REACHABLE.sum()) * MAX_OPERANDS),
+            "position": (int((self.position[position] > 0).sum()), int(position.sum())),
+            "opcode":   (int((self.opcode[1:] > 0).sum()), len(self.opcode) - 1),
+        }
+
+    def uncovered(self):
+        # The slot bins never hit, as (slot, mode, indexed)
+        return [
+            (int(slot) + 1, MODES[mode], bool(indexed))
+            for slot, mode, indexed in zip(*np.nonzero((self.slot == 0) & REACHABLE))
+        ]
+
+
+def reference(data, resume, opcode, first, decoders):
+    # What VaxDecoderTest outputs for the windows `data` ((count, width) bytes), resumed at operand
+    # `first` of `opcode` where `resume` is set. Per operand fields are (MAX_OPERANDS, count)
+    # arrays by operand index, and only hold for the operands set in o_decoded.
+    arrays = opcode_arrays()
+    count, width = data.shape
+    stride = width + LOOKAHEAD + 2
+    vector = np.arange(count)
+
+    # Bytes past the window read as zero
+    buf = np.zeros((count, stride), dtype=np.uint8)
+    buf[:, :width] = data
+    buf   = buf.ravel()
+    pairs = buf[:-1].astype(np.int32) | (buf[1:].astype(np.int32) << 8)
+    base  = vector.astype(np.int64) * stride
+
+    resume   = np.asarray(resume, dtype=bool)
+    first    = np.where(resume, first, 0).astype(np.int64)
+    extended = ~resume & (data[:, 0] >= 0xfd)
+    row      = np.where(resume, arrays.row[np.asarray(opcode, dtype=np.int64) & 0xffff], arrays.row[pairs[base]])
+    seed     = 1 + extended.astype(np.int64)
+
+    remaining = arrays.count[row].astype(np.int64) - first
+
+    # Operands in window order, the n-th being operand first + n
+    starts = np.zeros((MAX_OPERANDS, count), dtype=np.int64)
+    ends   = np.zeros((MAX_OPERANDS, count), dtype=np.int64)
+    oplens = np.zeros((MAX_OPERANDS, count), dtype=np.uint8)
+    fixed  = np.zeros((MAX_OPERANDS, count), dtype=bool)
+    pos    = base + seed
+    for n in range(MAX_OPERANDS):
+        operand   = (first + n) % MAX_OPERANDS
+        starts[n] = pos - base
+        oplens[n] = arrays.oplen[operand, row]
+        fixed[n]  = ~arrays.is_spec[operand, row]
+        pos      += arrays.op_len[arrays.op_class[operand, row] | pairs[pos]]
+        ends[n]   = pos - base
+
+    # Only the low longword of a quadword or octaword immediate is decoded, and decoding stops there
+    is_long = (buf[base + starts] == 0x8f) & ((oplens == Length.QUAD.value) | (oplens == Length.OCTA.value))
+    done    = (starts <= decoders) & np.where(is_long, starts + 5 <= width, ends <= width)
+    blocked = (~done | is_long) & (np.arange(MAX_OPERANDS)[:, None] < remaining)
+    stop    = np.where(blocked.any(axis=0), blocked.argmax(axis=0), MAX_OPERANDS)
+
+    def end_of(n):
+        return ends[np.clip(n, 0, MAX_OPERANDS - 1), vector]
+
+    fits      = stop >= remaining
+    long_fits = ~fits & done[np.minimum(stop, MAX_OPERANDS - 1), vector]
+    more      = ~fits & (~long_fits | (stop + 1 < remaining))
+    decoded   = np.where(fits, remaining, np.where(long_fits, stop + 1, stop))
+    length    = np.where(fits, np.where(remaining == 0, seed, end_of(remaining - 1)),
+                np.where(long_fits, end_of(stop) - (stop + 1 < remaining),
+                         np.where(stop == 0, seed, end_of(stop - 1)) - 1))
+
+    branch = np.array([
+        sum(1 << operand for operand, (kind, _) in enumerate(operands) if kind == "b") for operands in arrays.operands
+    ], dtype=np.uint32)
+
+    expected = {
+        "row":        row,
+        "o_count":    arrays.count[row].astype(np.uint32),
+        "o_branch":   branch[row],
+        "o_more":     more,
+        "o_length":   length.astype(np.uint32),
+        "o_operand":  np.where(long_fits, first + stop + 1, first + stop).astype(np.uint32),
+        "o_decoded":  np.zeros(count, dtype=np.uint32),
+        "starts":     np.zeros((MAX_OPERANDS, count), dtype=np.int64),
+        "fixed":      np.zeros((MAX_OPERANDS, count), dtype=bool),
+        **{field: np.zeros((MAX_OPERANDS, count), dtype=np.uint32) for field in
+           ("o_spec", "o_immed", "o_end", "o_speclen", "o_deferred", "o_immvalid", "o_legalop")},
+    }
+    for n in range(MAX_OPERANDS):
+        operand = first + n
+        valid   = (n < decoded) & (operand < MAX_OPERANDS)
+        at      = base + starts[n]
+        spec    = np.zeros(count, dtype=np.uint64)
+        for byte in range(6):
+            spec |= buf[at + byte].astype(np.uint64) << np.uint64(8 * byte)
+        model = decode_operands(spec, oplens[n], True, fixed[n])
+
+        index = (operand[valid], vector[valid])
+        expected["o_decoded"][valid] |= (np.uint32(1) << operand[valid].astype(np.uint32))
+        expected["starts"][index]     = starts[n][valid]
+        expected["o_spec"][index]     = (spec & np.uint64(0xffff))[valid]
+        expected["o_immed"][index]    = model.immed[valid]
+        expected["o_end"][index]      = ends[n][valid]
+        expected["o_speclen"][index]  = model.length[valid]
+        expected["o_deferred"][index] = model.deferred[valid]
+        expected["o_immvalid"][index] = model.immvalid[valid]
+        expected["o_legalop"][index]  = model.legalop[valid]
+        expected["fixed"][index]      = fixed[n][valid]
+    return expected
+
+
+def compare(outputs, expected):
+    # {output: which vectors mismatch on it}
+    result = {name: outputs[name] != expected[name] for name in ("o_count", "o_branch", "o_more", "o_length", "o_decoded")}
+    result["o_operand"] = expected["o_more"] & (outputs["o_operand"] != expected["o_operand"])
+    for operand in range(MAX_OPERANDS):
+        decoded = ((expected["o_decoded"] >> operand) & 1).astype(bool)
+        for field in ("o_spec", "o_immed", "o_end", "o_speclen"):
+            result[f"{field}{operand + 1}"] = decoded & (outputs[f"{field}{operand + 1}"] != expected[field][operand])
+        for field in ("o_deferred", "o_immvalid", "o_legalop"):
+            result[f"{field}[{operand}]"] = decoded & (((outputs[field] >> operand) & 1) != expected[field][operand])
+    return result
+
+
+def coverage(expected, decoders, opcodes):
+    # The Coverage of the windows `expected` came from
+    result = Coverage(decoders, opcodes)
+    spec     = expected["o_spec"]
+    decoded  = ((expected["o_decoded"][None, :] >> np.arange(MAX_OPERANDS, dtype=np.uint32)[:, None]) & 1).astype(bool)
+    indexed  = (spec >> 4) & 0xf == 0x4
+    mode     = np.where(expected["fixed"], FIXED, MODE_OF_BYTE[np.where(indexed, spec >> 8, spec) & 0xff])
+    indexed &= ~expected["fixed"]
+    slot     = np.broadcast_to(np.arange(MAX_OPERANDS)[:, None], spec.shape)
+
+    np.add.at(result.slot, (slot[decoded], mode[decoded], indexed[decoded].astype(np.int64)), 1)
+    np.add.at(result.position, (expected["starts"][decoded], mode[decoded], indexed[decoded].astype(np.int64)), 1)
+    np.add.at(result.opcode, expected["row"], 1)
+    return result
+
+
+def _payload(rng, size):
+    value = rng.choice(PAYLOADS) if rng.random() < 0.5 else rng.getrandbits(32)
+    value = value | rng.getrandbits(8 * size) << 32 if size > 4 else value
+    return (value & ((1 << (8 * size)) - 1)).to_bytes(size, "little")
+
+
+def _specifier(rng, mode, size):
+    if mode == "literal":
+        return bytes([rng.randrange(0x40)])
+    if mode == "immediate":
+        return b"\x8f" + _payload(rng, size)
+    if mode == "absolute":
+        return b"\x9f" + _payload(rng, 4)
+    nibble, payload = _MODE_FORMS[mode]
+    # PC would make autoincrement immediate and autoincrement deferred absolute
+    register = rng.randrange(15 if mode in ("autoinc", "autoinc_deferred") else 16)
+    return bytes([nibble << 4 | register]) + _payload(rng, payload)
+
+
+class Generator:
+    # Generates windows of `width` bytes, favouring the bins of `coverage` hit the least
+    def __init__(self, rng, width, coverage):
+        self.rng    = rng
+        self.width  = width
+        self.arrays = opcode_arrays()
+
+        slot     = 1 / (1 + coverage.slot)
+        position = 1 / (1 + coverage.position)
+        self._slot     = [[slot[n, mode, indexed] for mode, indexed in _CHOICES] for n in range(MAX_OPERANDS)]
+        self._position = [[position[p, mode, indexed] for mode, indexed in _CHOICES] for p in range(len(position))]
+
+        self._rows     = range(1, len(self.arrays.opcodes))
+        self._rows_cum = list(accumulate((1 / (1 + coverage.opcode[1:])).tolist()))
+        self._undefined = np.flatnonzero(self.arrays.row == 0)
+
+    def _bytes(self, count):
+        return self.rng.getrandbits(8 * count).to_bytes(count, "little")
+
+    def _choice(self, slot, position):
+        position = self._position[min(position, len(self._position) - 1)]
+        weights  = [a + b for a, b in zip(self._slot[slot], position)]
+        return _CHOICES[self.rng.choices(range(len(_CHOICES)), weights)[0]]
+
+    def instruction(self, row):
+        # The bytes of an instruction with opcode `row`, and where its operands start
+        rng   = self.rng
+        value = int(self.arrays.value[row])
+        code  = bytearray(value.to_bytes(2 if value > 0xff else 1, "little"))
+        starts = []
+        for slot, (kind, data_type) in enumerate(self.arrays.operands[row]):
+            starts.append(len(code))
+            if kind in "bi":
+                code += _payload(rng, DATA_TYPE_BYTES[data_type])
+                continue
+            mode, indexed = self._choice(slot, len(code))
+            if indexed:
+                code.append(0x40 | rng.randrange(16))
+            code += _specifier(rng, MODES[mode], DATA_TYPE_BYTES[data_type])
+        return bytes(code), starts
+
+    def _row(self):
+        return self.rng.choices(self._rows, cum_weights=self._rows_cum)[0]
+
+    def window(self):
+        # (window bytes, resume, opcode, first operand)
+        rng  = self.rng
+        roll = rng.random()
+        if roll < _RANDOM:
+            return self._bytes(self.width), False, 0, 0
+        if roll < _RANDOM + _ILLEGAL:
+            value = int(rng.choice(self._undefined))
+            return (value.to_bytes(2, "little") + self._bytes(self.width))[:self.width], False, 0, 0
+
+        row = self._row()
+        code, starts = self.instruction(row)
+        text = code + (self.instruction(self._row())[0] if rng.random() < 0.5 else b"") + self._bytes(self.width)
+        if len(starts) >= 2 and rng.random() < _RESUME:
+            first  = rng.randrange(1, len(starts))
+            offset = starts[first] - 1
+            return text[offset:offset + self.width], True, int(self.arrays.value[row]), first
+        return text[:self.width], False, 0, 0
+
+
+_sim = None
+
+
+def _init_worker(design, backend, build_dir):
+    global _sim
+    from .decode import VaxDecoderTest
+    from .simulate import Simulation
+
+    _sim = Simulation(VaxDecoderTest(**design), backend, build_dir)
+
+
+def _inputs(sim, data, resume, opcode, first):
+    inputs = sim.zeros(len(data))
+    padded = np.zeros((len(data), inputs["i_data"].shape[1] * 4), dtype=np.uint8)
+    padded[:, :data.shape[1]] = data
+    inputs["i_data"]    = padded.view("<u4")
+    inputs["i_resume"]  = resume
+    inputs["i_opcode"]  = opcode
+    inputs["i_operand"] = first
+    return inputs
+
+
+def _check(data, resume, opcode, first):
+    # Simulates the windows and returns ({output: mismatching vectors}, expected, RunStats). A
+    # pipelined design (see VaxDecoderTest.stages) is run on for its latency, less the register
+    # stage Simulation's sampling after the clock edge already covers.
+    inputs = _inputs(_sim, data, resume, opcode, first)
+    delay  = max(0, _sim.design.latency - 1)
+    outputs, stats = _sim.run(np.concatenate((inputs, inputs[:delay])))
+    outputs = outputs[delay:]
+    expected = reference(data, resume, opcode, first, _sim.design.decoders)
+    return compare(outputs, expected), expected, stats
+
+
+def _failing(data, resume, opcode, first):
+    count = len(data)
+    mismatches, _, _ = _check(data, np.full(count, resume), np.full(count, opcode), np.full(count, first))
+    return np.logical_or.reduce(list(mismatches.values()))
+
+
+def minimize(window, resume, opcode, first):
+    # The shortest prefix of `window` that still mismatches with the rest zero, with as many of
+    # its bytes cleared as possible
+    width = len(window)
+
+    def shortest(window):
+        candidates = np.where(np.arange(width)[None, :] < np.arange(width + 1)[:, None], window[None, :], 0).astype(np.uint8)
+        failing = _failing(candidates, resume, opcode, first)
+        return candidates[failing.argmax()] if failing.any() else window
+
+    window = shortest(window)
+    while True:
+        nonzero = np.flatnonzero(window)
+        if not len(nonzero):
+            return window
+        candidates = np.repeat(window[None, :], len(nonzero), axis=0)
+        candidates[np.arange(len(nonzero)), nonzero] = 0
+        failing = _failing(candidates, resume, opcode, first)
+        if not failing.any():
+            return window
+        window = shortest(candidates[failing.argmax()])
+
+
+def fuzz_batch(job):
+    # Generates and checks `count` windows, returning the Coverage, the vector count, seconds
+    # generating and simulating, and up to `limit` minimized findings
+    seed, count, limit, cover = job
+    width     = _sim.design.width
+    generator = Generator(random.Random(seed), width, cover)
+
+    start   = time.perf_counter()
+    windows = [generator.window() for _ in range(count)]
+    data    = np.frombuffer(b"".join(window.ljust(width, b"\0") for window, _, _, _ in windows), dtype=np.uint8).reshape(-1, width)
+    resume  = np.array([window[1] for window in windows], dtype=bool)
+    opcode  = np.array([window[2] for window in windows], dtype=np.uint32)
+    first   = np.array([window[3] for window in windows], dtype=np.uint32)
+    generate_s = time.perf_counter() - start
+
+    mismatches, expected, stats = _check(data, resume, opcode, first)
+    failing = np.logical_or.reduce(list(mismatches.values()))
+
+    findings = []
+    for n in np.flatnonzero(failing)[:limit]:
+        window = minimize(data[n].copy(), bool(resume[n]), int(opcode[n]), int(first[n]))
+        findings.append({
+            "bytes":   bytes(window[:np.flatnonzero(window).max() + 1 if window.any() else 0]).hex(),
+            "resume":  bool(resume[n]),
+            "opcode":  f"{int(opcode[n]):04x}" if resume[n] else None,
+            "operand": int(first[n]) if resume[n] else None,
+            "outputs": sorted(name for name, wrong in mismatches.items() if wrong[n]),
+        })
+
+    cover = coverage(expected, _sim.design.decoders, len(cover.opcode))
+    return cover, count, generate_s, stats.seconds, int(failing.sum()), findings
+
+
+def run(design, backend="auto", build_dir="build", jobs=None, vectors=1 << 20, batch=1 << 14, limit=4, seed=0,
+        duration=None, progress=None):
+    # Fuzzes VaxDecoderTest(**design) with `vectors` windows, or for `duration` seconds, in batches of
+    # `batch` windows over `jobs` processes, and returns the report
+    from .decode import VaxDecoderTest
+    from .simulate import Simulation
+
+    # Built once up front, so the workers find it in the build directory instead of racing to build it
+    sim     = Simulation(VaxDecoderTest(**design), backend, build_dir)
+    backend = sim.backend
+    jobs    = jobs or os.cpu_count()
+
+    cover     = Coverage(sim.design.decoders, len(opcode_arrays().opcodes))
+    findings  = {}
+    totals    = {"vectors": 0, "failing": 0, "generate_s": 0.0, "sim_s": 0.0}
+    submitted = 0
+    start     = time.perf_counter()
+
+    def more():
+        if duration is not None:
+            return time.perf_counter() - start < duration
+        return submitted < vectors
+
+    with multiprocessing.get_context("spawn").Pool(jobs, _init_worker, (design, backend, build_dir)) as pool:
+        pending = deque()
+        while pending or more():
+            while more() and len(pending) < 2 * jobs:
+                count = batch if duration is not None else min(batch, vectors - submitted)
+                pending.append(pool.apply_async(fuzz_batch, ((seed << 32 | submitted, count, limit, cover),)))
+                submitted += count
+
+            delta, count, generate_s, sim_s, failing, found = pending.popleft().get()
+            cover.merge(delta)
+            totals["vectors"]    += count
+            totals["failing"]    += failing
+            totals["generate_s"] += generate_s
+            totals["sim_s"]      += sim_s
+            for finding in found:
+                findings.setdefault((finding["bytes"], finding["resume"], finding["opcode"], finding["operand"]), finding)
+            if progress is not None:
+                progress(totals, cover, len(findings))
+    seconds = time.perf_counter() - start
+
+    return {
+        "design":        design,
+        "backend":       backend,
+        "vectors":       totals["vectors"],
+        "failing":       totals["failing"],
+        "seconds":       seconds,
+        "vectors_per_s": totals["vectors"] / seconds,
+        "sim_vectors_per_s": totals["vectors"] / totals["sim_s"] if totals["sim_s"] else None,
+        "coverage":      cover.summary(),
+        "uncovered":     cover.uncovered(),
+        "findings":      list(findings.values()),
+    }
+
+
+if __name__ == "__main__":
+    from argparse import ArgumentParser
+
+    from .decode_operand import STAGES
+    from .simulate import BACKENDS
+
+    parser = ArgumentParser(description="Fuzz VaxDecoderTest with coverage-guided random instruction streams")
+    parser.add_argument("--backend", choices=BACKENDS, default="auto")
+    parser.add_argument("--width", type=int, default=1 + 6*6, help="window width in bytes")
+    parser.add_argument("--decoders", type=int, default=None, help="operand decoder count")
+    parser.add_argument("--boundary", choices=("ripple", "prefix"), default="ripple")
+    parser.add_argument("--lookup", choices=("rom", "mux"), default="rom")
+    parser.add_argument("--stages", nargs="*", choices=STAGES, default=[], help="OperandDecoder register stages")
+    parser.add_argument("--vectors", "-n", type=int, default=1 << 20, help="windows to check")
+    parser.add_argument("--duration", type=float, default=None, help="run for this many seconds instead")
+    parser.add_argument("--batch", type=int, default=1 << 14, help="windows per worker task")
+    parser.add_argument("--limit", type=int, default=4, help="findings to minimize per batch")
+    parser.add_argument("--jobs", "-j", type=int, default=None, help="simulator processes (default: one per CPU)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", "-o", default=None, help="write the JSON report here")
+    parser.add_argument("--build-dir", default="build")
+    args = parser.parse_args()
+
+    def progress(totals, cover, findings):
+        bins = ", ".join(f"{kind} {hit}/{total}" for kind, (hit, total) in cover.summary().items())
+        print(f"{totals['vectors']} vectors, {totals['failing']} failing, {findings} findings; coverage {bins}",
+              file=sys.stderr, flush=True)
+
+    design = {"width": args.width, "decoders": args.decoders, "boundary": args.boundary, "lookup": args.lookup,
+              "stages": args.stages}
+    report = run(design, args.backend, args.build_dir, args.jobs, args.vectors, args.batch, args.limit, args.seed,
+                 args.duration, progress)
+
+    text = json.dumps(report, indent=2)
+    if args.output is None:
+        print(text)
+    else:
+        Path(args.output).write_text(text + "\n")
+
+    print(f"{report['vectors']} vectors in {report['seconds']:.1f}s ({report['backend']}), "
+          f"{report['vectors_per_s']:,.0f} vectors/s, {len(report['findings'])} findings", file=sys.stderr)
+    sys.exit(1 if report["findings"] else 0)
@@ -0,0 +1,997 @@
+import struct
+import sys
+import time
+
+from .decode import IssueStats, Opcode
+from .disasm import DATA_TYPE_BYTES, opcode_arrays
+
+# VAX instruction set simulator, used as the golden model for the decoder and the pipeline.
+#
+# Instructions are decoded once into compact records and grouped into basic blocks, which are
+# cached by their starting PC. A block ends at the first instruction that can change the flow
+# of control. Writes to memory that hit a page holding a cached block invalidate every block
+# on that page, so self-modifying code and loaders behave.
+#
+# Operand specifiers are decoded with the same length rules as OperandDecoder (through the
+# disassembler's tables) and evaluated in order, including the autoincrement and autodecrement
+# side effects, when the instruction executes.
+#
+# Only the integer, control flow and procedure call instructions are implemented; anything
+# else stops the simulation with UnimplementedInstruction.
+
+PAGE_SHIFT = 9 # VAX pages are 512 bytes
+
+PC = 15
+SP = 14
+FP = 13
+AP = 12
+
+MAX_BLOCK = 64
+
+__all__ = (
+    "Cpu",
+    "SimulationError",
+    "ReservedInstruction",
+    "UnimplementedInstruction",
+    "AccessViolation",
+)
+
+
+class SimulationError(Exception):
+    pass
+
+
+class ReservedInstruction(SimulationError):
+    pass
+
+
+class UnimplementedInstruction(SimulationError):
+    pass
+
+
+class AccessViolation(SimulationError):
+    pass
+
+
+def _sext(value, size):
+    bits = 8 * size
+    value &= (1 << bits) - 1
+    return value - (1 << bits) if value >> (bits - 1) else value
+
+
+class Operand:
+    # A decoded operand specifier; `locate` evaluates its address (with side effects) and
+    # returns a memory address, ~register for register mode, or None for literal/immediate.
+    __slots__ = ("size", "locate", "const")
+
+    def __init__(self, size, locate, const=None):
+        self.size   = size
+        self.locate = locate
+        self.const  = const
+
+
+class Instruction:
+    __slots__ = ("addr", "next_pc", "opcode", "operands", "execute", "ends_block", "extra")
+
+    def __init__(self, addr, next_pc, opcode, operands, execute, ends_block, extra=None):
+        self.addr       = addr
+        self.next_pc    = next_pc
+        self.opcode     = opcode
+        self.operands   = operands
+        self.execute    = execute
+        self.ends_block = ends_block
+        self.extra      = extra # CASE table address
+
+
+class Block:
+    __slots__ = ("pc", "end", "instructions")
+
+    def __init__(self, pc, end, instructions):
+        self.pc           = pc
+        self.end          = end
+        self.instructions = instructions
+
+
+class Cpu:
+    def __init__(self, memory_size=16 << 20):
+        self.memory = bytearray(memory_size)
+        self.regs   = [0] * 16
+        self.n = self.z = self.v = self.c = 0
+        self.psw    = 0 # PSW bits other than the condition codes
+
+        self.halted  = False
+        self.retired = 0
+
+        self.blocks      = {}
+        self.code_pages  = {}
+        self.stale       = False
+        self.translated  = 0
+        self.block_hits  = 0
+
+    # Memory
+
+    def load_image(self, data, base=0):
+        self.memory[base:base + len(data)] = data
+        self._invalidate_range(base, base + len(data))
+
+    def read(self, addr, size):
+        if addr < 0 or addr + size > len(self.memory):
+            raise AccessViolation(f"read of {size} bytes at 0x{addr:08x}")
+        return int.from_bytes(self.memory[addr:addr + size], "little")
+
+    def write(self, addr, size, value):
+        if addr < 0 or addr + size > len(self.memory):
+            raise AccessViolation(f"write of {size} bytes at 0x{addr:08x}")
+        self.memory[addr:addr + size] = (value & ((1 << (8 * size)) - 1)).to_bytes(size, "little")
+        if (addr >> PAGE_SHIFT) in self.code_pages or ((addr + size - 1) >> PAGE_SHIFT) in self.code_pages:
+            self._invalidate_range(addr, addr + size)
+
+    def load(self, loc, size):
+        if loc >= 0:
+            return self.read(loc, size)
+        reg = ~loc
+        if size == 8:
+            return self.regs[reg] | (self.regs[(reg + 1) & 0xf] << 32)
+        return self.regs[reg] & ((1 << (8 * size)) - 1)
+
+    def store(self, loc, size, value):
+        if loc >= 0:
+            self.write(loc, size, value)
+            return
+        reg = ~loc
+        if size >= 4:
+            self.regs[reg] = value & 0xffffffff
+            if size == 8:
+                self.regs[(reg + 1) & 0xf] = (value >> 32) & 0xffffffff
+        else:
+            mask = (1 << (8 * size)) - 1
+            self.regs[reg] = (self.regs[reg] & ~mask) | (value & mask)
+
+    def read_operand(self, operand):
+        if operand.const is not None:
+            return operand.const
+        return self.load(operand.locate(self), operand.size)
+
+    def push(self, value):
+        self.regs[SP] = (self.regs[SP] - 4) & 0xffffffff
+        self.write(self.regs[SP], 4, value)
+
+    def pop(self):
+        value = self.read(self.regs[SP], 4)
+        self.regs[SP] = (self.regs[SP] + 4) & 0xffffffff
+        return value
+
+    # Block cache
+
+    def _invalidate_range(self, start, end):
+        for page in range(start >> PAGE_SHIFT, ((end - 1) >> PAGE_SHIFT) + 1):
+            for pc in self.code_pages.pop(page, ()):
+                if self.blocks.pop(pc, None) is not None:
+                    self.stale = True
+
+    def _translate(self, pc):
+        instructions = []
+        addr = pc
+        while len(instructions) < MAX_BLOCK:
+            ins = _decode(self, addr)
+            instructions.append(ins)
+            addr = ins.next_pc
+            if ins.ends_block:
+                break
+
+        block = Block(pc, addr, tuple(instructions))
+        self.blocks[pc] = block
+        for page in range(pc >> PAGE_SHIFT, ((addr - 1) >> PAGE_SHIFT) + 1):
+            self.code_pages.setdefault(page, set()).add(pc)
+        self.translated += 1
+        return block
+
+    # Execution
+
+    def run(self, max_instructions=None, trace=None):
+        regs    = self.regs
+        blocks  = self.blocks
+        limit   = float("inf") if max_instructions is None else max_instructions
+        retired = self.retired
+
+        try:
+            while not self.halted and retired < limit:
+                block = blocks.get(regs[PC])
+                if block is None:
+                    block = self._translate(regs[PC])
+                else:
+                    self.block_hits += 1
+
+                self.stale = False
+                for ins in block.instructions:
+                    regs[PC] = ins.next_pc
+                    ins.execute(self, ins)
+                    retired += 1
+                    if trace is not None:
+                        trace(ins)
+                    if regs[PC] != ins.next_pc or self.stale or self.halted or retired >= limit:
+                        break
+        finally:
+            self.retired = retired
+
+        return retired
+
+
+# Specifier decoding
+
+def _decode_specifier(cpu, pos, size, oplen_class):
+    arrays = opcode_arrays()
+    mem    = cpu.memory
+    if pos >= len(mem):
+        raise AccessViolation(f"instruction fetch at 0x{pos:08x}")
+    spec   = mem[pos]
+    mode, reg = spec >> 4, spec & 0xf
+    # The byte after the specifier only matters for indexed ones, and may be past the end of memory
+    length = int(arrays.op_len[oplen_class | spec | ((mem[pos + 1] if pos + 1 < len(mem) else 0) << 8)])
+    end    = pos + length
+    if end > len(mem):
+        raise AccessViolation(f"instruction fetch at 0x{pos:08x}")
+
+    if mode == 0x4:
+        base_locate = _decode_specifier(cpu, pos + 1, size, oplen_class)[0].locate
+        index = reg
+        def locate(cpu):
+            return (base_locate(cpu) + cpu.regs[index] * size) & 0xffffffff
+        return Operand(size, locate), end
+
+    def field(offset, width, signed=True):
+        value = int.from_bytes(mem[pos + offset:pos + offset + width], "little", signed=signed)
+        return value
+
+    if mode <= 0x3:
+        return Operand(size, _no_locate, spec & 0x3f), end
+    if mode == 0x5:
+        loc = ~reg
+        return Operand(size, lambda cpu: loc), end
+    if mode == 0x6:
+        return Operand(size, lambda cpu: cpu.regs[reg]), end
+    if mode == 0x7:
+        def locate(cpu):
+            cpu.regs[reg] = (cpu.regs[reg] - size) & 0xffffffff
+            return cpu.regs[reg]
+        return Operand(size, locate), end
+    if mode == 0x8:
+        if reg == PC:
+            return Operand(size, _no_locate, field(1, size, signed=False)), end
+        def locate(cpu):
+            addr = cpu.regs[reg]
+            cpu.regs[reg] = (addr + size) & 0xffffffff
+            return addr
+        return Operand(size, locate), end
+    if mode == 0x9:
+        if reg == PC:
+            addr = field(1, 4, signed=False)
+            return Operand(size, lambda cpu: addr), end
+        def locate(cpu):
+            addr = cpu.regs[reg]
+            cpu.regs[reg] = (addr + 4) & 0xffffffff
+            return cpu.read(addr, 4)
+        return Operand(size, locate), end
+
+    disp     = field(1, length - 1)
+    deferred = mode & 1
+    if reg == PC:
+        # PC relative, PC is the address following the specifier
+        addr = (end + disp) & 0xffffffff
+        if deferred:
+            return Operand(size, lambda cpu: cpu.read(addr, 4)), end
+        return Operand(size, lambda cpu: addr), end
+    if deferred:
+        return Operand(size, lambda cpu: cpu.read((cpu.regs[reg] + disp) & 0xffffffff, 4)), end
+    return Operand(size, lambda cpu: (cpu.regs[reg] + disp) & 0xffffffff), end
+
+
+def _no_locate(cpu):
+    return None
+
+
+def _decode(cpu, addr):
+    arrays = opcode_arrays()
+    mem    = cpu.memory
+    if addr + 2 > len(mem):
+        raise AccessViolation(f"instruction fetch at 0x{addr:08x}")
+
+    first = mem[addr]
+    row   = int(arrays.row[first | (mem[addr + 1] << 8)])
+    if row == 0:
+        raise ReservedInstruction(f"reserved opcode 0x{first:02x} at 0x{addr:08x}")
+
+    opcode   = arrays.opcodes[row]
+    pos      = addr + (2 if opcode.value > 0xff else 1)
+    operands = []
+    for operand, (kind, data_type) in enumerate(arrays.operands[row]):
+        size = DATA_TYPE_BYTES[data_type]
+        if kind in "bi":
+            if pos + size > len(mem):
+                raise AccessViolation(f"instruction fetch at 0x{pos:08x}")
+            value = int.from_bytes(mem[pos:pos + size], "little", signed=(kind == "b"))
+            pos  += size
+            operands.append(Operand(size, _no_locate, (pos + value) & 0xffffffff if kind == "b" else value))
+        else:
+            spec, pos = _decode_specifier(cpu, pos, size, int(arrays.op_class[operand, row]))
+            operands.append(spec)
+
+    execute = _HANDLERS.get(opcode)
+    if execute is None:
+        execute = _unimplemented
+    return Instruction(addr, pos, opcode, tuple(operands), execute, opcode in _BLOCK_ENDERS, pos)
+
+
+def _unimplemented(cpu, ins):
+    raise UnimplementedInstruction(f"{ins.opcode.name} at 0x{ins.addr:08x}")
+
+
+# Condition codes
+
+def _set_nz(cpu, value, size):
+    bits = 8 * size
+    value &= (1 << bits) - 1
+    cpu.n = value >> (bits - 1)
+    cpu.z = int(value == 0)
+
+
+def _set_nzv0(cpu, value, size):
+    _set_nz(cpu, value, size)
+    cpu.v = 0
+
+
+def _add_cc(cpu, a, b, result, size):
+    bits = 8 * size
+    _set_nz(cpu, result, size)
+    sign = bits - 1
+    cpu.v = int(((a >> sign) & 1) == ((b >> sign) & 1) and ((result >> sign) & 1) != ((a >> sign) & 1))
+    cpu.c = (result >> bits) & 1
+
+
+def _sub_cc(cpu, minuend, subtrahend, result, size):
+    bits = 8 * size
+    mask = (1 << bits) - 1
+    _set_nz(cpu, result, size)
+    sign = bits - 1
+    cpu.v = int(((minuend >> sign) & 1) != ((subtrahend >> sign) & 1) and ((result >> sign) & 1) != ((minuend >> sign) & 1))
+    cpu.c = int((minuend & mask) < (subtrahend & mask))
+
+
+# Instruction handlers
+
+_HANDLERS = {}
+
+
+def _handles(*names):
+    def register(factory):
+        for name in names:
+            _HANDLERS[Opcode[name]] = factory(name)
+        return factory
+    return register
+
+
+def _size_of(name):
+    return {"B": 1, "W": 2, "L": 4, "Q": 8}[name]
+
+
+@_handles("HALT")
+def _halt(name):
+    def execute(cpu, ins):
+        cpu.halted = True
+    return execute
+
+
+@_handles("NOP")
+def _nop(name):
+    def execute(cpu, ins):
+        pass
+    return execute
+
+
+def _binary(name, operation, cc):
+    size   = _size_of(name[-2])
+    three  = name.endswith("3")
+    def execute(cpu, ins):
+        ops = ins.operands
+        a   = cpu.read_operand(ops[0])
+        if three:
+            b   = cpu.read_operand(ops[1])
+            loc = ops[2].locate(cpu)
+        else:
+            loc = ops[1].locate(cpu)
+            b   = cpu.load(loc, size)
+        result = operation(cpu, b, a, size)
+        if result is None:
+            return
+        cpu.store(loc, size, result)
+        cc(cpu, b, a, result, size)
+    return execute
+
+
+@_handles(*(f"{op}{size}{n}" for op in ("ADD", "SUB", "MUL", "DIV", "BIS", "BIC", "XOR") for size in "BWL" for n in "23"))
+def _arith(name):
+    op = name[:3]
+    if op == "ADD":
+        return _binary(name, lambda cpu, b, a, size: b + a, lambda cpu, b, a, r, size: _add_cc(cpu, b, a, r, size))
+    if op == "SUB":
+        return _binary(name, lambda cpu, b, a, size: b - a, lambda cpu, b, a, r, size: _sub_cc(cpu, b, a, r, size))
+    if op == "MUL":
+        def mul(cpu, b, a, size):
+            return _sext(b, size) * _sext(a, size)
+        def mul_cc(cpu, b, a, result, size):
+            _set_nz(cpu, result, size)
+            cpu.v = int(result != _sext(result, size))
+            cpu.c = 0
+        return _binary(name, mul, mul_cc)
+    if op == "DIV":
+        def div(cpu, b, a, size):
+            divisor, dividend = _sext(a, size), _sext(b, size)
+            if divisor == 0:
+                cpu.v, cpu.c = 1, 0
+                return None
+            quotient = abs(dividend) // abs(divisor)
+            return -quotient if (dividend < 0) != (divisor < 0) else quotient
+        def div_cc(cpu, b, a, result, size):
+            _set_nz(cpu, result, size)
+            cpu.v = int(result != _sext(result, size))
+            cpu.c = 0
+        return _binary(name, div, div_cc)
+
+    logic = {
+        "BIS": lambda cpu, b, a, size: b | a,
+        "BIC": lambda cpu, b, a, size: b & ~a,
+        "XOR": lambda cpu, b, a, size: b ^ a,
+    }[op]
+    return _binary(name, logic, lambda cpu, b, a, r, size: _set_nzv0(cpu, r, size))
+
+
+@_handles("MOVB", "MOVW", "MOVL", "MOVQ")
+def _mov(name):
+    size = _size_of(name[-1])
+    def execute(cpu, ins):
+        value = cpu.read_operand(ins.operands[0])
+        cpu.store(ins.operands[1].locate(cpu), size, value)
+        _set_nzv0(cpu, value, size)
+    return execute
+
+
+@_handles("MNEGB", "MNEGW", "MNEGL")
+def _mneg(name):
+    size = _size_of(name[-1])
+    def execute(cpu, ins):
+        value  = cpu.read_operand(ins.operands[0])
+        result = -value
+        cpu.store(ins.operands[1].locate(cpu), size, result)
+        _sub_cc(cpu, 0, value, result, size)
+    return execute
+
+
+@_handles("MCOMB", "MCOMW", "MCOML")
+def _mcom(name):
+    size = _size_of(name[-1])
+    def execute(cpu, ins):
+        result = ~cpu.read_operand(ins.operands[0])
+        cpu.store(ins.operands[1].locate(cpu), size, result)
+        _set_nzv0(cpu, result, size)
+    return execute
+
+
+@_handles("CLRB", "CLRW", "CLRL", "CLRQ")
+def _clr(name):
+    size = _size_of(name[-1])
+    def execute(cpu, ins):
+        cpu.store(ins.operands[0].locate(cpu), size, 0)
+        cpu.n, cpu.z, cpu.v = 0, 1, 0
+    return execute
+
+
+@_handles("TSTB", "TSTW", "TSTL")
+def _tst(name):
+    size = _size_of(name[-1])
+    def execute(cpu, ins):
+        _set_nzv0(cpu, cpu.read_operand(ins.operands[0]), size)
+        cpu.c = 0
+    return execute
+
+
+@_handles("CMPB", "CMPW", "CMPL")
+def _cmp(name):
+    size = _size_of(name[-1])
+    mask = (1 << (8 * size)) - 1
+    def execute(cpu, ins):
+        a = cpu.read_operand(ins.operands[0])
+        b = cpu.read_operand(ins.operands[1])
+        sa, sb = _sext(a, size), _sext(b, size)
+        cpu.n = int(sa < sb)
+        cpu.z = int(sa == sb)
+        cpu.v = 0
+        cpu.c = int((a & mask) < (b & mask))
+    return execute
+
+
+@_handles("BITB", "BITW", "BITL")
+def _bit(name):
+    size = _size_of(name[-1])
+    def execute(cpu, ins):
+        mask = cpu.read_operand(ins.operands[0])
+        _set_nzv0(cpu, mask & cpu.read_operand(ins.operands[1]), size)
+    return execute
+
+
+@_handles("INCB", "INCW", "INCL", "DECB", "DECW", "DECL")
+def _incdec(name):
+    size = _size_of(name[-1])
+    inc  = name.startswith("INC")
+    def execute(cpu, ins):
+        loc   = ins.operands[0].locate(cpu)
+        value = cpu.load(loc, size)
+        if inc:
+            result = value + 1
+            _add_cc(cpu, value, 1, result, size)
+        else:
+            result = value - 1
+            _sub_cc(cpu, value, 1, result, size)
+        cpu.store(loc, size, result)
+    return execute
+
+
+@_handles("ADAWI")
+def _adawi(name):
+    def execute(cpu, ins):
+        add   = cpu.read_operand(ins.operands[0])
+        loc   = ins.operands[1].locate(cpu)
+        value = cpu.load(loc, 2)
+        result = value + add
+        cpu.store(loc, 2, result)
+        _add_cc(cpu, value, add, result, 2)
+    return execute
+
+
+@_handles("ADWC", "SBWC")
+def _carry(name):
+    def execute(cpu, ins):
+        a     = cpu.read_operand(ins.operands[0])
+        loc   = ins.operands[1].locate(cpu)
+        value = cpu.load(loc, 4)
+        if name == "ADWC":
+            result = value + a + cpu.c
+            _add_cc(cpu, value, a, result, 4)
+        else:
+            result = value - a - cpu.c
+            _sub_cc(cpu, value, a + cpu.c, result, 4)
+            cpu.c = int(result < 0)
+        cpu.store(loc, 4, result)
+    return execute
+
+
+@_handles("MOVZBW", "MOVZBL", "MOVZWL")
+def _movz(name):
+    src, dst = _size_of(name[4]), _size_of(name[5])
+    def execute(cpu, ins):
+        value = cpu.read_operand(ins.operands[0]) & ((1 << (8 * src)) - 1)
+        cpu.store(ins.operands[1].locate(cpu), dst, value)
+        _set_nzv0(cpu, value, dst)
+    return execute
+
+
+@_handles("CVTBW", "CVTBL", "CVTWB", "CVTWL", "CVTLB", "CVTLW")
+def _cvt(name):
+    src, dst = _size_of(name[3]), _size_of(name[4])
+    def execute(cpu, ins):
+        value = _sext(cpu.read_operand(ins.operands[0]), src)
+        cpu.store(ins.operands[1].locate(cpu), dst, value)
+        _set_nz(cpu, value, dst)
+        cpu.v = int(value != _sext(value, dst))
+        cpu.c = 0
+    return execute
+
+
+@_handles("MOVAB", "MOVAW", "MOVAL", "MOVAQ")
+def _mova(name):
+    def execute(cpu, ins):
+        addr = ins.operands[0].locate(cpu)
+        cpu.store(ins.operands[1].locate(cpu), 4, addr)
+        _set_nzv0(cpu, addr, 4)
+    return execute
+
+
+@_handles("PUSHAB", "PUSHAW", "PUSHAL", "PUSHAQ")
+def _pusha(name):
+    def execute(cpu, ins):
+        addr = ins.operands[0].locate(cpu)
+        cpu.push(addr)
+        _set_nzv0(cpu, addr, 4)
+    return execute
+
+
+@_handles("PUSHL")
+def _pushl(name):
+    def execute(cpu, ins):
+        value = cpu.read_operand(ins.operands[0])
+        cpu.push(value)
+        _set_nzv0(cpu, value, 4)
+    return execute
+
+
+@_handles("ASHL")
+def _ashl(name):
+    def execute(cpu, ins):
+        count  = _sext(cpu.read_operand(ins.operands[0]), 1)
+        value  = _sext(cpu.read_operand(ins.operands[1]), 4)
+        result = value << count if count >= 0 else value >> -count
+        cpu.store(ins.operands[2].locate(cpu), 4, result)
+        _set_nz(cpu, result, 4)
+        cpu.v = int(result != _sext(result, 4))
+        cpu.c = 0
+    return execute
+
+
+@_handles("ROTL")
+def _rotl(name):
+    def execute(cpu, ins):
+        count  = cpu.read_operand(ins.operands[0]) % 32
+        value  = cpu.read_operand(ins.operands[1]) & 0xffffffff
+        result = ((value << count) | (value >> (32 - count))) & 0xffffffff
+        cpu.store(ins.operands[2].locate(cpu), 4, result)
+        _set_nzv0(cpu, result, 4)
+    return execute
+
+
+# Control flow
+
+_CONDITIONS = {
+    "BNEQ":  lambda cpu: not cpu.z,
+    "BEQL":  lambda cpu: cpu.z,
+    "BGTR":  lambda cpu: not (cpu.n or cpu.z),
+    "BLEQ":  lambda cpu: cpu.n or cpu.z,
+    "BGEQ":  lambda cpu: not cpu.n,
+    "BLSS":  lambda cpu: cpu.n,
+    "BGTRU": lambda cpu: not (cpu.c or cpu.z),
+    "BLEQU": lambda cpu: cpu.c or cpu.z,
+    "BVC":   lambda cpu: not cpu.v,
+    "BVS":   lambda cpu: cpu.v,
+    "BGEQU": lambda cpu: not cpu.c,
+    "BLSSU": lambda cpu: cpu.c,
+}
+
+
+@_handles(*_CONDITIONS)
+def _bcond(name):
+    condition = _CONDITIONS[name]
+    def execute(cpu, ins):
+        if condition(cpu):
+            cpu.regs[PC] = ins.operands[0].const
+    return execute
+
+
+@_handles("BRB", "BRW")
+def _br(name):
+    def execute(cpu, ins):
+        cpu.regs[PC] = ins.operands[0].const
+    return execute
+
+
+@_handles("BSBB", "BSBW")
+def _bsb(name):
+    def execute(cpu, ins):
+        cpu.push(ins.next_pc)
+        cpu.regs[PC] = ins.operands[0].const
+    return execute
+
+
+@_handles("RSB")
+def _rsb(name):
+    def execute(cpu, ins):
+        cpu.regs[PC] = cpu.pop()
+    return execute
+
+
+@_handles("JMP")
+def _jmp(name):
+    def execute(cpu, ins):
+        cpu.regs[PC] = ins.operands[0].locate(cpu)
+    return execute
+
+
+@_handles("JSB")
+def _jsb(name):
+    def execute(cpu, ins):
+        target = ins.operands[0].locate(cpu)
+        cpu.push(ins.next_pc)
+        cpu.regs[PC] = target
+    return execute
+
+
+@_handles("BLBS", "BLBC")
+def _blb(name):
+    want = int(name == "BLBS")
+    def execute(cpu, ins):
+        if (cpu.read_operand(ins.operands[0]) & 1) == want:
+            cpu.regs[PC] = ins.operands[1].const
+    return execute
+
+
+@_handles("BBS", "BBC", "BBSS", "BBCS", "BBSC", "BBCC", "BBSSI", "BBCCI")
+def _bb(name):
+    want    = int(name[2] == "S")
+    new_bit = None if len(name) == 3 else int(name[3] == "S")
+    def execute(cpu, ins):
+        pos = _sext(cpu.read_operand(ins.operands[0]), 4)
+        loc = ins.operands[1].locate(cpu)
+        if loc < 0:
+            if not 0 <= pos < 32:
+                raise SimulationError(f"reserved operand, bit position {pos} in a register")
+            addr, bit = loc, pos
+            value = cpu.load(loc, 4)
+        else:
+            addr, bit = loc + (pos >> 3), pos & 7
+            value = cpu.load(addr, 1)
+        old = (value >> bit) & 1
+        if new_bit is not None:
+            value = (value | (1 << bit)) if new_bit else (value & ~(1 << bit))
+            cpu.store(addr, 4 if loc < 0 else 1, value)
+        if old == want:
+            cpu.regs[PC] = ins.operands[2].const
+    return execute
+
+
+@_handles("AOBLSS", "AOBLEQ")
+def _aob(name):
+    def execute(cpu, ins):
+        limit = _sext(cpu.read_operand(ins.operands[0]), 4)
+        loc   = ins.operands[1].locate(cpu)
+        value = cpu.load(loc, 4)
+        result = value + 1
+        cpu.store(loc, 4, result)
+        carry = cpu.c
+        _add_cc(cpu, value, 1, result, 4)
+        cpu.c = carry # N, Z and V only
+        index = _sext(result, 4)
+        if index < limit or (name == "AOBLEQ" and index == limit):
+            cpu.regs[PC] = ins.operands[2].const
+    return execute
+
+
+@_handles("SOBGEQ", "SOBGTR")
+def _sob(name):
+    def execute(cpu, ins):
+        loc   = ins.operands[0].locate(cpu)
+        value = cpu.load(loc, 4)
+        result = value - 1
+        cpu.store(loc, 4, result)
+        carry = cpu.c
+        _sub_cc(cpu, value, 1, result, 4)
+        cpu.c = carry # N, Z and V only
+        index = _sext(result, 4)
+        if index > 0 or (name == "SOBGEQ" and index == 0):
+            cpu.regs[PC] = ins.operands[1].const
+    return execute
+
+
+@_handles("ACBB", "ACBW", "ACBL")
+def _acb(name):
+    size = _size_of(name[-1])
+    def execute(cpu, ins):
+        limit = _sext(cpu.read_operand(ins.operands[0]), size)
+        add   = cpu.read_operand(ins.operands[1])
+        loc   = ins.operands[2].locate(cpu)
+        value = cpu.load(loc, size)
+        result = value + add
+        cpu.store(loc, size, result)
+        carry = cpu.c
+        _add_cc(cpu, value, add, result, size)
+        cpu.c = carry # N, Z and V only
+        index = _sext(result, size)
+        if (index <= limit) if _sext(add, size) >= 0 else (index >= limit):
+            cpu.regs[PC] = ins.operands[3].const
+    return execute
+
+
+@_handles("CASEB", "CASEW", "CASEL")
+def _case(name):
+    size = _size_of(name[-1])
+    mask = (1 << (8 * size)) - 1
+    def execute(cpu, ins):
+        selector = cpu.read_operand(ins.operands[0])
+        base     = cpu.read_operand(ins.operands[1])
+        limit    = cpu.read_operand(ins.operands[2]) & mask
+        offset   = (selector - base) & mask
+        _sub_cc(cpu, offset, limit, offset - limit, size)
+        table    = ins.extra
+        if offset <= limit:
+            cpu.regs[PC] = (table + _sext(cpu.read(table + 2 * offset, 2), 2)) & 0xffffffff
+        else:
+            cpu.regs[PC] = table + 2 * (limit + 1)
+    return execute
+
+
+# Procedure calls
+
+def _call(cpu, ins, target, numarg=None):
+    mask   = cpu.read(target, 2)
+    if numarg is not None:
+        cpu.push(numarg)
+        arglist = cpu.regs[SP]
+    else:
+        arglist = None
+    align  = cpu.regs[SP] & 3
+    cpu.regs[SP] &= ~3
+    for reg in range(11, -1, -1):
+        if mask & (1 << reg):
+            cpu.push(cpu.regs[reg])
+    cpu.push(ins.next_pc)
+    cpu.push(cpu.regs[FP])
+    cpu.push(cpu.regs[AP])
+    psw = (cpu.n << 3) | (cpu.z << 2) | (cpu.v << 1) | cpu.c | (cpu.psw & 0xfff0)
+    cpu.push((align << 30) | (int(numarg is not None) << 29) | ((mask & 0xfff) << 16) | (psw & 0xffef))
+    cpu.push(0)
+    cpu.regs[FP] = cpu.regs[SP]
+    cpu.regs[AP] = arglist
+    cpu.n = cpu.z = cpu.v = cpu.c = 0
+    cpu.psw = (cpu.psw & ~0xa0) | (0x20 if mask & 0x4000 else 0) | (0x80 if mask & 0x8000 else 0) # IV, DV
+    cpu.regs[PC] = (target + 2) & 0xffffffff
+
+
+@_handles("CALLS")
+def _calls(name):
+    def execute(cpu, ins):
+        numarg = cpu.read_operand(ins.operands[0])
+        target = ins.operands[1].locate(cpu)
+        _call(cpu, ins, target, numarg)
+    return execute
+
+
+@_handles("CALLG")
+def _callg(name):
+    def execute(cpu, ins):
+        arglist = ins.operands[0].locate(cpu)
+        target  = ins.operands[1].locate(cpu)
+        _call(cpu, ins, target)
+        cpu.regs[AP] = arglist
+    return execute
+
+
+@_handles("RET")
+def _ret(name):
+    def execute(cpu, ins):
+        cpu.regs[SP] = (cpu.regs[FP] + 4) & 0xffffffff
+        saved = cpu.pop()
+        cpu.regs[AP] = cpu.pop()
+        cpu.regs[FP] = cpu.pop()
+        cpu.regs[PC] = cpu.pop()
+        mask = (saved >> 16) & 0xfff
+        for reg in range(12):
+            if mask & (1 << reg):
+                cpu.regs[reg] = cpu.pop()
+        cpu.regs[SP] = (cpu.regs[SP] + (saved >> 30)) & 0xffffffff
+        cpu.n, cpu.z, cpu.v, cpu.c = (saved >> 3) & 1, (saved >> 2) & 1, (saved >> 1) & 1, saved & 1
+        cpu.psw = saved & 0xfff0
+        if saved & (1 << 29):
+            # Called by CALLS: pop the argument count, then drop the arguments
+            numarg = cpu.pop() & 0xff
+            cpu.regs[SP] = (cpu.regs[SP] + 4 * numarg) & 0xffffffff
+    return execute
+
+
+@_handles("PUSHR", "POPR")
+def _pushr(name):
+    def execute(cpu, ins):
+        mask = cpu.read_operand(ins.operands[0])
+        if name == "PUSHR":
+            for reg in range(14, -1, -1):
+                if mask & (1 << reg):
+                    cpu.push(cpu.regs[reg])
+        else:
+            for reg in range(15):
+                if mask & (1 << reg):
+                    cpu.regs[reg] = cpu.pop()
+    return execute
+
+
+@_handles("MOVPSL")
+def _movpsl(name):
+    def execute(cpu, ins):
+        psl = cpu.psw | (cpu.n << 3) | (cpu.z << 2) | (cpu.v << 1) | cpu.c
+        cpu.store(ins.operands[0].locate(cpu), 4, psl)
+    return execute
+
+
+@_handles("BISPSW", "BICPSW")
+def _bispsw(name):
+    def execute(cpu, ins):
+        mask = cpu.read_operand(ins.operands[0]) & 0xff
+        psw  = cpu.psw | (cpu.n << 3) | (cpu.z << 2) | (cpu.v << 1) | cpu.c
+        psw  = psw | mask if name == "BISPSW" else psw & ~mask
+        cpu.psw = psw & 0xf0
+        cpu.n, cpu.z, cpu.v, cpu.c = (psw >> 3) & 1, (psw >> 2) & 1, (psw >> 1) & 1, psw & 1
+    return execute
+
+
+# Instructions that can change the flow of control end a block
+_BLOCK_ENDERS = frozenset(
+    opcode for opcode in Opcode.table().opcodes
+    if "b" in Opcode._data()[opcode][0] or opcode.name in (
+        "HALT", "REI", "BPT", "RET", "RSB", "JSB", "JMP", "CALLS", "CALLG",
+        "CASEB", "CASEW", "CASEL", "CHMK", "CHME", "CHMS", "CHMU", "XFC", "LDPCTX",
+    )
+)
+
+
+# Tracing
+
+class TraceWriter:
+    # Buffers retired instructions and writes them out in bulk, as text lines
+    # ("<pc> <opcode>") or packed (pc:u32, opcode:u16, length:u8) records.
+    RECORD = struct.Struct("<IHB")
+
+    def __init__(self, output, fmt="text", buffered=65536):
+        self.output   = output
+        self.fmt      = fmt
+        self.buffered = buffered
+        self.pending  = []
+
+    def __call__(self, ins):
+        self.pending.append(ins)
+        if len(self.pending) >= self.buffered:
+            self.flush()
+
+    def flush(self):
+        if self.fmt == "binary":
+            pack = self.RECORD.pack
+            self.output.write(b"".join(pack(ins.addr, ins.opcode.value, ins.next_pc - ins.addr) for ins in self.pending))
+        else:
+            self.output.write("".join(f"{ins.addr:08x} {ins.opcode.name}\n" for ins in self.pending))
+        self.pending.clear()
+
+
+def iss(args):
+    cpu = Cpu(args.memory)
+    with open(args.image, "rb") as image:
+        cpu.load_image(image.read(), args.base)
+    cpu.regs[PC] = args.base if args.entry is None else args.entry
+    cpu.regs[SP] = args.memory if args.stack is None else args.stack
+
+    writer = None
+    if args.trace is not None:
+        binary = args.trace_format == "binary"
+        output = open(args.trace, "wb" if binary else "w")
+        writer = TraceWriter(output, args.trace_format)
+
+    trace = writer
+    issue = None
+    if args.dual_issue is not None:
+        issue = IssueStats(args.dual_issue)
+        def trace_issue(ins):
+            issue.add(ins.addr, ins.next_pc - ins.addr)
+            if writer is not None:
+                writer(ins)
+        trace = trace_issue
+
+    opcode_arrays() # keep building the tables out of the measurement
+    start = time.perf_counter()
+    try:
+        cpu.run(args.max_instructions, trace)
+        status = "halted" if cpu.halted else "stopped"
+    except SimulationError as error:
+        status = f"stopped: {error}"
+    finally:
+        elapsed = time.perf_counter() - start
+        if writer is not None:
+            writer.flush()
+            writer.output.close()
+
+    print(f"{status} at PC 0x{cpu.regs[PC]:08x}", file=sys.stderr)
+    print(
+        f"{cpu.retired} instructions in {elapsed:.3f}s ({cpu.retired / max(elapsed, 1e-9):,.0f} instructions/s), "
+        f"{cpu.translated} blocks translated, {cpu.block_hits} block cache hits",
+        file=sys.stderr
+    )
+    print(" ".join(f"R{reg}={value:08x}" for reg, value in enumerate(cpu.regs)), file=sys.stderr)
+    if issue is not None:
+        print(
+            f"dual issue ({issue.width} byte window): second slot filled in {issue.paired} of "
+            f"{issue.cycles} decode cycles ({issue.rate:.1%})",
+            file=sys.stderr
+        )
+
+    return 0
@@ -0,0 +1,232 @@
+import shutil
+import subprocess
+import tempfile
+import time
+from itertools import combinations
+from pathlib import Path
+
+from amaranth.back import rtlil, verilog
+from amaranth.hdl.ir import Fragment
+from amaranth._toolchain.yosys import find_yosys
+
+from .decode_operand import STAGES, SharedOperandDecoder
+from .synth import _OUTPUTS, _Netlist, io_ports
+
+# Netlists with shared module definitions.
+#
+# Amaranth emits a separate module for every submodule, so VaxDecoderTest carries 31 copies of the
+# OperandDecoder logic (and the prefix boundary another 30 for its probes). Built with shared=True
+# the decoders are SharedOperandDecoders, which are instances of one module; convert() emits its
+# definition once, after the design, and the rest of the flow sees an ordinary hierarchy.
+#
+# check_equivalence() proves a shared netlist equivalent to the one with a copy per decoder. The
+# Yosys that ships with Amaranth has neither `equiv_*` nor `sat`, so both are flattened and every
+# output is traced back through the cells driving it, numbering each distinct structure once
+# (hash consing): an output of the two netlists gets the same number exactly when it is computed
+# by identical logic from the same inputs. That proves netlists which are the same up to names,
+# which is what sharing a definition should give, and only combinational ones. When a Yosys is on
+# the PATH, its equivalence checker is run on the two as well, which also handles registers and
+# logic that differs in structure.
+
+_DEFINITIONS = (SharedOperandDecoder,)
+
+
+def _definitions(rtlil_text):
+    # RTLIL of the shared modules `rtlil_text` instantiates, without their top attribute
+    text = ""
+    for shared in _DEFINITIONS:
+        for count in range(len(STAGES) + 1):
+            for stages in combinations(STAGES, count):
+                if f"cell \\{shared.module(stages)} " in rtlil_text:
+                    text += shared.definition(stages).replace("attribute \\top 1\n", "", 1)
+    return text
+
+
+def convert_fragment(fragment, name="top", fmt="rtlil", **kwargs):
+    # Like the Amaranth backends, with the shared modules the fragment uses added to the netlist
+    rtlil_text, name_map = rtlil.convert_fragment(fragment, name, **kwargs)
+    rtlil_text += _definitions(rtlil_text)
+    if fmt == "rtlil":
+        return rtlil_text, name_map
+    if fmt == "verilog":
+        return verilog._convert_rtlil_text(rtlil_text), name_map
+    raise ValueError(f"Unknown netlist format '{fmt}', expected 'rtlil' or 'verilog'")
+
+
+def convert(design, name="top", ports=None, fmt="rtlil", **kwargs):
+    fragment = Fragment.get(design, platform=None).prepare(ports=io_ports(design) if ports is None else ports)
+    text, _ = convert_fragment(fragment, name, fmt, **kwargs)
+    return text
+
+
+# Flattened before proc, so that constants driving the inputs of a submodule are seen the same
+# way whether it was a module of its own or an instance of a shared one
+_FLATTEN_SCRIPT = """
+read_rtlil <<rtlil
+{rtlil}
+rtlil
+hierarchy -top {top}
+flatten
+proc
+memory_collect
+opt_clean -purge
+write_rtlil
+"""
+
+_EQUIV_SCRIPT = """
+read_rtlil {gold}
+read_rtlil {gate}
+proc
+flatten
+equiv_make gold gate equiv
+hierarchy -top equiv
+equiv_simple -seq 4
+equiv_induct
+equiv_status -assert
+"""
+
+
+def _structure(text, inputs, nodes):
+    # Numbers the bits of the flattened netlist `text` by the logic driving them. `nodes` maps
+    # structures to numbers and is shared between netlists, so two bits get the same number
+    # exactly when they are driven by the same cells, with the same parameters, connected the
+    # same way to the same input ports and constants. Returns a function from a wire name to the
+    # numbers of its bits.
+    netlist = _Netlist(text, constants=True)
+    find    = netlist._find
+
+    constants = {find(bit): bit for bit in list(netlist.aliases) if bit[0] == "'"}
+    drivers   = {}
+    for index, (_, _, connections) in enumerate(netlist.cells):
+        for port, bits in connections.items():
+            if port in _OUTPUTS:
+                for offset, bit in enumerate(bits):
+                    drivers[find(bit)] = (index, port, offset)
+
+    def node(key):
+        return nodes.setdefault(key, len(nodes))
+
+    cells    = {}
+    numbered = {}
+    def number(root):
+        # Iterative, as the chains are long. Registers and loops can't be numbered by structure
+        # alone, so they end the proof.
+        stack  = [(root, False)]
+        active = set()
+        while stack:
+            bit, expanded = stack.pop()
+            if bit in numbered:
+                continue
+            if bit[0] == "'" or bit in constants:
+                numbered[bit] = node(constants.get(bit, bit))
+                continue
+            if bit not in drivers:
+                if bit[0].lstrip("\\") not in inputs:
+                    raise AssertionError(f"{bit[0]} [{bit[1]}] is driven by neither a cell nor an input port")
+                numbered[bit] = node(("input", bit[0], bit[1]))
+                continue
+
+            index, port, offset = drivers[bit]
+            if index not in cells:
+                kind, params, connections = netlist.cells[index]
+                if "CLK" in connections or kind in ("$dlatch", "$adlatch", "$sr"):
+                    raise AssertionError(f"{kind} cells can't be compared by structure")
+                operands = [(name, [find(bit) for bit in bits])
+                            for name, bits in sorted(connections.items()) if name not in _OUTPUTS]
+                pending  = [bit for _, bits in operands for bit in bits if bit not in numbered]
+                if pending:
+                    if expanded or active.intersection(pending):
+                        raise AssertionError(f"Combinational loop through a {kind} cell")
+                    active.add(bit)
+                    stack.append((bit, True))
+                    stack.extend((bit, False) for bit in pending)
+                    continue
+                cells[index] = node((
+                    kind, tuple(sorted(params.items())),
+                    tuple((name, tuple(numbered[bit] for bit in bits)) for name, bits in operands),
+                ))
+            active.discard(bit)
+            numbered[bit] = node((cells[index], port, offset))
+        return numbered[root]
+
+    return lambda name: [number(find(bit)) for bit in netlist._bits(f"\\{name}")]
+
+
+def check_equivalence(factory, ports=None):
+    # Proves factory(shared=False) and factory(shared=True) equivalent, see above. Returns a
+    # string describing the proofs, or raises AssertionError if one of them fails.
+    gold = factory(shared=False)
+    gate = factory(shared=True)
+    if ports is None:
+        ports = io_ports(gold)
+    netlists = {
+        "gold": convert(gold, "gold", ports, emit_src=False),
+        "gate": convert(gate, "gate", _like(gate, ports), emit_src=False),
+    }
+
+    yosys   = find_yosys(lambda version: version >= (0, 10))
+    inputs  = {port.name for port in ports if port.name.startswith("i_")}
+    nodes   = {}
+    numbers = {
+        module: _structure(yosys.run(["-q", "-"], _FLATTEN_SCRIPT.format(rtlil=netlist, top=module),
+                                     ignore_warnings=True), inputs, nodes)
+        for module, netlist in netlists.items()
+    }
+    for port in ports:
+        if port.name.startswith("o_") and numbers["gold"](port.name) != numbers["gate"](port.name):
+            raise AssertionError(f"{port.name} of the shared netlist is not driven by the same logic")
+    proofs = ["structurally identical"]
+
+    system_yosys = shutil.which("yosys")
+    if system_yosys is not None:
+        with tempfile.TemporaryDirectory(prefix="vixen_equiv_") as build:
+            build = Path(build)
+            for module, netlist in netlists.items():
+                (build / f"{module}.il").write_text(netlist)
+            script = _EQUIV_SCRIPT.format(gold=build / "gold.il", gate=build / "gate.il")
+            result = subprocess.run([system_yosys, "-q", "-p", script.replace("\n", "; ")], capture_output=True, text=True)
+            if result.returncode != 0:
+                raise AssertionError(f"Yosys could not prove the netlists equivalent:\n{result.stdout}{result.stderr}")
+        proofs.append("equivalent under equiv_induct")
+
+    return ", ".join(proofs)
+
+
+def _like(gate, ports):
+    # The ports of `gate` with the names of `ports`, which belong to the gold design
+    by_name = {port.name: port for port in io_ports(gate)}
+    return [by_name[port.name] for port in ports]
+
+
+if __name__ == "__main__":
+    from argparse import ArgumentParser
+
+    from .decode import VaxDecoderTest
+
+    parser = ArgumentParser(description="Compare VaxDecoderTest netlists with and without a shared OperandDecoder")
+    parser.add_argument("--boundary", choices=("ripple", "prefix"), default="ripple")
+    parser.add_argument("--width", type=int, default=1 + 6*6, help="window width in bytes")
+    parser.add_argument("--no-check", action="store_true", help="skip the equivalence check")
+    args = parser.parse_args()
+
+    def factory(shared):
+        return VaxDecoderTest(boundary=args.boundary, width=args.width, shared=shared)
+
+    for shared in (False, True):
+        start = time.perf_counter()
+        text  = convert(factory(shared))
+        rtlil_s = time.perf_counter() - start
+
+        start = time.perf_counter()
+        verilog_text = convert(factory(shared), fmt="verilog")
+        verilog_s = time.perf_counter() - start
+
+        print(
+            f"{'shared' if shared else 'copies':<7} rtlil {len(text) / 1e6:>7.2f} MB in {rtlil_s:>6.1f}s  "
+            f"verilog {len(verilog_text) / 1e6:>7.2f} MB in {verilog_s:>6.1f}s  "
+            f"modules {text.count(chr(10) + 'module ')}"
+        )
+
+    if not args.no_check:
+        start = time.perf_counter()
+        print(f"{check_equivalence(factory)} in {time.perf_counter() - start:.1f}s")
@@ -0,0 +1,166 @@
+from typing import NamedTuple
+
+import numpy as np
+
+from .util import Length
+
+# Software model of OperandDecoder, vectorized over NumPy arrays.
+#
+# Every function here mirrors the RTL in decode_operand.py bit for bit, including its corner
+# cases (for example quadword and octaword immediates, which don't fit in the 6-bit one-hot
+# o_length and are reported as six bytes), so it can be used as the golden reference for the
+# decoders without having to run the simulator.
+#
+# Specifier windows are 48-bit little-endian values held in uint64 arrays, byte 0 being the
+# operand specifier byte, exactly like OperandDecoder.i_data.
+
+WINDOW_BYTES = 6
+
+_MASK32 = np.uint64(0xffffffff)
+
+# Autoincrement/autodecrement step per Length, Length values past OCTA behave like OCTA in the RTL
+_AUTOINC_STEP = np.array([1, 2, 4, 8, 16, 16, 16, 16], dtype=np.uint64)
+
+
+def _sign_extend(values, bits):
+    # Low `bits` of `values` sign extended to 32 bits
+    sign = np.uint64(1 << (bits - 1))
+    low  = values & np.uint64((1 << bits) - 1)
+    return ((low ^ sign) - sign) & _MASK32
+
+
+class DecodedOperands(NamedTuple):
+    length:   np.ndarray # uint8, one-hot byte count like o_length (0 when not valid)
+    immed:    np.ndarray # uint32
+    deferred: np.ndarray # bool
+    legalop:  np.ndarray # bool
+    immvalid: np.ndarray # bool
+
+
+def windows(data, offsets=None):
+    # Builds the 48-bit specifier windows starting at each of `offsets` (default: every byte) of `data`.
+    # Bytes past the end of `data` read as zero, like bit_select past the end of VaxDecoderTest.i_data.
+    buf = np.frombuffer(data, dtype=np.uint8) if not isinstance(data, np.ndarray) else data.astype(np.uint8, copy=False)
+    buf = np.concatenate((buf, np.zeros(WINDOW_BYTES, dtype=np.uint8)))
+
+    if offsets is None:
+        offsets = np.arange(len(buf) - WINDOW_BYTES, dtype=np.int64)
+    else:
+        offsets = np.asarray(offsets, dtype=np.int64)
+
+    result = np.zeros(offsets.shape, dtype=np.uint64)
+    for byte in range(WINDOW_BYTES):
+        result |= buf[offsets + byte].astype(np.uint64) << np.uint64(8 * byte)
+    return result
+
+
+def decode_operands(data, oplength, valid=True, fixed=False):
+    # Decodes `data` (48-bit windows) as operand specifiers of the given `oplength` (Length values),
+    # or as fixed size branch displacements / inline data where `fixed` is set (i_fixed in the RTL).
+    # `oplength`, `valid` and `fixed` broadcast against `data`.
+    data     = np.asarray(data, dtype=np.uint64)
+    oplength = np.broadcast_to(np.asarray(oplength, dtype=np.uint8), data.shape)
+    valid    = np.broadcast_to(np.asarray(valid, dtype=bool), data.shape)
+    fixed    = np.broadcast_to(np.asarray(fixed, dtype=bool), data.shape)
+
+    byte0 = data & np.uint64(0xff)
+    byte1 = (data >> np.uint64(8)) & np.uint64(0xff)
+
+    is_indexed  = (byte0 >> np.uint64(4)) == 0x4
+
+    imm_offset  = np.where(is_indexed, np.uint64(16), np.uint64(8))
+
+    opcode_byte   = np.where(is_indexed, byte1, byte0)
+    opcode_nibble = opcode_byte >> np.uint64(4)
+
+    is_literal           = (byte0 >> np.uint64(6)) == 0b00
+    is_literal_indexed   = (byte1 >> np.uint64(6)) == 0b00
+    is_index_indexed     = (byte1 >> np.uint64(4)) == 0x4
+    is_register          = (byte0 >> np.uint64(4)) == 0x5
+    is_register_indexed  = (byte1 >> np.uint64(4)) == 0x5
+    is_register_deferred = opcode_nibble == 0x6
+    is_autodec           = opcode_nibble == 0x7
+    is_autoinc           = opcode_nibble == 0x8
+    is_immediate         = byte0         == 0x8F
+    is_immediate_indexed = byte1         == 0x8F
+    is_autoinc_deferred  = opcode_nibble == 0x9
+    is_absolute          = opcode_byte   == 0x9F
+    is_bytedisp          = opcode_nibble == 0xA
+    is_worddisp          = opcode_nibble == 0xC
+    is_longdisp          = opcode_nibble == 0xE
+    is_bytedisp_deferred = opcode_nibble == 0xB
+    is_worddisp_deferred = opcode_nibble == 0xD
+    is_longdisp_deferred = opcode_nibble == 0xF
+
+    is_byte = oplength == Length.BYTE.value
+    is_word = oplength == Length.WORD.value
+    is_long = oplength == Length.LONG.value
+
+    displacement  = data >> imm_offset
+    literal_imm   = byte0 & np.uint64(0x3f)
+    autoinc_imm   = _AUTOINC_STEP[oplength & 0x7]
+    autodec_imm   = (np.uint64(1 << 32) - autoinc_imm) & _MASK32
+    immediate_imm = np.where(is_byte, (data >> np.uint64(8)) & np.uint64(0xff),
+                    np.where(is_word, (data >> np.uint64(8)) & np.uint64(0xffff),
+                                      (data >> np.uint64(8)) & _MASK32))
+    absolute_imm  = displacement & _MASK32
+    bytedisp_imm  = _sign_extend(displacement, 8)
+    worddisp_imm  = _sign_extend(displacement, 16)
+    longdisp_imm  = absolute_imm
+    fixed_imm     = np.where(is_byte, _sign_extend(data, 8), np.where(is_word, _sign_extend(data, 16), data & _MASK32))
+
+    is_short_autoinc      = is_autoinc & ~is_immediate
+    is_short_autoinc_def  = is_autoinc_deferred & ~is_absolute
+    is_short_mode         = is_literal | is_register | is_register_deferred | is_autodec | is_short_autoinc | is_short_autoinc_def
+    is_one_byte           = ~is_indexed & is_short_mode
+    is_one_byte_indexed   = is_indexed & is_short_mode
+    is_two_byte           = is_one_byte_indexed | (is_byte & is_immediate) | (~is_indexed & (is_bytedisp | is_bytedisp_deferred))
+    is_two_byte_indexed   = is_indexed & (is_bytedisp | is_bytedisp_deferred)
+    is_three_byte         = is_two_byte_indexed | (is_word & is_immediate) | (~is_indexed & (is_worddisp | is_worddisp_deferred))
+    is_three_byte_indexed = is_indexed & (is_worddisp | is_worddisp_deferred)
+    is_four_byte          = is_three_byte_indexed
+    is_five_byte          = ~is_indexed & ((is_long & is_immediate) | is_absolute | is_longdisp | is_longdisp_deferred)
+
+    # Immediate routing, first match wins
+    immed = np.select(
+        [
+            fixed,
+            is_literal,
+            is_autodec,
+            is_immediate,
+            is_absolute,
+            is_autoinc | is_autoinc_deferred,
+            is_bytedisp | is_bytedisp_deferred,
+            is_worddisp | is_worddisp_deferred,
+            is_longdisp | is_longdisp_deferred,
+        ],
+        [fixed_imm, literal_imm, autodec_imm, immediate_imm, absolute_imm, autoinc_imm, bytedisp_imm, worddisp_imm, longdisp_imm],
+        default=np.uint64(0),
+    )
+
+    # Size routing, first match wins, six bytes otherwise
+    length = np.select(
+        [fixed & is_byte, fixed & is_word, fixed, is_one_byte, is_two_byte, is_three_byte, is_four_byte, is_five_byte],
+        [1 << 0, 1 << 1, 1 << 3, 1 << 0, 1 << 1, 1 << 2, 1 << 3, 1 << 4],
+        default=1 << 5,
+    ).astype(np.uint8)
+    length[~valid] = 0
+
+    return DecodedOperands(
+        length   = length,
+        immed    = immed.astype(np.uint32),
+        deferred = ~fixed & (is_register_deferred | is_autoinc_deferred | is_bytedisp_deferred | is_worddisp_deferred | is_longdisp_deferred),
+        legalop  = fixed | ~is_indexed | ~(is_literal_indexed | is_index_indexed | is_register_indexed | is_immediate_indexed),
+        immvalid = fixed | ~(is_register | is_register_deferred),
+    )
+
+
+# Byte count for each one-hot o_length value
+_ONEHOT_BYTES = np.zeros(1 << WINDOW_BYTES, dtype=np.uint8)
+for _bytes in range(1, WINDOW_BYTES + 1):
+    _ONEHOT_BYTES[1 << (_bytes - 1)] = _bytes
+
+
+def specifier_bytes(data, oplength):
+    # Byte count of each specifier as OperandDecoder computes it, rather than one-hot.
+    return _ONEHOT_BYTES[decode_operands(data, oplength).length]
@@ -0,0 +1,250 @@
+from amaranth import *
+
+from .decode import VaxDecoder
+
+# Instruction prefetch for VaxDecoder.
+#
+# PrefetchQueue fetches aligned words ahead of the decoder and keeps the bytes in a queue whose
+# head is always the current decode address, so the decoder sees its window without any further
+# alignment. The fetch side is a request stream (o_fetch_valid/i_fetch_ready with the aligned
+# o_fetch_addr) and an in order response stream (i_fetch_valid with i_fetch_data); that maps onto
+# pipelined Wishbone as STB/~STALL and ACK. Several requests can be outstanding, bounded by the
+# free space left in the queue.
+#
+# FrontEnd puts the two together. The decoder is only handed a window once every byte it decodes
+# from it has arrived, so it never needs a full queue to make progress.
+# Branches the decoder predicts taken redirect the queue straight away, and so does an
+# instruction the decoder takes from its decoded-instruction cache before its bytes are in.
+
+
+def _clog2(value):
+    return (value - 1).bit_length()
+
+
+class PrefetchQueue(Elaboratable):
+    def __init__(self, fetch_width=64, depth=64, window=1 + 6*6):
+        if fetch_width not in (16, 32, 64, 128):
+            raise ValueError(f"Fetch width must be 16, 32, 64 or 128 bits, not {fetch_width}")
+        if depth < window + fetch_width // 8:
+            raise ValueError(f"Queue depth must be at least {window + fetch_width // 8} bytes, not {depth}")
+
+        self.fetch_width = fetch_width
+        self.depth       = depth
+        self.window      = window
+
+        # Fetch requests and responses
+        self.o_fetch_valid = Signal()
+        self.i_fetch_ready = Signal()
+        self.o_fetch_addr  = Signal(32)
+        self.i_fetch_valid = Signal()
+        self.i_fetch_data  = Signal(fetch_width)
+
+        # Queued bytes from the decode address on, and how many of them are valid
+        self.o_data  = Signal(window*8)
+        self.o_level = Signal(range(depth + 1))
+
+        # Drops the first i_consume bytes from the queue
+        self.i_consume = Signal(range(depth + 1))
+
+        # Empties the queue and restarts fetching at i_target
+        self.i_redirect = Signal()
+        self.i_target   = Signal(32)
+
+    def elaborate(self, platform):
+        m = Module()
+
+        word_bytes = self.fetch_width // 8
+        word_shift = _clog2(word_bytes)
+
+        queue = Signal(self.depth*8)
+        level = Signal(range(self.depth + 1))
+
+        # Requests issued but not yet answered, and how many of those answers belong to the
+        # stream from before a redirect
+        pending = Signal(range(self.depth // word_bytes + 2))
+        discard = Signal.like(pending)
+
+        # Bytes to skip in the next word when the decode address isn't aligned
+        skip = Signal(word_shift)
+
+        issue  = self.o_fetch_valid & self.i_fetch_ready
+        arrive = self.i_fetch_valid
+        accept = arrive & (discard == 0)
+
+        m.d.comb += [
+            self.o_data.eq(queue),
+            self.o_level.eq(level),
+            # Bytes already queued and still on their way must all fit
+            self.o_fetch_valid.eq(~self.i_redirect & (level + (pending << word_shift) + word_bytes <= self.depth)),
+        ]
+
+        with m.If(issue):
+            m.d.sync += self.o_fetch_addr.eq(self.o_fetch_addr + word_bytes)
+        m.d.sync += pending.eq(pending + issue - arrive)
+
+        with m.If(self.i_redirect):
+            m.d.sync += [
+                queue.eq(0),
+                level.eq(0),
+                discard.eq(pending - arrive),
+                skip.eq(self.i_target[:word_shift]),
+                self.o_fetch_addr.eq(Cat(C(0, word_shift), self.i_target[word_shift:])),
+            ]
+        with m.Else():
+            # The queue above `level` is kept zero, so the incoming bytes can simply be ORed in
+            # after the bytes left over from this cycle's consumption
+            remaining = level - self.i_consume
+            incoming  = Signal(self.fetch_width)
+            arriving  = Signal(range(word_bytes + 1))
+            m.d.comb += [
+                incoming.eq(Mux(accept, self.i_fetch_data >> Cat(C(0, 3), skip), 0)),
+                arriving.eq(Mux(accept, word_bytes - skip, 0)),
+            ]
+            m.d.sync += [
+                queue.eq((queue >> Cat(C(0, 3), self.i_consume)) | (incoming << Cat(C(0, 3), remaining))),
+                level.eq(remaining + arriving),
+            ]
+            with m.If(accept):
+                m.d.sync += skip.eq(0)
+            with m.If(arrive & (discard != 0)):
+                m.d.sync += discard.eq(discard - 1)
+
+        return m
+
+
+class FrontEnd(Elaboratable):
+    # A PrefetchQueue feeding a VaxDecoder. The fetch signals are those of `prefetch`, the decoded
+    # instructions those of `decoder`.
+    def __init__(self, fetch_width=64, depth=64, width=1 + 6*6, boundary="ripple", issue=1, predict=True,
+                 cache_sets=0, cache_ways=1):
+        self.prefetch = PrefetchQueue(fetch_width=fetch_width, depth=depth, window=width)
+        self.decoder  = VaxDecoder(width=width, boundary=boundary, issue=issue, predict=predict,
+                                   cache_sets=cache_sets, cache_ways=cache_ways)
+
+        self.i_redirect = Signal()
+        self.i_target   = Signal(32)
+
+        # The decoder could take a window but the bytes for it haven't arrived yet
+        self.o_starved = Signal()
+
+    def elaborate(self, platform):
+        m = Module()
+
+        m.submodules.prefetch = prefetch = self.prefetch
+        m.submodules.decoder  = decoder  = self.decoder
+
+        # Bytes past o_level are zero rather than the real instruction stream, and decode as
+        # literal operands. An instruction that ends in the window covers o_advance bytes, so any it
+        # read from past o_level moved o_advance past it too. When it goes on in the next window
+        # (o_more), the last operand taken ends on the byte at o_advance, which the next window
+        # resumes from, so that byte has to be there as well.
+        available = (prefetch.o_level != 0) & Mux(decoder.o_more,
+                                                  decoder.o_advance < prefetch.o_level,
+                                                  decoder.o_advance <= prefetch.o_level)
+
+        # A cache hit doesn't wait for its bytes; when they aren't all there yet, fetching restarts
+        # after the instruction instead
+        bypass = ~self.i_redirect & decoder.o_hit & decoder.o_ready & ~available
+
+        m.d.comb += [
+            prefetch.i_redirect.eq(self.i_redirect | decoder.o_redirect | bypass),
+            prefetch.i_target.eq(Mux(self.i_redirect, self.i_target,
+                                     Mux(decoder.o_redirect, decoder.o_redirect_target, decoder.o_addr + decoder.o_advance))),
+            decoder.i_redirect.eq(self.i_redirect),
+            decoder.i_target.eq(self.i_target),
+
+            decoder.i_data.eq(prefetch.o_data),
+            decoder.i_valid.eq(available),
+            prefetch.i_consume.eq(Mux(available & decoder.o_ready, decoder.o_advance, 0)),
+
+            self.o_starved.eq(~self.i_redirect & decoder.o_ready & ~decoder.o_hit & ~available),
+        ]
+
+        return m
+
+
+def measure(image, base=0, instructions=500, fetch_width=64, depth=64, latency=1, width=1 + 6*6, issue=1, predict=True,
+            cache_sets=0, cache_ways=1):
+    # Simulates a FrontEnd decoding `image` from `base`, following the branches it predicts taken,
+    # with a memory answering every fetch after `latency` cycles and a consumer that is always
+    # ready. Returns the cycle count, instructions decoded, the cycles the decoder was starved and
+    # the instructions that came from the decoded-instruction cache.
+    from amaranth.sim import Settle, Simulator
+
+    front = FrontEnd(fetch_width=fetch_width, depth=depth, width=width, issue=issue, predict=predict,
+                     cache_sets=cache_sets, cache_ways=cache_ways)
+    prefetch, decoder = front.prefetch, front.decoder
+    word_bytes = fetch_width // 8
+    padded = bytes(image) + bytes(depth + word_bytes)
+
+    result = {"cycles": 0, "instructions": 0, "starved": 0, "hits": 0}
+
+    def process():
+        yield front.i_redirect.eq(1)
+        yield front.i_target.eq(base)
+        yield
+        yield front.i_redirect.eq(0)
+        yield prefetch.i_fetch_ready.eq(1)
+        yield decoder.i_ready.eq(1)
+
+        in_flight = []
+        cycle     = 0
+        while result["instructions"] < instructions:
+            ready = [request for request in in_flight if request[0] <= cycle]
+            if ready:
+                in_flight.remove(ready[0])
+                offset = ready[0][1] - base
+                yield prefetch.i_fetch_valid.eq(1)
+                yield prefetch.i_fetch_data.eq(int.from_bytes(padded[offset:offset + word_bytes], "little") if offset >= 0 else 0)
+            else:
+                yield prefetch.i_fetch_valid.eq(0)
+            yield Settle()
+
+            if (yield prefetch.o_fetch_valid):
+                in_flight.append((cycle + latency, (yield prefetch.o_fetch_addr)))
+                if (yield prefetch.o_fetch_addr) - base >= len(image):
+                    break
+            result["starved"]      += (yield front.o_starved)
+            result["hits"]         += (yield decoder.o_hit) & (yield decoder.o_ready)
+            result["instructions"] += (yield decoder.o_valid) + (yield decoder.o_valid2)
+
+            yield
+            cycle += 1
+        result["cycles"] = cycle
+
+    sim = Simulator(front)
+    sim.add_clock(1e-6)
+    sim.add_sync_process(process)
+    sim.run()
+    return result
+
+
+if __name__ == "__main__":
+    from argparse import ArgumentParser
+
+    parser = ArgumentParser(description="Measure decoder starvation behind the prefetch queue")
+    parser.add_argument("image", help="raw VAX code")
+    parser.add_argument("--base", type=lambda value: int(value, 0), default=0, help="load address of the image")
+    parser.add_argument("--instructions", "-n", type=int, default=500, help="instructions to decode per run")
+    parser.add_argument("--fetch-widths", type=int, nargs="+", default=[32, 64], help="fetch widths in bits")
+    parser.add_argument("--depth", type=int, default=64, help="queue depth in bytes")
+    parser.add_argument("--latency", type=int, default=1, help="fetch latency in cycles")
+    parser.add_argument("--issue", type=int, choices=(1, 2), default=1, help="decoder issue width")
+    parser.add_argument("--no-predict", action="store_true", help="decode straight through, ignoring branches")
+    parser.add_argument("--cache-sets", type=int, default=0, help="decoded-instruction cache sets, 0 for none")
+    parser.add_argument("--cache-ways", type=int, default=1, help="decoded-instruction cache associativity")
+    args = parser.parse_args()
+
+    with open(args.image, "rb") as image:
+        data = image.read()
+
+    print(f"{'fetch':>6} {'cycles':>8} {'insns':>7} {'IPC':>6} {'starved':>8} {'hits':>6}")
+    for fetch_width in args.fetch_widths:
+        stats = measure(data, args.base, args.instructions, fetch_width, args.depth, args.latency, issue=args.issue,
+                        predict=not args.no_predict, cache_sets=args.cache_sets, cache_ways=args.cache_ways)
+        print(
+            f"{fetch_width:>6} {stats['cycles']:>8} {stats['instructions']:>7} "
+            f"{stats['instructions'] / max(stats['cycles'], 1):>6.2f} {stats['starved'] / max(stats['cycles'], 1):>8.1%} "
+            f"{stats['hits'] / max(stats['instructions'], 1):>6.1%}",
+            flush=True
+        )
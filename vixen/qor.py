@@ -0,0 +1,153 @@
+import json
+import multiprocessing
+import shutil
+import sys
+from pathlib import Path
+
+from .decode import OpcodeOperandCount, VaxDecoder, VaxDecoderTest
+from .decode_operand import OperandDecoder
+from .prefetch import PrefetchQueue
+from .synth import gate_stats, io_ports, lut_stats
+from .uop import Cracker
+
+# Synthesis QoR regression checks.
+#
+# Runs every module in MODULES through one of two flows and compares the numbers with those
+# stored in qor_baseline.json:
+#
+#   lut4   `synth -lut 4` with the Yosys on the PATH: cells, LUTs and LUT levels (lut_stats)
+#   gates  the builtin Yosys and the gate model of synth.py: gate equivalents, gate levels and
+#          memory bits (gate_stats)
+#
+# The default is gates, the flow the committed baseline has numbers for; "auto" picks lut4 when
+# there is a Yosys on the PATH. The baseline keeps the numbers of each flow apart, and a module
+# fails when one of its numbers grows past the baseline by more than the tolerance for it, a
+# fraction of the baseline value, or when the baseline has no numbers for it under the flow that
+# ran. New pipeline stages go into MODULES, along with `--update` to give them a baseline.
+
+MODULES = {
+    "OperandDecoder":     OperandDecoder,
+    "OpcodeOperandCount": OpcodeOperandCount,
+    "VaxDecoderTest":     VaxDecoderTest,
+    "VaxDecoder":         VaxDecoder,
+    "PrefetchQueue":      PrefetchQueue,
+    "Cracker":            Cracker,
+}
+
+# Allowed growth by metric; logic depth has to stay where it is
+TOLERANCES = {
+    "cells":       0.02,
+    "luts":        0.02,
+    "gates":       0.02,
+    "memory_bits": 0.0,
+    "depth":       0.0,
+}
+
+BASELINE = Path(__file__).with_name("qor_baseline.json")
+
+
+def _flow(flow):
+    if flow == "auto":
+        return "lut4" if shutil.which("yosys") else "gates"
+    return flow
+
+
+def measure(name, flow="gates"):
+    # The QoR numbers of MODULES[name] under `flow`
+    flow   = _flow(flow)
+    design = MODULES[name]()
+    ports  = io_ports(design)
+    if flow == "lut4":
+        stats = lut_stats(design, ports, lut_size=4)
+        if stats is None:
+            raise RuntimeError("The lut4 flow needs a Yosys on the PATH")
+        return {"cells": stats.cells, "luts": stats.luts, "depth": stats.depth}
+    stats = gate_stats(design, ports)
+    return {"gates": stats.gates, "depth": stats.depth, "memory_bits": stats.memory_bits}
+
+
+def _measure(job):
+    return job[0], measure(*job)
+
+
+def run(names=tuple(MODULES), flow="gates", jobs=1):
+    # {"flow": flow, "modules": {name: numbers}} for the modules in `names`
+    flow = _flow(flow)
+    with multiprocessing.get_context("spawn").Pool(jobs) as pool:
+        results = dict(pool.imap(_measure, [(name, flow) for name in names]))
+    return {"flow": flow, "modules": {name: results[name] for name in names}}
+
+
+def check(report, baseline, tolerances=TOLERANCES):
+    # (module, metric, baseline, current) for every number that grew past its tolerance, and the
+    # modules the baseline has nothing for under this flow
+    reference   = baseline.get(report["flow"], {})
+    regressions = []
+    missing     = []
+    for name, numbers in report["modules"].items():
+        if name not in reference:
+            missing.append(name)
+            continue
+        for metric, value in numbers.items():
+            before = reference[name].get(metric)
+            if before is not None and value > before * (1 + tolerances.get(metric, 0.0)):
+                regressions.append((name, metric, before, value))
+    return regressions, missing
+
+
+def load_baseline(path=BASELINE):
+    path = Path(path)
+    return json.loads(path.read_text()) if path.exists() else {}
+
+
+def update_baseline(report, path=BASELINE):
+    # Stores the numbers of `report` as the baseline of its flow, keeping the other modules
+    baseline = load_baseline(path)
+    baseline.setdefault(report["flow"], {}).update(report["modules"])
+    Path(path).write_text(json.dumps(baseline, indent=2, sort_keys=True) + "\n")
+
+
+if __name__ == "__main__":
+    from argparse import ArgumentParser, ArgumentTypeError
+
+    def tolerance(text):
+        metric, _, value = text.partition("=")
+        try:
+            if metric in TOLERANCES:
+                return metric, float(value)
+        except ValueError:
+            pass
+        raise ArgumentTypeError(f"expected METRIC=FRACTION with METRIC one of {', '.join(TOLERANCES)}")
+
+    parser = ArgumentParser(description="Check synthesis QoR of the decoder modules against a baseline")
+    parser.add_argument("--modules", nargs="+", choices=tuple(MODULES), default=list(MODULES))
+    parser.add_argument("--flow", choices=("auto", "lut4", "gates"), default="gates",
+                        help="synthesis flow (default: gates, which the committed baseline covers)")
+    parser.add_argument("--baseline", default=BASELINE, help="baseline JSON to compare against")
+    parser.add_argument("--tolerance", metavar="METRIC=FRACTION", type=tolerance, action="append", default=[],
+                        help="allowed growth of a metric, e.g. luts=0.05")
+    parser.add_argument("--update", action="store_true", help="store the results as the new baseline")
+    parser.add_argument("--output", "-o", default=None, help="also write the JSON report here")
+    parser.add_argument("--jobs", "-j", type=int, default=1, help="modules to synthesize at once")
+    args = parser.parse_args()
+
+    report = run(args.modules, args.flow, args.jobs)
+    if args.output is not None:
+        Path(args.output).write_text(json.dumps(report, indent=2) + "\n")
+
+    metrics = sorted({metric for numbers in report["modules"].values() for metric in numbers})
+    print(f"{'module':<20} " + " ".join(f"{metric:>12}" for metric in metrics) + f"   ({report['flow']})")
+    for name, numbers in report["modules"].items():
+        print(f"{name:<20} " + " ".join(f"{numbers.get(metric, ''):>12}" for metric in metrics))
+
+    if args.update:
+        update_baseline(report, args.baseline)
+        sys.exit(0)
+
+    regressions, missing = check(report, load_baseline(args.baseline), {**TOLERANCES, **dict(args.tolerance)})
+    for name in missing:
+        print(f"missing: no {report['flow']} baseline for {name}, run with --update to add one", file=sys.stderr)
+    for name, metric, before, value in regressions:
+        growth = f" ({value / before - 1:+.1%})" if before else ""
+        print(f"regression: {name} {metric} {before} -> {value}{growth}", file=sys.stderr)
+    sys.exit(1 if regressions or missing else 0)
@@ -0,0 +1,536 @@
+import hashlib
+import os
+import shutil
+import subprocess
+import sys
+import time
+from pathlib import Path
+from typing import NamedTuple
+
+import numpy as np
+
+from amaranth import *
+from amaranth._toolchain.yosys import YosysError
+from amaranth.hdl.ir import Fragment
+
+from .synth import io_ports
+
+# Batched simulation of the decoders.
+#
+# A Simulation runs a design one input vector per cycle over whole arrays of vectors. Vectors are
+# NumPy structured arrays with a field per port, every port held as little-endian 32-bit words
+# (a scalar uint32 field up to 32 bits, an array of them above), so a batch goes to a simulator
+# and comes back as a single buffer. The backends are:
+#
+#   verilator  the Verilog netlist, built with a Verilator on the PATH
+#   cxxrtl     the CXXRTL netlist from the builtin Yosys, built with the C++ compiler ($CXX)
+#   pysim      Amaranth's Python simulator, one vector at a time
+#
+# "auto" picks the first one that is available and builds, saying on stderr why it passed over any
+# that didn't, so a broken toolchain costs speed rather than the run. The compiled backends build
+# a small driver around the netlist that reads vectors from a file or stdin, evaluates them in
+# batches and writes the outputs back out, so nothing runs in Python per vector. Builds are kept
+# under the build directory by a hash of their sources and reused.
+#
+# Designs with a sync domain get a clock edge per vector, after the inputs are set, and their
+# outputs are sampled after the edge; `rst` is an ordinary input. Others are just evaluated.
+
+BACKENDS = ("auto", "verilator", "cxxrtl", "pysim")
+
+DESIGNS = ("OperandDecoder", "VaxDecoderTest")
+
+
+class Port(NamedTuple):
+    name:   str
+    width:  int
+    signal: Signal
+
+    @property
+    def words(self):
+        return (self.width + 31) // 32
+
+
+class RunStats(NamedTuple):
+    vectors: int
+    seconds: float # in the simulator, excluding the build
+
+    @property
+    def rate(self):
+        return self.vectors / self.seconds if self.seconds else float("inf")
+
+
+def dtype(ports):
+    # Record layout for `ports`
+    return np.dtype([(port.name, "<u4", (port.words,)) if port.words > 1 else (port.name, "<u4") for port in ports])
+
+
+def words(values, width):
+    # Python ints as a (len, words) uint32 array, for ports wider than 32 bits
+    count = (width + 31) // 32
+    data  = b"".join(int(value).to_bytes(count * 4, "little") for value in values)
+    return np.frombuffer(data, dtype="<u4").reshape(-1, count)
+
+
+def values(field):
+    # A record field as a list of Python ints
+    if field.ndim == 1:
+        return field.tolist()
+    return [int.from_bytes(row.tobytes(), "little") for row in field]
+
+
+def windows(data, width, offsets=None):
+    # The `width` byte windows of `data` starting at each of `offsets` (default: every byte), as
+    # (len, words) uint32 for a `width * 8` bit i_data port. Bytes past the end read as zero.
+    buf = np.frombuffer(data, dtype=np.uint8) if not isinstance(data, np.ndarray) else data.astype(np.uint8, copy=False)
+    if offsets is None:
+        offsets = np.arange(len(buf), dtype=np.int64)
+    buf = np.concatenate((buf, np.zeros(width, dtype=np.uint8)))
+
+    count  = (width * 8 + 31) // 32
+    result = np.zeros((len(offsets), count * 4), dtype=np.uint8)
+    result[:, :width] = buf[np.asarray(offsets, dtype=np.int64)[:, None] + np.arange(width)]
+    return result.view("<u4")
+
+
+_DRIVER = """
+#include <chrono>
+#include <cstdint>
+#include <cstdio>
+#include <cstdlib>
+#include <cstring>
+#include <vector>
+
+{prelude}
+
+// Reads records of {in_words} input words from argv[1] and writes records of {out_words} output words
+// to argv[2] ("-" for stdin and stdout), {{argv[3]}} records at a time. Prints the record count and
+// the seconds spent on stderr.
+int main(int argc, char **argv) {{
+	if (argc != 4) {{
+		fprintf(stderr, "usage: %s INPUT OUTPUT BATCH\\n", argv[0]);
+		return 2;
+	}}
+	FILE *in  = strcmp(argv[1], "-") ? fopen(argv[1], "rb") : stdin;
+	FILE *out = strcmp(argv[2], "-") ? fopen(argv[2], "wb") : stdout;
+	size_t batch = strtoull(argv[3], nullptr, 0);
+	if (!in || !out || !batch) {{
+		perror(argv[0]);
+		return 1;
+	}}
+	std::vector<uint32_t> inputs(batch * {in_words}), outputs(batch * {out_words});
+
+{setup}
+
+	uint64_t vectors = 0;
+	auto start = std::chrono::steady_clock::now();
+	size_t count;
+	while ((count = fread(inputs.data(), {in_words} * 4, batch, in)) > 0) {{
+		for (size_t n = 0; n < count; n++) {{
+			const uint32_t *i = &inputs[n * {in_words}];
+			uint32_t *o = &outputs[n * {out_words}];
+{set}
+{cycle}
+{get}
+		}}
+		if (fwrite(outputs.data(), {out_words} * 4, count, out) != count) {{
+			perror(argv[0]);
+			return 1;
+		}}
+		vectors += count;
+	}}
+	fflush(out);
+	double seconds = std::chrono::duration<double>(std::chrono::steady_clock::now() - start).count();
+{teardown}
+	fprintf(stderr, "%llu %.9f\\n", (unsigned long long)vectors, seconds);
+	return 0;
+}}
+"""
+
+_CXXRTL_PRELUDE = """
+#include "design.cc"
+
+using namespace cxxrtl;
+
+template<size_t Bits>
+static inline void set(value<Bits> &port, const uint32_t *data) {
+	for (size_t k = 0; k < value<Bits>::chunks; k++)
+		port.data[k] = data[k];
+}
+
+template<size_t Bits>
+static inline void set(wire<Bits> &port, const uint32_t *data) {
+	set(port.next, data);
+}
+
+template<size_t Bits>
+static inline void get(const value<Bits> &port, uint32_t *data) {
+	for (size_t k = 0; k < value<Bits>::chunks; k++)
+		data[k] = port.data[k];
+}
+
+template<size_t Bits>
+static inline void get(const wire<Bits> &port, uint32_t *data) {
+	get(port.curr, data);
+}
+"""
+
+_VERILATOR_PRELUDE = """
+#include "Vtop.h"
+#include "verilated.h"
+
+static inline void set(CData &port, const uint32_t *data) { port = data[0]; }
+static inline void set(SData &port, const uint32_t *data) { port = data[0]; }
+static inline void set(IData &port, const uint32_t *data) { port = data[0]; }
+static inline void set(QData &port, const uint32_t *data) { port = data[0] | (QData)data[1] << 32; }
+
+template<std::size_t Words>
+static inline void set(VlWide<Words> &port, const uint32_t *data) {
+	for (std::size_t k = 0; k < Words; k++)
+		port[k] = data[k];
+}
+
+static inline void get(CData port, uint32_t *data) { data[0] = port; }
+static inline void get(SData port, uint32_t *data) { data[0] = port; }
+static inline void get(IData port, uint32_t *data) { data[0] = port; }
+static inline void get(QData port, uint32_t *data) { data[0] = port; data[1] = port >> 32; }
+
+template<std::size_t Words>
+static inline void get(const VlWide<Words> &port, uint32_t *data) {
+	for (std::size_t k = 0; k < Words; k++)
+		data[k] = port[k];
+}
+"""
+
+
+def _cxxrtl_name(name):
+    return "p_" + name.replace("_", "__")
+
+
+def _offsets(ports):
+    offset = 0
+    for port in ports:
+        yield port, offset
+        offset += port.words
+
+
+class Simulation:
+    # Simulates `design` with `backend` (see BACKENDS). Builds go under `build_dir`.
+    def __init__(self, design, backend="auto", build_dir="build", ports=None):
+        if backend not in BACKENDS:
+            raise ValueError(f"Unknown simulation backend '{backend}', expected one of {', '.join(BACKENDS)}")
+
+        self.design  = design
+        self.backend = backend
+
+        ports = io_ports(design) if ports is None else ports
+        self.inputs  = [Port(port.name, len(port), port) for port in ports if port.name.startswith("i_")]
+        self.outputs = [Port(port.name, len(port), port) for port in ports if port.name.startswith("o_")]
+
+        # Designs using the sync domain get one of their own, so the compiled netlists and pysim
+        # (which prepares the fragment itself) see the same clock and reset signals
+        self.clock = None
+        fragment   = Fragment.get(design, platform=None)
+        if "sync" in fragment.prepare(ports=ports).domains:
+            m = Module()
+            m.domains.sync = domain = ClockDomain("sync")
+            m.submodules.design = design
+            fragment   = Fragment.get(m, platform=None)
+            self.clock = domain.clk
+            self.inputs.append(Port(domain.rst.name, 1, domain.rst))
+        self._fragment = fragment
+
+        self.input_dtype  = dtype(self.inputs)
+        self.output_dtype = dtype(self.outputs)
+
+        self._binary = None
+        for candidate in self._backends() if backend == "auto" else [backend]:
+            self.backend = candidate
+            if candidate == "pysim":
+                break
+            try:
+                self._binary = self._build(Path(build_dir) / "sim")
+                break
+            except (RuntimeError, YosysError) as error:
+                if backend != "auto":
+                    raise
+                print(f"{candidate} simulation unavailable: {str(error).strip().splitlines()[0]}", file=sys.stderr)
+
+    @staticmethod
+    def _backends():
+        # The backends "auto" tries, in order
+        backends = []
+        if shutil.which("verilator"):
+            backends.append("verilator")
+        if shutil.which(os.environ.get("CXX", "c++")):
+            backends.append("cxxrtl")
+        return backends + ["pysim"]
+
+    def zeros(self, count):
+        # An input array of `count` vectors, all zero
+        return np.zeros(count, dtype=self.input_dtype)
+
+    def _prepared(self):
+        # The clock isn't one of the inputs, as the drivers toggle it themselves, but it still has
+        # to be a port of the netlist for them to get at
+        clock = [self.clock] if self.clock is not None else []
+        return self._fragment.prepare(ports=[port.signal for port in self.inputs + self.outputs] + clock)
+
+    def _driver(self, prelude, setup, cycle, teardown, port_ref):
+        lines = {"set": [], "get": []}
+        for port, offset in _offsets(self.inputs):
+            lines["set"].append(f"\t\t\tset({port_ref(port.name)}, i + {offset});")
+        for port, offset in _offsets(self.outputs):
+            lines["get"].append(f"\t\t\tget({port_ref(port.name)}, o + {offset});")
+        return _DRIVER.format(
+            prelude   = prelude,
+            in_words  = max(1, sum(port.words for port in self.inputs)),
+            out_words = sum(port.words for port in self.outputs),
+            setup     = setup,
+            set       = "\n".join(lines["set"]),
+            cycle     = cycle,
+            get       = "\n".join(lines["get"]),
+            teardown  = teardown,
+        )
+
+    def _build(self, build_dir):
+        from .netlist import convert_fragment
+
+        if self.backend == "cxxrtl":
+            from amaranth.back import cxxrtl
+
+            rtlil_text, _ = convert_fragment(self._prepared(), "top")
+            sources = {"design.cc": cxxrtl._convert_rtlil_text(rtlil_text, None)}
+            if self.clock is not None:
+                # step() stops once the flops are committed, so the logic after them takes another
+                clk   = _cxxrtl_name(self.clock.name)
+                cycle = (f"\t\t\ttop.{clk}.set<bool>(false);\n\t\t\ttop.step();\n"
+                         f"\t\t\ttop.{clk}.set<bool>(true);\n\t\t\ttop.step();\n\t\t\ttop.step();")
+            else:
+                cycle = "\t\t\ttop.step();"
+            sources["driver.cc"] = self._driver(_CXXRTL_PRELUDE, "\tcxxrtl_design::p_top top;", cycle, "",
+                                                lambda name: f"top.{_cxxrtl_name(name)}")
+        else:
+            verilog_text, _ = convert_fragment(self._prepared(), "top", "verilog")
+            sources = {"top.v": verilog_text}
+            if self.clock is not None:
+                clk   = self.clock.name
+                cycle = f"\t\t\ttop->{clk} = 0;\n\t\t\ttop->eval();\n\t\t\ttop->{clk} = 1;\n\t\t\ttop->eval();"
+            else:
+                cycle = "\t\t\ttop->eval();"
+            sources["driver.cpp"] = self._driver(_VERILATOR_PRELUDE, "\tVtop *top = new Vtop;", cycle,
+                                                 "\ttop->final();\n\tdelete top;", lambda name: f"top->{name}")
+
+        digest = hashlib.sha256()
+        for name, text in sorted(sources.items()):
+            digest.update(name.encode())
+            digest.update(text.encode())
+        directory = build_dir / f"{self.backend}-{digest.hexdigest()[:16]}"
+        binary    = directory / "vixen_sim"
+        if binary.exists():
+            return binary
+
+        directory.mkdir(parents=True, exist_ok=True)
+        for name, text in sources.items():
+            (directory / name).write_text(text)
+
+        if self.backend == "cxxrtl":
+            from amaranth._toolchain.yosys import find_yosys
+
+            include = find_yosys(lambda version: version >= (0, 10)).data_dir() / "include" / "backends" / "cxxrtl" / "runtime"
+            command = [
+                os.environ.get("CXX", "c++"), "-std=c++14", "-O1", *os.environ.get("CXXFLAGS", "").split(),
+                f"-I{include}", "-o", str(binary), str(directory / "driver.cc"),
+            ]
+        else:
+            command = [
+                "verilator", "--cc", "--exe", "--build", "-O3", "-Wno-fatal", "--top-module", "top",
+                "-Mdir", str(directory / "obj"), "-o", str(binary), "top.v", "driver.cpp",
+            ]
+        result = subprocess.run(command, cwd=directory, capture_output=True, text=True)
+        if result.returncode != 0:
+            raise RuntimeError(f"Building the {self.backend} simulation failed:\n{result.stdout}{result.stderr}")
+        return binary
+
+    def _mask(self, inputs):
+        # Clears the bits of each input past its width, which the compiled models expect to be zero
+        inputs = np.ascontiguousarray(inputs, dtype=self.input_dtype)
+        if any(port.width % 32 for port in self.inputs):
+            inputs = inputs.copy()
+            for port in self.inputs:
+                if port.width % 32:
+                    field = inputs[port.name]
+                    mask  = np.uint32((1 << (port.width % 32)) - 1)
+                    if field.ndim == 1:
+                        field &= mask
+                    else:
+                        field[:, -1] &= mask
+        return inputs
+
+    def run(self, inputs, batch=1 << 16):
+        # Simulates the vectors of `inputs`, returning the outputs and the RunStats
+        inputs = self._mask(inputs)
+        if self.backend == "pysim":
+            return self._run_pysim(inputs)
+
+        result = subprocess.run([str(self._binary), "-", "-", str(batch)], input=inputs.tobytes(), capture_output=True)
+        if result.returncode != 0:
+            raise RuntimeError(f"Simulation failed: {result.stderr.decode(errors='replace')}")
+        vectors, seconds = result.stderr.split()[-2:]
+        return np.frombuffer(result.stdout, dtype=self.output_dtype), RunStats(int(vectors), float(seconds))
+
+    def run_file(self, input_path, output_path, batch=1 << 16):
+        # Simulates the input records in the file `input_path` and writes the outputs to
+        # `output_path`, without going through Python for the compiled backends
+        if self.backend != "pysim":
+            result = subprocess.run([str(self._binary), str(input_path), str(output_path), str(batch)],
+                                    capture_output=True, text=True)
+            if result.returncode != 0:
+                raise RuntimeError(f"Simulation failed: {result.stderr}")
+            vectors, seconds = result.stderr.split()[-2:]
+            return RunStats(int(vectors), float(seconds))
+
+        inputs = np.fromfile(input_path, dtype=self.input_dtype)
+        outputs, stats = self.run(inputs)
+        outputs.tofile(output_path)
+        return stats
+
+    def _run_pysim(self, inputs):
+        from amaranth.sim import Settle, Simulator
+
+        outputs = np.zeros(len(inputs), dtype=self.output_dtype)
+        fields  = {port.name: values(inputs[port.name]) for port in self.inputs}
+
+        def process():
+            for n in range(len(inputs)):
+                for port in self.inputs:
+                    yield port.signal.eq(fields[port.name][n])
+                if self.clock is not None:
+                    yield
+                yield Settle()
+                for port in self.outputs:
+                    value = yield port.signal
+                    if port.words > 1:
+                        outputs[port.name][n] = np.frombuffer(value.to_bytes(port.words * 4, "little"), dtype="<u4")
+                    else:
+                        outputs[port.name][n] = value
+
+        sim = Simulator(self._fragment)
+        if self.clock is not None:
+            sim.add_clock(1e-6)
+            sim.add_sync_process(process)
+        else:
+            sim.add_process(process)
+
+        start = time.perf_counter()
+        sim.run()
+        return outputs, RunStats(len(inputs), time.perf_counter() - start)
+
+
+def _design(name, width=None, boundary="ripple"):
+    from .decode import VaxDecoderTest
+    from .decode_operand import OperandDecoder
+
+    if name == "OperandDecoder":
+        return OperandDecoder()
+    if name == "VaxDecoderTest":
+        return VaxDecoderTest(boundary=boundary) if width is None else VaxDecoderTest(boundary=boundary, width=width)
+    raise ValueError(f"Unknown design '{name}', expected one of {', '.join(DESIGNS)}")
+
+
+if __name__ == "__main__":
+    from argparse import ArgumentParser
+
+    def assignment(text):
+        name, _, value = text.partition("=")
+        return name, int(value, 0)
+
+    parser = ArgumentParser(description="Simulate a decoder over windows of a VAX image, many vectors at a time")
+    parser.add_argument("design", choices=DESIGNS)
+    parser.add_argument("--backend", choices=BACKENDS, default="auto")
+    parser.add_argument("--width", type=int, default=None, help="VaxDecoderTest window width in bytes")
+    parser.add_argument("--boundary", choices=("ripple", "prefix"), default="ripple")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--image", help="raw VAX code, one window per byte offset")
+    source.add_argument("--random", action="store_true", help="random windows")
+    parser.add_argument("--vectors", "-n", type=int, default=1 << 20, help="windows to simulate, repeating the image")
+    parser.add_argument("--set", metavar="PORT=VALUE", type=assignment, action="append", default=[],
+                        help="drive another input port with a constant, e.g. i_valid=1")
+    parser.add_argument("--batch", type=int, default=1 << 20, help="windows per simulator run")
+    parser.add_argument("--output", "-o", default=None, help="append the output records here")
+    parser.add_argument("--verify", metavar="N", type=int, default=0,
+                        help="check the first N windows against the Python simulator")
+    parser.add_argument("--build-dir", default="build")
+    parser.add_argument("--seed", type=int, default=0)
+    capture_options = parser.add_argument_group("waveform capture")
+    capture_options.add_argument("--capture", metavar="PATH", default=None,
+                                 help="write the cycles around each trigger to PATH.NNNNNN.vcd.gz")
+    capture_options.add_argument("--trigger", metavar="PORT=VALUE", type=assignment, action="append", default=[],
+                                 help="trigger when a port has a value")
+    capture_options.add_argument("--trigger-low", metavar="PORT[/ENABLE]", action="append", default=[],
+                                 help="trigger when a port is zero, or any of its bits set in ENABLE is low")
+    capture_options.add_argument("--trigger-opcode", metavar="OPCODE", action="append", default=[],
+                                 type=lambda text: int.from_bytes(bytes.fromhex(text), "little"),
+                                 help="trigger on windows starting with an opcode, in hex as in the stream (e.g. FD32)")
+    capture_options.add_argument("--signals", nargs="+", default=None, help="ports to capture (default: all)")
+    capture_options.add_argument("--depth", type=int, default=1024, help="cycles to keep before a trigger")
+    capture_options.add_argument("--after", type=int, default=64, help="cycles to capture after a trigger")
+    capture_options.add_argument("--keep", type=int, default=16, help="captures to keep on disk, the oldest are deleted")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    sim   = Simulation(_design(args.design, args.width, args.boundary), args.backend, args.build_dir)
+    print(f"{sim.backend} simulation of {args.design} ready in {time.perf_counter() - start:.1f}s", file=sys.stderr)
+
+    width = len(sim.design.i_data) // 8
+    if args.image is not None:
+        image = np.fromfile(args.image, dtype=np.uint8)
+    else:
+        image = np.random.default_rng(args.seed).integers(0, 256, min(args.vectors, 1 << 24), dtype=np.uint8)
+
+    def batch_inputs(first, count):
+        inputs = sim.zeros(count)
+        inputs["i_data"] = windows(image, width, (first + np.arange(count)) % len(image)).reshape(inputs["i_data"].shape)
+        for name, value in args.set:
+            field = inputs[name]
+            field[...] = words([value], len(getattr(sim.design, name)))[0] if field.ndim > 1 else value
+        return inputs
+
+    capture = None
+    if args.capture is not None:
+        from . import capture as waveform
+
+        triggers = [waveform.equals(name, value) for name, value in args.trigger]
+        triggers += [waveform.low(*text.split("/", 1)) for text in args.trigger_low]
+        triggers += [waveform.opcode(value) for value in args.trigger_opcode]
+        capture = waveform.Capture(sim, args.capture, args.signals, args.depth, args.after,
+                                   waveform.any_of(*triggers) if triggers else None, args.keep)
+
+    output = open(args.output, "wb") if args.output is not None else None
+    total  = RunStats(0, 0.0)
+    first  = 0
+    while first < args.vectors:
+        count = min(args.batch, args.vectors - first)
+        inputs = batch_inputs(first, count)
+        outputs, stats = sim.run(inputs)
+        if capture is not None:
+            capture.feed(inputs, outputs)
+        if output is not None:
+            outputs.tofile(output)
+        total = RunStats(total.vectors + stats.vectors, total.seconds + stats.seconds)
+        first += count
+    if output is not None:
+        output.close()
+    if capture is not None:
+        capture.close()
+        print(f"{capture.triggers} triggers, kept {', '.join(str(path) for path in capture.files) or 'nothing'}",
+              file=sys.stderr)
+    print(f"{total.vectors} vectors in {total.seconds:.2f}s, {total.rate:,.0f} cycles/s")
+
+    if args.verify:
+        reference = Simulation(_design(args.design, args.width, args.boundary), "pysim")
+        inputs    = batch_inputs(0, min(args.verify, args.vectors))
+        expected, _ = reference.run(inputs)
+        actual, _   = sim.run(inputs)
+        mismatches  = [n for n in range(len(inputs)) if expected[n].tobytes() != actual[n].tobytes()]
+        print(f"{len(inputs) - len(mismatches)} of {len(inputs)} vectors match the Python simulator")
+        sys.exit(1 if mismatches else 0)
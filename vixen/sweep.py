@@ -0,0 +1,331 @@
+import json
+import multiprocessing
+import os
+import sys
+import time
+
+import numpy as np
+
+from .operand_model import decode_operands
+from .util import Length
+
+# Exhaustive equivalence sweep of OperandDecoder against the model in operand_model.py.
+#
+# The input space is enumerated in shards, one per first specifier byte. A shard covers:
+#
+#   - for an index prefix (4x), every base specifier byte after it
+#   - every payload of PAYLOADS in the bytes after the specifier (and base)
+#   - every Length for the active operand, the other operands getting other lengths
+#   - every operand index, as the one-hot i_operidx
+#   - the active operand fixed (i_fixed set for it alone) or not (set for every other operand)
+#   - i_valid low and high
+#
+# The shards are simulated by a pool of processes, each with a Simulation of its own (see
+# simulate.py), and compared with the model on o_length, o_immed, o_deferred, o_legalop and
+# o_immvalid. The model mirrors the RTL, so it can only catch the two drifting apart; o_length
+# and o_immed are also checked against the architectural tables below, reported as
+# "o_length/arch" and "o_immed/arch". A pipelined decoder (see OperandDecoder.stages) gets
+# i_data ahead of its other inputs by its latency, and its outputs are lined up with the vectors
+# they belong to. Mismatches come back to the parent as they are found and go into the report as
+# one JSON line each, followed by a summary line.
+
+OUTPUTS      = ("o_length", "o_immed", "o_deferred", "o_legalop", "o_immvalid")
+ARCH_OUTPUTS = ("o_length", "o_immed")
+
+# Representative 32-bit payloads: zero, the sign and carry boundaries of byte, word and
+# longword displacements and immediates, and two patterns to catch swapped bytes
+PAYLOADS = (
+    0x00000000, 0x00000001, 0x0000007f, 0x00000080, 0x000000ff, 0x00000100, 0x00007fff, 0x00008000,
+    0x0000ffff, 0x00010000, 0x7fffffff, 0x80000000, 0xffffffff, 0x12345678, 0x89abcdef,
+)
+
+# What the byte past a longword payload holds when there is one (non-indexed specifiers)
+_TRAILERS = (0x00, 0xa5)
+
+OPERANDS = 6
+
+_LENGTHS = len(Length)
+
+# The architectural reference: bytes following the specifier byte by mode, for Rn and for PC,
+# as the VAX architecture gives them rather than as the RTL works them out. None is the size of
+# the operand (immediate). An index prefix (4x) adds its own byte in front of the base specifier.
+_MODE_BYTES = {
+    0x0: (0, 0), 0x1: (0, 0), 0x2: (0, 0), 0x3: (0, 0), # short literal
+    0x5: (0, 0),                                        # register
+    0x6: (0, 0),                                        # register deferred
+    0x7: (0, 0),                                        # autodecrement
+    0x8: (0, None),                                     # autoincrement, immediate
+    0x9: (0, 4),                                        # autoincrement deferred, absolute
+    0xA: (1, 1), 0xB: (1, 1),                           # byte displacement (deferred)
+    0xC: (2, 2), 0xD: (2, 2),                           # word displacement (deferred)
+    0xE: (4, 4), 0xF: (4, 4),                           # longword displacement (deferred)
+}
+
+# What o_immed holds by mode, for Rn and for PC. Autoincrement deferred always steps by a
+# longword, which the decoder leaves to the Cracker, so it has nothing to check.
+_MODE_IMMED = {
+    0x0: ("literal",) * 2, 0x1: ("literal",) * 2, 0x2: ("literal",) * 2, 0x3: ("literal",) * 2,
+    0x5: (None, None),
+    0x6: (None, None),
+    0x7: ("decrement", "decrement"),
+    0x8: ("increment", "unsigned"),
+    0x9: (None, "unsigned"),
+    0xA: ("signed",) * 2, 0xB: ("signed",) * 2,
+    0xC: ("signed",) * 2, 0xD: ("signed",) * 2,
+    0xE: ("signed",) * 2, 0xF: ("signed",) * 2,
+}
+
+_DATA_BYTES = {Length.BYTE: 1, Length.WORD: 2, Length.LONG: 4, Length.QUAD: 8, Length.OCTA: 16}
+
+_IMMED_KINDS = (None, "literal", "increment", "decrement", "unsigned", "signed")
+
+
+def _specifier_tables():
+    # The tables above by specifier byte (and Length): bytes after the specifier byte, what
+    # o_immed holds, and whether it can follow an index prefix
+    extra     = np.zeros((256, _LENGTHS), dtype=np.int64)
+    kind      = np.zeros(256, dtype=np.uint8)
+    indexable = np.zeros(256, dtype=bool)
+    for spec in range(256):
+        mode, is_pc = spec >> 4, (spec & 0xf) == 15
+        if mode == 0x4:
+            continue
+        for length in Length:
+            count = _MODE_BYTES[mode][is_pc]
+            extra[spec, length.value] = _DATA_BYTES[length] if count is None else count
+        kind[spec]      = _IMMED_KINDS.index(_MODE_IMMED[mode][is_pc])
+        indexable[spec] = mode not in (0x0, 0x1, 0x2, 0x3, 0x5) and spec != 0x8F
+    return extra, kind, indexable
+
+
+_SPEC_EXTRA, _SPEC_IMMED, _SPEC_INDEXABLE = _specifier_tables()
+
+# Branch displacements and inline data (i_fixed) are as long as their Length, which the decoder
+# only handles up to a longword
+_FIXED_BYTES = np.array([_DATA_BYTES[length] if length.value <= Length.LONG.value else 0 for length in Length])
+_STEP        = np.array([_DATA_BYTES[length] for length in Length], dtype=np.uint64)
+
+
+def shard_windows(first):
+    # The 48-bit specifier windows of the shard for first byte `first`
+    payloads = np.array(PAYLOADS, dtype=np.uint64)
+    if first >> 4 == 0x4:
+        base = np.arange(256, dtype=np.uint64)
+        rest = (base[:, None] | (payloads[None, :] << np.uint64(8))).ravel()
+    else:
+        trailers = np.array(_TRAILERS, dtype=np.uint64)
+        rest = (payloads[:, None] | (trailers[None, :] << np.uint64(32))).ravel()
+    return np.uint64(first) | (rest << np.uint64(8))
+
+
+def shard_vectors(first):
+    # Every combination of a window of the shard with the Length, operand index, fixed and valid
+    # inputs, as flat arrays
+    data = shard_windows(first)
+    grid = np.meshgrid(
+        np.arange(len(data)), np.arange(_LENGTHS), np.arange(OPERANDS), np.arange(2), np.arange(2), indexing="ij"
+    )
+    window, length, operand, fixed, valid = (axis.ravel() for axis in grid)
+    return {
+        "data":    data[window],
+        "length":  length.astype(np.uint8),
+        "operand": operand.astype(np.uint8),
+        "fixed":   fixed.astype(bool),
+        "valid":   valid.astype(bool),
+    }
+
+
+def _inputs(sim, vectors):
+    # The Simulation inputs for `vectors`
+    inputs  = sim.zeros(len(vectors["data"]))
+    operand = vectors["operand"].astype(np.uint32)
+    onehot  = np.uint32(1) << operand
+
+    inputs["i_data"][:, 0] = vectors["data"] & np.uint64(0xffffffff)
+    inputs["i_data"][:, 1] = vectors["data"] >> np.uint64(32)
+    inputs["i_valid"]      = vectors["valid"]
+    inputs["i_operidx"]    = onehot
+    inputs["i_fixed"]      = np.where(vectors["fixed"], onehot, ~onehot & np.uint32((1 << OPERANDS) - 1))
+    for index in range(OPERANDS):
+        # The other operands get a length other than the active one's, so picking the wrong one shows
+        other = (vectors["length"] + 1 + index % (_LENGTHS - 1)) % _LENGTHS
+        inputs[f"i_operlen{index + 1}"] = np.where(operand == index, vectors["length"], other)
+    return inputs
+
+
+def _expected(vectors):
+    decoded = decode_operands(vectors["data"], vectors["length"], vectors["valid"], vectors["fixed"])
+    return {
+        "o_length":   decoded.length.astype(np.uint32),
+        "o_immed":    decoded.immed.astype(np.uint32),
+        "o_deferred": decoded.deferred.astype(np.uint32),
+        "o_legalop":  decoded.legalop.astype(np.uint32),
+        "o_immvalid": decoded.immvalid.astype(np.uint32),
+    }
+
+
+def architectural(vectors):
+    # o_length and o_immed for `vectors` by the architectural tables, with a mask each of the
+    # vectors they hold for. Illegal index bases, quadword and octaword immediates, which don't
+    # fit in the window, and modes without an immediate are left out.
+    data    = vectors["data"]
+    length  = vectors["length"].astype(np.intp)
+    fixed   = vectors["fixed"]
+    byte0   = (data & np.uint64(0xff)).astype(np.intp)
+    byte1   = ((data >> np.uint64(8)) & np.uint64(0xff)).astype(np.intp)
+    indexed = byte0 >> 4 == 0x4
+    spec    = np.where(indexed, byte1, byte0)
+    legal   = ~indexed | _SPEC_INDEXABLE[spec]
+
+    extra  = _SPEC_EXTRA[spec, length]
+    size   = np.where(fixed, _FIXED_BYTES[length], 1 + indexed + extra)
+    fits   = np.where(fixed, _FIXED_BYTES[length] > 0, legal & (size <= 6))
+    kind   = np.where(fixed, _IMMED_KINDS.index("signed"), _SPEC_IMMED[spec])
+    onehot = np.left_shift(1, np.clip(size, 1, 6) - 1)
+
+    # The payload is whatever follows the specifier (or all of a fixed operand), as many bytes of
+    # it as the specifier takes
+    payload = np.where(fixed, data, data >> (np.uint64(8) * (1 + indexed).astype(np.uint64)))
+    width   = np.uint64(8) * np.clip(np.where(fixed, size, extra), 1, 4).astype(np.uint64)
+    low     = payload & ((np.uint64(1) << width) - np.uint64(1))
+    sign    = np.uint64(1) << (width - np.uint64(1))
+    immed   = np.select(
+        [kind == _IMMED_KINDS.index(name) for name in ("literal", "increment", "decrement", "unsigned", "signed")],
+        [data & np.uint64(0x3f), _STEP[length], np.uint64(1 << 32) - _STEP[length], low, (low ^ sign) - sign],
+        default=np.uint64(0),
+    ) & np.uint64(0xffffffff)
+
+    return {
+        "o_length": (np.where(vectors["valid"], onehot, 0).astype(np.uint32), fits),
+        "o_immed":  (immed.astype(np.uint32), fits & (kind != 0)),
+    }
+
+
+_sim = None
+
+
+def _init_worker(backend, build_dir, stages):
+    global _sim
+    from .decode_operand import OperandDecoder
+    from .simulate import Simulation
+
+    _sim = Simulation(OperandDecoder(stages), backend, build_dir)
+
+
+def _delay(sim):
+    # Vectors that i_data goes in ahead of the other inputs, and the outputs come out after it.
+    # Simulation samples the outputs after the clock edge of each vector, so the first register
+    # stage doesn't add one.
+    return max(0, sim.design.latency - 1)
+
+
+def run_shard(job):
+    # Simulates the shard for first byte `first` and returns (first, vectors, seconds, mismatch
+    # counts by output, the first `limit` mismatches)
+    first, limit = job
+    vectors = shard_vectors(first)
+    inputs  = _inputs(_sim, vectors)
+    delay   = _delay(_sim)
+    stream  = np.concatenate((inputs, inputs[:delay]))
+    for name in inputs.dtype.names:
+        if name != "i_data":
+            stream[name][delay:] = inputs[name]
+    outputs, stats = _sim.run(stream)
+    outputs  = outputs[delay:]
+    expected = _expected(vectors)
+
+    wrong  = np.zeros(len(outputs), dtype=bool)
+    counts = {}
+    for name in OUTPUTS:
+        differs = outputs[name] != expected[name]
+        counts[name] = int(differs.sum())
+        wrong |= differs
+    reference = {}
+    for name, (values, checked) in architectural(vectors).items():
+        differs = checked & (outputs[name] != values)
+        reference[f"{name}/arch"] = (name, values, differs)
+        counts[f"{name}/arch"] = int(differs.sum())
+        wrong |= differs
+
+    mismatches = []
+    for n in np.flatnonzero(wrong)[:limit]:
+        mismatches.append({
+            "data":    f"{int(vectors['data'][n]):012x}",
+            "length":  Length(int(vectors["length"][n])).name,
+            "operand": int(vectors["operand"][n]) + 1,
+            "fixed":   bool(vectors["fixed"][n]),
+            "valid":   bool(vectors["valid"][n]),
+            **{
+                name: {"expected": int(expected[name][n]), "actual": int(outputs[name][n])}
+                for name in OUTPUTS if outputs[name][n] != expected[name][n]
+            },
+            **{
+                key: {"expected": int(values[n]), "actual": int(outputs[name][n])}
+                for key, (name, values, differs) in reference.items() if differs[n]
+            },
+        })
+    return first, stats.vectors, stats.seconds, counts, mismatches
+
+
+def run(backend="auto", build_dir="build", jobs=None, firsts=range(256), limit=16, report=None, progress=None, stages=()):
+    # Sweeps the shards for the first bytes `firsts` over `jobs` processes, writing every mismatch
+    # to the text stream `report` as it arrives, and returns the summary. `stages` pipelines the
+    # decoder, see OperandDecoder.
+    from .decode_operand import OperandDecoder
+    from .simulate import Simulation
+
+    # Built once up front, so the workers find it in the build directory instead of racing to build it
+    backend = Simulation(OperandDecoder(stages), backend, build_dir).backend
+
+    summary = {"backend": backend, "shards": 0, "vectors": 0, "sim_seconds": 0.0,
+               "mismatches": dict.fromkeys(OUTPUTS + tuple(f"{name}/arch" for name in ARCH_OUTPUTS), 0)}
+    start = time.perf_counter()
+    with multiprocessing.get_context("spawn").Pool(jobs or os.cpu_count(), _init_worker, (backend, build_dir, stages)) as pool:
+        for first, vectors, seconds, counts, mismatches in pool.imap_unordered(run_shard, [(first, limit) for first in firsts]):
+            summary["shards"]      += 1
+            summary["vectors"]     += vectors
+            summary["sim_seconds"] += seconds
+            for name, count in counts.items():
+                summary["mismatches"][name] += count
+            if report is not None:
+                for mismatch in mismatches:
+                    report.write(json.dumps(mismatch, separators=(",", ":")) + "\n")
+                report.flush()
+            if progress is not None:
+                progress(first, vectors, counts)
+    summary["seconds"] = time.perf_counter() - start
+    return summary
+
+
+if __name__ == "__main__":
+    from argparse import ArgumentParser
+
+    from .decode_operand import STAGES
+    from .simulate import BACKENDS
+
+    parser = ArgumentParser(description="Sweep OperandDecoder exhaustively against the software model")
+    parser.add_argument("--backend", choices=BACKENDS, default="auto")
+    parser.add_argument("--jobs", "-j", type=int, default=None, help="simulator processes (default: one per CPU)")
+    parser.add_argument("--first", metavar="BYTE", type=lambda text: int(text, 16), nargs="+", default=list(range(256)),
+                        help="only sweep these first specifier bytes, in hex")
+    parser.add_argument("--limit", type=int, default=16, help="mismatches to report per shard")
+    parser.add_argument("--output", "-o", default=None, help="write the mismatches and summary as JSON lines here")
+    parser.add_argument("--stages", nargs="*", choices=STAGES, default=[], help="OperandDecoder register stages")
+    parser.add_argument("--build-dir", default="build")
+    args = parser.parse_args()
+
+    def progress(first, vectors, counts):
+        failed = sum(counts.values())
+        print(f"{first:02x}: {vectors} vectors" + (f", {failed} mismatching outputs" if failed else ""),
+              file=sys.stderr, flush=True)
+
+    report = open(args.output, "w") if args.output is not None else sys.stdout
+    summary = run(args.backend, args.build_dir, args.jobs, args.first, args.limit, report, progress, args.stages)
+    report.write(json.dumps({"summary": summary}, separators=(",", ":")) + "\n")
+    if report is not sys.stdout:
+        report.close()
+
+    failed = sum(summary["mismatches"].values())
+    print(f"{summary['vectors']} vectors in {summary['seconds']:.1f}s ({summary['backend']}), "
+          f"{summary['vectors'] / summary['seconds']:,.0f} vectors/s, {failed} mismatching outputs", file=sys.stderr)
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,452 @@
+import json
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+from math import ceil, log2
+from pathlib import Path
+from typing import NamedTuple
+
+from amaranth import *
+from amaranth.back import rtlil
+from amaranth._toolchain.yosys import find_yosys
+
+# Quick synthesis statistics for comparing RTL variants of the decoder.
+#
+# gate_stats() lowers a design to generic gates with the Yosys that ships with Amaranth and
+# measures it in Python: area in two-input gate equivalents and logic depth in gate levels
+# along the longest combinational path. The few coarse cells the builtin Yosys can't map
+# (adders, comparators, shifters, $pmux, ROMs) are costed with the usual textbook estimates.
+# That is good enough to compare variants against each other, not to predict a vendor flow.
+#
+# lut_stats() maps a design to generic LUTs with a Yosys on the PATH, which unlike the builtin
+# one has `synth` and ABC, and reports the cells, LUTs and LUT levels on the longest path.
+#
+# fmax() runs the real thing (synth_ecp5 and nextpnr-ecp5) when both are on the PATH. The
+# design is put between registers fed from and reduced to a single pin, so it fits any package.
+
+
+class GateStats(NamedTuple):
+    gates:       int  # two-input gate equivalents, inverters not counted
+    depth:       int  # gate levels on the longest combinational path
+    memory_bits: int
+    cells:       dict # cell type -> count after lowering
+
+
+class LutStats(NamedTuple):
+    cells: int  # all cells after mapping, flip-flops and memories included
+    luts:  int
+    depth: int  # LUT levels on the longest combinational path
+    cell_types: dict # cell type -> count after mapping
+
+
+def _clog2(value):
+    return ceil(log2(value)) if value > 1 else 0
+
+
+def io_ports(design):
+    # The i_* and o_* signals of a design, including those kept in lists
+    ports = []
+    for name, value in vars(design).items():
+        if name.startswith(("i_", "o_")):
+            ports.extend(signal for signal in (value if isinstance(value, list) else [value]) if isinstance(signal, Signal))
+    return ports
+
+
+_LOWER_SCRIPT = """
+read_rtlil <<rtlil
+{rtlil}
+rtlil
+hierarchy -top top
+proc
+flatten
+opt
+wreduce
+opt
+bmuxmap
+demuxmap
+simplemap
+opt
+opt_clean -purge
+write_rtlil
+"""
+
+
+def lower(design, ports):
+    # Returns the design as RTLIL, flattened and mapped to generic gates where possible.
+    yosys = find_yosys(lambda version: version >= (0, 10))
+    return yosys.run(["-q", "-"], _LOWER_SCRIPT.format(rtlil=rtlil.convert(design, ports=ports)), ignore_warnings=True)
+
+
+_SIGSPEC = re.compile(r"\{|\}|[0-9]+'[01xzm-]*|[\\$]\S+(?: \[[0-9]+(?::[0-9]+)?\])?")
+
+
+class _Netlist:
+    # Constant bits are None, or ("'", value) with `constants` set
+    def __init__(self, text, constants=False):
+        self.constants = constants
+        self.widths    = {}
+        self.cells     = [] # (type, parameters, {port: [bits]})
+        self.aliases   = {}
+
+        cell = None
+        for line in text.splitlines():
+            fields = line.split()
+            if not fields:
+                continue
+            if fields[0] == "wire":
+                width = int(fields[fields.index("width") + 1]) if "width" in fields else 1
+                self.widths[fields[-1]] = width
+            elif fields[0] == "cell":
+                cell = (fields[1], {}, {})
+            elif fields[0] == "parameter" and cell is not None:
+                value = fields[-1]
+                cell[1][fields[-2]] = int(value) if value.lstrip("-").isdigit() else value
+            elif fields[0] == "connect":
+                lhs, rhs = self._split_connect(line.strip()[len("connect "):])
+                if cell is not None:
+                    cell[2][lhs.lstrip("\\")] = self._bits(rhs)
+                else:
+                    for a, b in zip(self._bits(lhs), self._bits(rhs)):
+                        if a is not None and b is not None:
+                            self._union(a, b)
+            elif fields[0] == "end":
+                if cell is not None:
+                    self.cells.append(cell)
+                    cell = None
+
+    def _split_connect(self, text):
+        # Splits "<sigspec> <sigspec>" at the end of the first sigspec
+        depth = 0
+        for match in _SIGSPEC.finditer(text):
+            token = match.group()
+            depth += (token == "{") - (token == "}")
+            if depth == 0:
+                return text[:match.end()], text[match.end():].strip()
+        raise ValueError(f"malformed connection '{text}'")
+
+    def _bits(self, text):
+        # LSB first list of (wire, bit) tuples, None for constant bits
+        stack = [[]]
+        for match in _SIGSPEC.finditer(text):
+            token = match.group()
+            if token == "{":
+                stack.append([])
+            elif token == "}":
+                parts = stack.pop()
+                stack[-1].append([bit for part in reversed(parts) for bit in part])
+            elif "'" in token and token[0].isdigit():
+                width, _, value = token.partition("'")
+                if self.constants:
+                    stack[-1].append([("'", char) for char in reversed(value)])
+                else:
+                    stack[-1].append([None] * int(width))
+            else:
+                name, _, select = token.partition(" [")
+                if select:
+                    hi, _, lo = select[:-1].partition(":")
+                    lo = lo or hi
+                    stack[-1].append([(name, bit) for bit in range(int(lo), int(hi) + 1)])
+                else:
+                    stack[-1].append([(name, bit) for bit in range(self.widths.get(name, 1))])
+        return [bit for part in reversed(stack[0]) for bit in part]
+
+    def _find(self, bit):
+        root = bit
+        while root in self.aliases:
+            root = self.aliases[root]
+        while bit != root:
+            self.aliases[bit], bit = root, self.aliases[bit]
+        return root
+
+    def _union(self, a, b):
+        a, b = self._find(a), self._find(b)
+        if a != b:
+            self.aliases[a] = b
+
+
+_OUTPUTS = {"Y", "Q", "RD_DATA"}
+
+
+def _cell_cost(kind, params, ports):
+    # (area in gate equivalents, delay in gate levels, memory bits)
+    if kind == "$_NOT_":
+        return 0, 0, 0
+    if kind.startswith("$_"):
+        return (3 if kind in ("$_MUX_", "$_XOR_", "$_XNOR_") else 1), 1, 0
+    width = len(ports.get("Y", ()))
+    if kind == "$pmux":
+        cases = params.get("\\S_WIDTH", 1)
+        return width * 2 * cases, 1 + _clog2(cases + 1), 0
+    if kind in ("$add", "$sub", "$neg"):
+        return 6 * width, 2 + 2 * _clog2(width), 0
+    if kind in ("$lt", "$le", "$gt", "$ge", "$eq", "$ne", "$eqx", "$nex"):
+        width = max(len(ports.get("A", ())), len(ports.get("B", ())))
+        return 3 * width, 2 + _clog2(width), 0
+    if kind in ("$shift", "$shiftx", "$shl", "$shr", "$sshl", "$sshr"):
+        levels = len(ports.get("B", ()))
+        return 3 * width * levels, levels, 0
+    if kind == "$mem_v2":
+        abits = params.get("\\ABITS", 1)
+        return 0, abits, params.get("\\SIZE", 0) * params.get("\\WIDTH", 0)
+    return width, 1, 0
+
+
+def _arrival(netlist):
+    # ({cell index: gate levels on the longest path ending at its outputs}, {bit: driving cell},
+    # [cell costs])
+    drivers = {}
+    costs   = []
+    for index, (kind, params, connections) in enumerate(netlist.cells):
+        costs.append(_cell_cost(kind, params, connections))
+        for port, bits in connections.items():
+            if port in _OUTPUTS:
+                for bit in bits:
+                    if bit is not None:
+                        drivers[netlist._find(bit)] = index
+
+    # Longest path by memoized depth first search, iterative as the chains are long
+    arrival = {}
+    for root in range(len(netlist.cells)):
+        stack = [(root, False)]
+        while stack:
+            index, expanded = stack.pop()
+            if index in arrival:
+                continue
+            kind, params, connections = netlist.cells[index]
+            inputs = _inputs(netlist, drivers, connections)
+            # Registers and memories with a clock start new paths
+            if _is_clocked(kind, connections):
+                inputs = set()
+            if not expanded:
+                pending = [cell for cell in inputs if cell not in arrival]
+                if pending:
+                    stack.append((index, True))
+                    stack.extend((cell, False) for cell in pending)
+                    continue
+            arrival[index] = costs[index][1] + max((arrival.get(cell, 0) for cell in inputs), default=0)
+
+    return arrival, drivers, costs
+
+
+def _inputs(netlist, drivers, connections):
+    # The cells driving the inputs of a cell
+    inputs = {
+        drivers.get(netlist._find(bit))
+        for port, bits in connections.items() if port not in _OUTPUTS
+        for bit in bits if bit is not None
+    }
+    inputs.discard(None)
+    return inputs
+
+
+def _is_clocked(kind, connections):
+    return "CLK" in connections or kind.startswith(("$_DFF", "$_SDFF"))
+
+
+def gate_stats(design, ports):
+    netlist = _Netlist(lower(design, ports))
+    arrival, _, costs = _arrival(netlist)
+
+    cells = {}
+    for kind, _, _ in netlist.cells:
+        cells[kind] = cells.get(kind, 0) + 1
+
+    return GateStats(
+        gates       = sum(cost[0] for cost in costs),
+        depth       = max(arrival.values(), default=0),
+        memory_bits = sum(cost[2] for cost in costs),
+        cells       = dict(sorted(cells.items())),
+    )
+
+
+def stage_depths(design, ports, stages):
+    # Gate levels on the longest path into the registers of each of `stages`, told apart by the
+    # "<stage>_" names of the signals they drive, and into the outputs, as {stage or "out": depth}.
+    # Together they are the depth of each pipeline stage, where gate_stats() only has the deepest.
+    netlist = _Netlist(lower(design, ports))
+    arrival, drivers, _ = _arrival(netlist)
+
+    def into(bits):
+        cells = {drivers.get(netlist._find(bit)) for bit in bits if bit is not None}
+        return max((arrival[cell] for cell in cells if cell is not None), default=0)
+
+    depths = dict.fromkeys(stages, 0)
+    for kind, _, connections in netlist.cells:
+        if not _is_clocked(kind, connections):
+            continue
+        name = next((bit[0] for bit in connections.get("Q", ()) if bit is not None), "")
+        for stage in stages:
+            if name.split(".")[-1].lstrip("\\").startswith(f"{stage}_"):
+                bits = [bit for port, bits in connections.items() if port not in _OUTPUTS for bit in bits]
+                depths[stage] = max(depths[stage], into(bits))
+    depths["out"] = into([
+        (f"\\{port.name}", bit) for port in ports if port.name.startswith("o_") for bit in range(len(port))
+    ])
+    return depths
+
+
+_LONGEST_PATH = re.compile(r"Longest topological path in \S+ \(length=([0-9]+)\)")
+
+
+def lut_stats(design, ports, lut_size=4):
+    # LUT mapping results from a Yosys on the PATH, or None when there isn't one.
+    yosys = shutil.which("yosys")
+    if yosys is None:
+        return None
+
+    with tempfile.TemporaryDirectory() as build_dir:
+        build = Path(build_dir)
+        (build / "top.il").write_text(rtlil.convert(design, ports=ports))
+        log = subprocess.run(
+            [yosys, "-p", f"read_rtlil {build / 'top.il'}; synth -flatten -top top -lut {lut_size}; "
+                          f"ltp -noff; tee -q -o {build / 'stat.json'} stat -json"],
+            check=True, capture_output=True, text=True
+        ).stdout
+        stat = json.loads((build / "stat.json").read_text())
+
+    top   = stat["design"]
+    types = top.get("num_cells_by_type", {})
+    depth = [int(length) for length in _LONGEST_PATH.findall(log)]
+    return LutStats(
+        cells = top["num_cells"],
+        luts  = sum(count for kind, count in types.items() if kind in ("$lut", "$_LUT_")),
+        depth = max(depth, default=0),
+        cell_types = dict(sorted(types.items())),
+    )
+
+
+class _Harness(Elaboratable):
+    # Registers every input and output of `design`, loading the inputs through a shift register
+    # from one pin and XOR reducing the outputs to another, so nothing gets optimized away.
+    def __init__(self, design, ports):
+        self.design  = design
+        self.ports   = ports
+        self.i_data  = Signal()
+        self.o_data  = Signal()
+
+    def elaborate(self, platform):
+        m = Module()
+        m.submodules.design = self.design
+
+        inputs  = [port for port in self.ports if port.name.startswith("i_")]
+        outputs = [port for port in self.ports if not port.name.startswith("i_")]
+
+        shift = Signal(sum(len(port) for port in inputs))
+        m.d.sync += shift.eq(Cat(self.i_data, shift[:-1]))
+        offset = 0
+        for port in inputs:
+            m.d.comb += port.eq(shift[offset:offset + len(port)])
+            offset += len(port)
+
+        captured = Signal(sum(len(port) for port in outputs))
+        m.d.sync += [
+            captured.eq(Cat(outputs)),
+            self.o_data.eq(captured.xor()),
+        ]
+
+        return m
+
+
+def fmax(design, ports, device="25k"):
+    # Achieved Fmax in MHz from nextpnr-ecp5, or None when the tools aren't installed.
+    yosys, nextpnr = shutil.which("yosys"), shutil.which("nextpnr-ecp5")
+    if yosys is None or nextpnr is None:
+        return None
+
+    harness = _Harness(design, ports)
+    with tempfile.TemporaryDirectory() as build_dir:
+        build = Path(build_dir)
+        (build / "top.il").write_text(rtlil.convert(harness, ports=[harness.i_data, harness.o_data]))
+        subprocess.run(
+            [yosys, "-q", "-p", f"read_rtlil {build / 'top.il'}; synth_ecp5 -top top -json {build / 'top.json'}"],
+            check=True
+        )
+        subprocess.run(
+            [nextpnr, f"--{device}", "--json", build / "top.json", "--report", build / "report.json", "--freq", "100", "--quiet"],
+            check=True
+        )
+        report = json.loads((build / "report.json").read_text())
+
+    return min(clock["achieved"] for clock in report["fmax"].values())
+
+
+def compare(variants, fmax_device=None, stages=None):
+    # Prints a table of gate_stats() (and fmax() when `fmax_device` is given) for each of
+    # `variants`, a {name: (design factory, ports getter)} mapping. With `stages`, a list of
+    # register stage names, also the stage_depths() of each.
+    width  = max(24, *(len(name) for name in variants))
+    header = f"{'variant':<{width}} {'gates':>9} {'depth':>6} {'ROM bits':>9} {'Fmax':>8}"
+    if stages is not None:
+        header += "".join(f" {stage:>9}" for stage in (*stages, "out"))
+    print(header)
+    for name, (make, get_ports) in variants.items():
+        design = make()
+        stats  = gate_stats(design, get_ports(design))
+        freq   = None
+        if fmax_device is not None:
+            design = make()
+            freq   = fmax(design, get_ports(design), fmax_device)
+        freq = "n/a" if freq is None else f"{freq:.1f}"
+        line = f"{name:<{width}} {stats.gates:>9} {stats.depth:>6} {stats.memory_bits:>9} {freq:>8}"
+        if stages is not None:
+            design = make()
+            depths = stage_depths(design, get_ports(design), stages)
+            line  += "".join(f" {depths[stage] if stage in depths and depths[stage] else '-':>9}"
+                             for stage in (*stages, "out"))
+        print(line, flush=True)
+
+
+if __name__ == "__main__":
+    from argparse import ArgumentParser
+
+    from itertools import combinations
+
+    from .decode import VaxDecoderTest
+    from .decode_operand import STAGES, OperandDecoder
+
+    parser = ArgumentParser(description="Compare the VaxDecoderTest boundary networks and window sizes")
+    parser.add_argument("--fmax", metavar="DEVICE", default=None, help="also place and route for an ECP5 device, e.g. 25k")
+    parser.add_argument("--widths", metavar="BYTES", type=int, nargs="+", default=[1 + 6*6], help="window widths to sweep")
+    parser.add_argument("--boundaries", nargs="+", choices=("ripple", "prefix"), default=["ripple", "prefix"])
+    parser.add_argument("--operand-stages", action="store_true",
+                        help="compare the OperandDecoder register stage configurations, alone and in the windows, instead")
+    args = parser.parse_args()
+
+    def window_ports(design):
+        return [design.i_data, design.i_resume, design.i_opcode, design.i_operand,
+                design.o_operands, design.o_count, design.o_more, design.o_length, design.o_operand]
+
+    if args.operand_stages:
+        # Every register stage configuration of OperandDecoder on its own and in the windows.
+        # Stage depths are into the registers of each stage and then into the outputs, which for
+        # a window is the boundary chain.
+        configurations = [stages for count in range(len(STAGES) + 1) for stages in combinations(STAGES, count)]
+        variants = {
+            f"operand, {'+'.join(stages) or 'comb'}": (
+                lambda stages=stages: OperandDecoder(stages),
+                lambda design: design.ports(),
+            )
+            for stages in configurations
+        }
+        variants.update({
+            f"{boundary}, {width} bytes, {'+'.join(stages) or 'comb'}": (
+                lambda boundary=boundary, width=width, stages=stages: VaxDecoderTest(boundary=boundary, width=width, stages=stages),
+                window_ports,
+            )
+            for width in args.widths
+            for boundary in args.boundaries
+            for stages in configurations
+        })
+        compare(variants, args.fmax, STAGES)
+        sys.exit(0)
+
+    compare({
+        f"{boundary}, {width} bytes": (
+            lambda boundary=boundary, width=width: VaxDecoderTest(boundary=boundary, width=width),
+            window_ports,
+        )
+        for width in args.widths
+        for boundary in args.boundaries
+    }, args.fmax)
@@ -0,0 +1,347 @@
+from enum import Enum
+from functools import lru_cache
+
+from amaranth import *
+from amaranth.lib import data
+from amaranth.lib.fifo import SyncFIFOBuffered
+
+from .decode import MAX_OPERANDS, Opcode, OpcodeAttributes, _or_tree
+from .util import Length
+
+# Micro-op cracking.
+#
+# Cracker takes the instructions VaxDecoder hands out and turns each into a sequence of micro-ops
+# with up to three source and two destination registers, one per cycle, into a SyncFIFOBuffered
+# that execution drains at its own pace. Every operand gets the micro-ops for its addressing mode
+# in operand order, so autoincrement and autodecrement side effects happen in the architectural
+# order, followed by the operation itself and the stores of any written memory operands:
+#
+#   base     address generation (AGEN) or absolute address (IMM), with the register update for
+#            autoincrement and autodecrement modes
+#   deref    the pointer load of the deferred modes
+#   index    scaling and adding the index register of an indexed operand
+#   value    the literal or immediate (IMM), or the load of a read memory operand
+#   ALU      the operation on the operand values, a second one when there are more than three
+#            source or two destination operands
+#   store    the store of each written memory operand
+#
+# Register numbers are 5 bits: the 16 architectural registers, then temporaries (operand n has
+# its value in value_temp(n) and address in address_temp(n)), and a ZERO register that reads as
+# zero and drops writes.
+
+REGISTER_PC = 15
+REGISTER_ZERO = 31
+
+
+def value_temp(operand):
+    return 16 + operand
+
+
+def address_temp(operand):
+    return 16 + MAX_OPERANDS + operand
+
+
+class UopKind(Enum):
+    IMM   = 0 # dst_a = imm
+    AGEN  = 1 # address generation, see AgenMode
+    LOAD  = 2 # dst_a = `size` at address src_a
+    STORE = 3 # `size` at address src_a = src_b
+    ALU   = 4 # dst_a, dst_b = opcode(src_a, src_b, src_c); imm is the address of the next instruction
+
+
+class AgenMode(Enum):
+    OFFSET = 0 # dst_a = src_a + (src_b << size) + imm
+    PRE    = 1 # dst_a = dst_b = src_a + imm
+    POST   = 2 # dst_a = src_a, dst_b = src_a + imm
+
+
+class Uop(data.Struct):
+    kind:   UopKind
+    mode:   AgenMode
+    size:   Length
+    opcode: Opcode
+    step:   1 # second ALU micro-op of the instruction
+    last:   1 # last micro-op of the instruction
+    src_a:  5
+    src_b:  5
+    src_c:  5
+    dst_a:  5
+    dst_b:  5
+    imm:    32
+
+
+# Register fields a micro-op doesn't use are ZERO, so they never look like a dependency
+UNUSED = {field: REGISTER_ZERO for field in ("src_a", "src_b", "src_c", "dst_a", "dst_b")}
+
+
+# Operand access kinds as in Opcode._data(), 0 for no operand
+ACCESS_CODES = {"r": 1, "w": 2, "m": 3, "a": 4, "v": 5, "b": 6, "i": 7}
+
+
+@lru_cache(maxsize=None)
+def access_rom_init():
+    # Operand access kinds, three bits per operand, addressed like OpcodeAttributes
+    table = Opcode.table()
+    init  = [0] * 1024
+    for row, opcode in enumerate(table.opcodes):
+        word = 0
+        for operand in range(MAX_OPERANDS):
+            kind = table.access[row * MAX_OPERANDS + operand]
+            if kind != "-":
+                word |= ACCESS_CODES[kind] << (3 * operand)
+        init[OpcodeAttributes.address(opcode)] = word
+    return tuple(init)
+
+
+class Cracker(Elaboratable):
+    # The instruction side mirrors the VaxDecoder outputs (see connect()), the micro-op side is
+    # the read end of a `depth` entry FIFO.
+    def __init__(self, depth=16):
+        self.depth = depth
+
+        self.i_valid  = Signal()
+        self.o_ready  = Signal()
+        self.i_pc     = Signal(32)
+        self.i_opcode = Signal(Opcode)
+        self.i_length = Signal(8)
+        self.i_count  = Signal(range(MAX_OPERANDS + 1))
+        self.i_spec   = [Signal(16, name=f"i_spec{operand + 1}") for operand in range(MAX_OPERANDS)]
+        self.i_immed  = [Signal(32, name=f"i_immed{operand + 1}") for operand in range(MAX_OPERANDS)]
+        self.i_end    = [Signal(8, name=f"i_end{operand + 1}") for operand in range(MAX_OPERANDS)]
+
+        self.o_valid = Signal()
+        self.i_ready = Signal()
+        self.o_uop   = Signal(Uop)
+
+    def connect(self, decoder):
+        # Statements feeding this from a single issue VaxDecoder
+        if decoder.issue != 1:
+            raise ValueError("Cracker takes one instruction at a time, connect it to a single issue VaxDecoder")
+        return [
+            self.i_valid.eq(decoder.o_valid),
+            decoder.i_ready.eq(self.o_ready),
+            self.i_pc.eq(decoder.o_pc),
+            self.i_opcode.eq(decoder.o_opcode),
+            self.i_length.eq(decoder.o_length),
+            self.i_count.eq(decoder.o_count),
+            *(spec.eq(source) for spec, source in zip(self.i_spec, decoder.o_spec)),
+            *(immed.eq(source) for immed, source in zip(self.i_immed, decoder.o_immed)),
+            *(end.eq(source) for end, source in zip(self.i_end, decoder.o_end)),
+        ]
+
+    def elaborate(self, platform):
+        m = Module()
+
+        m.submodules.fifo = fifo = SyncFIFOBuffered(width=Shape.cast(Uop).width, depth=self.depth)
+        m.d.comb += [
+            self.o_valid.eq(fifo.r_rdy),
+            self.o_uop.eq(fifo.r_data),
+            fifo.r_en.eq(self.i_ready),
+        ]
+
+        # The instruction being cracked
+        busy   = Signal()
+        pc     = Signal(32)
+        opcode = Signal(16)
+        length = Signal(8)
+        count  = Signal.like(self.i_count)
+        specs  = [Signal(16, name=f"spec{operand + 1}") for operand in range(MAX_OPERANDS)]
+        immeds = [Signal(32, name=f"immed{operand + 1}") for operand in range(MAX_OPERANDS)]
+        ends   = [Signal(8, name=f"end{operand + 1}") for operand in range(MAX_OPERANDS)]
+
+        m.submodules.attributes = attributes = OpcodeAttributes()
+        access_rom = Memory(width=3 * MAX_OPERANDS, depth=1024, init=access_rom_init())
+        m.submodules.access_rd = access_rd = access_rom.read_port(domain="comb")
+        is_extended = opcode[:8].matches(Opcode.EXOPFD, Opcode.EXOPFE, Opcode.EXOPFF)
+        m.d.comb += [
+            attributes.i_opcode.eq(opcode),
+            access_rd.addr.eq(Mux(is_extended, Cat(opcode[8:16], opcode[0:2]), opcode[0:8])),
+        ]
+        operlens = [attributes.o_operlen1, attributes.o_operlen2, attributes.o_operlen3,
+                    attributes.o_operlen4, attributes.o_operlen5, attributes.o_operlen6]
+
+        slots   = [] # (needed, uop) in issue order
+        stores  = []
+        sources = [] # (is source, register) per operand
+        dests   = []
+        for n in range(MAX_OPERANDS):
+            spec, immed, oplen = specs[n], immeds[n], operlens[n]
+            access = access_rd.data[3 * n:3 * n + 3]
+
+            is_indexed = spec[4:8] == 0x4
+            base_spec  = Mux(is_indexed, spec[8:16], spec[0:8])
+            mode       = base_spec[4:8]
+            register   = base_spec[0:4]
+            is_pc      = register == REGISTER_PC
+
+            is_literal     = ~is_indexed & (mode[2:4] == 0)
+            is_register    = mode == 0x5
+            is_regdeferred = mode == 0x6
+            is_autodec     = mode == 0x7
+            is_autoinc     = (mode == 0x8) & ~is_pc
+            is_immediate   = (mode == 0x8) & is_pc
+            is_autoinc_def = (mode == 0x9) & ~is_pc
+            is_absolute    = (mode == 0x9) & is_pc
+            is_disp        = mode >= 0xA
+            is_disp_def    = is_disp & mode[0]
+            is_pc_relative = is_disp & is_pc
+
+            present   = n < count
+            reads     = (access == ACCESS_CODES["r"]) | (access == ACCESS_CODES["m"])
+            writes    = (access == ACCESS_CODES["w"]) | (access == ACCESS_CODES["m"])
+            addresses = (access == ACCESS_CODES["a"]) | (access == ACCESS_CODES["v"])
+            inline    = (access == ACCESS_CODES["b"]) | (access == ACCESS_CODES["i"])
+            constant  = inline | is_literal | is_immediate
+            memory    = present & ~constant & ~is_register
+
+            value   = value_temp(n)
+            address = Mux(is_regdeferred & ~is_indexed, register, address_temp(n))
+
+            base = Signal(Uop, reset=UNUSED, name=f"base{n + 1}")
+            m.d.comb += [
+                base.kind.eq(Mux(is_absolute, UopKind.IMM, UopKind.AGEN)),
+                base.mode.eq(Mux(is_autodec, AgenMode.PRE, Mux(is_autoinc | is_autoinc_def, AgenMode.POST, AgenMode.OFFSET))),
+                base.size.eq(Length.LONG),
+                base.src_a.eq(Mux(is_pc_relative | is_absolute, REGISTER_ZERO, register)),
+                base.dst_a.eq(address_temp(n)),
+                base.dst_b.eq(Mux(is_autodec | is_autoinc | is_autoinc_def, register, REGISTER_ZERO)),
+                # autoincrement deferred steps over a pointer, whatever the operand size
+                base.imm.eq(Mux(is_autoinc_def, 4, Mux(is_pc_relative, immed + pc + ends[n], immed))),
+            ]
+
+            deref = Signal(Uop, reset=UNUSED, name=f"deref{n + 1}")
+            m.d.comb += [
+                deref.kind.eq(UopKind.LOAD),
+                deref.size.eq(Length.LONG),
+                deref.src_a.eq(address_temp(n)),
+                deref.dst_a.eq(address_temp(n)),
+            ]
+
+            index = Signal(Uop, reset=UNUSED, name=f"index{n + 1}")
+            m.d.comb += [
+                index.kind.eq(UopKind.AGEN),
+                index.mode.eq(AgenMode.OFFSET),
+                index.size.eq(oplen),
+                index.src_a.eq(Mux(is_regdeferred, register, address_temp(n))),
+                index.src_b.eq(spec[0:4]),
+                index.dst_a.eq(address_temp(n)),
+            ]
+
+            load = Signal(Uop, reset=UNUSED, name=f"value{n + 1}")
+            m.d.comb += [
+                load.kind.eq(Mux(constant, UopKind.IMM, UopKind.LOAD)),
+                load.size.eq(oplen),
+                load.src_a.eq(Mux(constant, REGISTER_ZERO, address)),
+                load.dst_a.eq(value),
+                load.imm.eq(immed),
+            ]
+
+            store = Signal(Uop, reset=UNUSED, name=f"store{n + 1}")
+            m.d.comb += [
+                store.kind.eq(UopKind.STORE),
+                store.size.eq(oplen),
+                store.src_a.eq(address),
+                store.src_b.eq(value),
+            ]
+
+            slots += [
+                (memory & ~is_regdeferred, base),
+                (memory & (is_autoinc_def | is_disp_def), deref),
+                (memory & is_indexed, index),
+                (present & (constant | (memory & reads)), load),
+            ]
+            stores.append((memory & writes, store))
+
+            sources.append((
+                present & (reads | addresses | inline),
+                Mux(is_register, register, Mux(addresses & memory, address, value)),
+            ))
+            dests.append((present & writes, Mux(is_register, register, value)))
+
+        # The operation: operand values are packed into the source and destination fields in
+        # operand order, spilling into a second micro-op
+        def ranks(operands):
+            result = []
+            for n, (used, _) in enumerate(operands):
+                rank = Signal(range(MAX_OPERANDS + 1), name=f"rank{n + 1}")
+                m.d.comb += rank.eq(sum(Cat(previous for previous, _ in operands[:n])) if n else 0)
+                result.append(rank)
+            return result
+
+        def pack(operands, operand_ranks, position):
+            picked = [Mux(used & (rank == position), register, 0) for (used, register), rank in zip(operands, operand_ranks)]
+            found  = Cat(used & (rank == position) for (used, _), rank in zip(operands, operand_ranks)).any()
+            return Mux(found, _or_tree(picked), REGISTER_ZERO)
+
+        source_ranks = ranks(sources)
+        dest_ranks   = ranks(dests)
+        n_sources    = sum(Cat(used for used, _ in sources))
+        n_dests      = sum(Cat(used for used, _ in dests))
+
+        for step in range(2):
+            alu = Signal(Uop, reset=UNUSED, name=f"alu{step + 1}")
+            m.d.comb += [
+                alu.kind.eq(UopKind.ALU),
+                alu.opcode.eq(opcode),
+                alu.size.eq(attributes.o_operlen1),
+                alu.step.eq(step),
+                alu.src_a.eq(pack(sources, source_ranks, 3 * step)),
+                alu.src_b.eq(pack(sources, source_ranks, 3 * step + 1)),
+                alu.src_c.eq(pack(sources, source_ranks, 3 * step + 2)),
+                alu.dst_a.eq(pack(dests, dest_ranks, 2 * step)),
+                alu.dst_b.eq(pack(dests, dest_ranks, 2 * step + 1)),
+                alu.imm.eq(pc + length),
+            ]
+            slots.append((C(1) if step == 0 else (n_sources > 3) | (n_dests > 2), alu))
+        slots += stores
+
+        # Issue the first micro-op still to go, one per cycle
+        needed  = Signal(len(slots))
+        issued  = Signal(len(slots))
+        pending = Signal(len(slots))
+        chosen  = Signal(range(len(slots)))
+        m.d.comb += [
+            needed.eq(Cat(need for need, _ in slots)),
+            pending.eq(Mux(busy, needed & ~issued, 0)),
+        ]
+        for index in reversed(range(len(slots))):
+            with m.If(pending[index]):
+                m.d.comb += chosen.eq(index)
+
+        uop  = Signal(Uop)
+        last = Signal()
+        with m.Switch(chosen):
+            for index, (_, slot) in enumerate(slots):
+                with m.Case(index):
+                    m.d.comb += [
+                        uop.eq(slot),
+                        uop.opcode.eq(opcode),
+                        last.eq((pending >> (index + 1)) == 0),
+                    ]
+        m.d.comb += uop.last.eq(last)
+
+        push = busy & fifo.w_rdy
+        m.d.comb += [
+            fifo.w_data.eq(uop),
+            fifo.w_en.eq(push),
+            self.o_ready.eq(~busy | (push & last)),
+        ]
+        with m.If(push):
+            m.d.sync += issued.eq(issued | (C(1, len(slots)) << chosen))
+            with m.If(last):
+                m.d.sync += busy.eq(0)
+
+        with m.If(self.i_valid & self.o_ready):
+            m.d.sync += [
+                busy.eq(1),
+                issued.eq(0),
+                pc.eq(self.i_pc),
+                opcode.eq(self.i_opcode),
+                length.eq(self.i_length),
+                count.eq(self.i_count),
+            ]
+            m.d.sync += [spec.eq(source) for spec, source in zip(specs, self.i_spec)]
+            m.d.sync += [immed.eq(source) for immed, source in zip(immeds, self.i_immed)]
+            m.d.sync += [end.eq(source) for end, source in zip(ends, self.i_end)]
+
+        return m
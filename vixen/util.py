@@ -6,3 +6,4 @@ class Length(Enum):
     WORD = 1
     LONG = 2
     QUAD = 3
+    OCTA = 4